@@ -22,6 +22,16 @@ class Card(object):
     def decode_json(obj):
         return Card(**obj)
 
+    @staticmethod
+    def getClassState():
+        # The sets, types, type names and bonus_regex of the language the cards were last read in,
+        # to put back with setClassState when drawing cards read earlier
+        return Card.sets, Card.types, Card.type_names, Card.bonus_regex
+
+    @staticmethod
+    def setClassState(state):
+        Card.sets, Card.types, Card.type_names, Card.bonus_regex = state
+
     def __init__(self, name=None, cardset='', types=None, cost='', description='',
                  potcost=0, debtcost=0, extra='', count=-1, card_tag='missing card_tag',
                  cardset_tags=None, group_tag='', group_top=False, image=None,
@@ -1,21 +1,146 @@
 from __future__ import print_function
 
+import argparse
+import atexit
+import contextlib
+import hashlib
+import json
+import multiprocessing
 import os
 import re
+import shutil
 import sys
+import tempfile
+import threading
+from collections import Counter, OrderedDict, namedtuple
 
 import pkg_resources
 
+import reportlab
+from reportlab import rl_config
 from reportlab.lib.units import cm
 from reportlab.pdfbase import pdfmetrics
-from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.platypus import Paragraph, XPreformatted
 from reportlab.lib.enums import TA_JUSTIFY, TA_CENTER, TA_LEFT
 from reportlab.pdfgen import canvas
 from reportlab.pdfbase.ttfonts import TTFont
 from reportlab.pdfbase.pdfmetrics import stringWidth
+from . import __version__
+from . import fitcache
+from . import resample
 from .cards import Card
 
+# What drawTab and drawText need to know about a card, worked out once for each card by
+# DividerDrawer.resolveCard before any drawing, instead of for every side of every divider.
+CardRender = namedtuple('CardRender', [
+    'name', 'upper_name', 'cardset', 'types_name',
+    'cost', 'potcost', 'debtcost',
+    'count', 'card_count',  # the counts for the card count icons and their total
+    'is_blank', 'is_expansion', 'centre_tab',
+    'set_image', 'text_icon',  # only looked up if they are drawn
+    'tab_image', 'tab_text_offset', 'tab_cost_offset',
+    'tab_cost', 'tab_text_inset', 'tab_text_inset_right',  # cost on the tab, space left and right of the name
+    'tab_font_size', 'tab_name_lines', 'tab_name_too_long',  # the name fitted to the tab
+    'tab_name_widths',  # width of each of the tab_name_lines at tab_font_size
+    'wrapper_name_width',  # width of the name on the top edge of a wrapper
+    'description', 'extra',  # text with the inline text (bonuses, <line>, alignment) resolved
+])
+
+# How the text of one side of a divider fits into its box, worked out by DividerDrawer.layoutText
+TextLayout = namedtuple('TextLayout', ['font_size', 'leading', 'spacer_height'])
+
+# The sizes of the dividers, how many of them go on a page and the page margins, worked out by
+# DividerDrawer.calculateGrid.  A plan only depends on the options in DividerDrawer.LAYOUT_OPTIONS (and for
+# wrappers on the stack heights), so the plans are kept in DividerDrawer.layoutPlans for all drawers to share.
+LayoutPlan = namedtuple('LayoutPlan', [
+    'dominionCardWidth', 'dominionCardHeight', 'paperwidth', 'paperheight',  # paper swapped for landscape
+    'minmarginwidth', 'minmarginheight', 'fixedMargins', 'rotate', 'spin',
+    'dividerWidth', 'dividerBaseHeight', 'dividerHeight', 'labelWidth', 'labelHeight',
+    'dividerWidthReserved', 'dividerHeightReserved', 'verticalBorderSpace', 'horizontalBorderSpace',
+    'numDividersHorizontal', 'numDividersVertical', 'gridDividersPerPage',
+    'minHorizontalMargin', 'minVerticalMargin', 'horizontalMargin', 'verticalMargin',
+    'packHeight',  # None unless the wrappers are packed
+])
+
+
+class StreamEncoding(object):
+    # Whether reportlab ASCII85 encodes the streams of a PDF is only the process wide rl_config.useA85,
+    # it can't be set for a canvas.  Drawers that want the same encoding can draw at the same time,
+    # one that wants the other waits until they are done.  The setting is put back after the last one.
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.users = 0
+        self.default = None  # rl_config.useA85 as it was before the drawers changed it
+
+    @contextlib.contextmanager
+    def use(self, useA85=None):
+        # Draw with useA85 (None for what rl_config has) while in the with block
+        with self.condition:
+            while True:
+                if not self.users:
+                    self.default = rl_config.useA85
+                wanted = self.default if useA85 is None else useA85
+                if not self.users or rl_config.useA85 == wanted:
+                    break
+                self.condition.wait()
+            rl_config.useA85 = wanted
+            self.users += 1
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.users -= 1
+                if not self.users:
+                    rl_config.useA85 = self.default
+                    self.condition.notify_all()
+
+
+class LRUCache(object):
+    # A process wide cache of at most maxsize entries, dropping the least recently used one when it is full,
+    # so that a long running process (a server, the gallery) doesn't keep every layout or selection it saw.
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key not in self.entries:
+                return default
+            value = self.entries.pop(key)
+            self.entries[key] = value  # now the most recently used
+            return value
+
+    def __setitem__(self, key, value):
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = value
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+def layoutTexts(args):
+    # Lay out the texts of a list of textJobs in a worker process of DividerDrawer.layoutDividers.
+    # Everything the layout needs comes with the jobs, so the worker does not rely on state inherited
+    # from the parent process (like Card.types, Card.sets and the tab size of CardPlot).
+    options, imageSizes, jobs = args
+    drawer = DividerDrawer(options)
+    drawer.imageSizes = imageSizes
+    return [drawer.layoutText(job)[0] for job in jobs]
+
 
 def split(l, n):
     i = 0
@@ -105,6 +230,7 @@ class CardPlot(object):
         self.cropOnBottom = cropOnBottom  # When true, cropmarks needed along BOTTOM *printed* edge of the card
         self.cropOnLeft = cropOnLeft  # When true, cropmarks needed along LEFT *printed* edge of the card
         self.cropOnRight = cropOnRight  # When true, cropmarks needed along RIGHT *printed* edge of the card
+        self.render = None  # CardRender of the card, set by DividerDrawer.resolveCards
 
         # And figure out the backside index
         if self.tabIndex == 0:
@@ -165,9 +291,9 @@ class CardPlot(object):
         else:
             return self.tabOffset
 
-    def nextTab(self, tab=None):
+    @staticmethod
+    def nextTab(tab):
         # For a given tab, calculate the next tab in the sequence
-        tab = tab if tab is not None else self.tabIndex
         if CardPlot.tabNumber == 1:
             return 1  # it is the same, nothing else to do
 
@@ -218,6 +344,19 @@ class CardPlot(object):
         # and set up the canvas so that (0,0) is now at the lower lower left of the item
         # and the item can be drawn as if it is in the "standard" orientation.
         # So when done, the canvas is set and ready to draw the divider
+        x, y, rotation = self.pagePosition(page_width, backside)
+        canvas.translate(x, y)
+        canvas.rotate(rotation)
+
+    def pageMatrix(self, page_width, backside=False, x0=0, y0=0):
+        # The (a, b, c, d, e, f) matrix that translate sets up on a canvas already moved to x0, y0 (the margins):
+        # a point x, y of the item is at a * x + c * y + e, b * x + d * y + f on the page
+        x, y, rotation = self.pagePosition(page_width, backside)
+        cos, sin = {0: (1, 0), 90: (0, 1), 180: (-1, 0), 270: (0, -1)}[rotation % 360]
+        return (cos, sin, -sin, cos, x0 + x, y0 + y)
+
+    def pagePosition(self, page_width, backside=False):
+        # The page x,y the lower left of the item is moved to, and the rotation around it, for translate
         x = self.x
         y = self.y
         rotation = self.rotation
@@ -249,8 +388,22 @@ class CardPlot(object):
                 x += height
 
         rotation = 360 - rotation % 360  # ReportLab rotates counter clockwise, not clockwise.
-        canvas.translate(x, y)
-        canvas.rotate(rotation)
+        return x, y, rotation
+
+    def fingerprintData(self, position=True, cropmarks=True):
+        # Everything that goes into drawing this divider: the card, its set and type information,
+        # the tab settings and (optionally) the placement on the page and the cropmarks.
+        # Used to spot dividers that have not changed.
+        card = self.card
+        return [Card.CardJSONEncoder(sort_keys=True).encode(card),
+                Card.sets.get(card.cardset_tag) if Card.sets else None,
+                card.getType().__dict__,
+                [self.x, self.y, self.page] if position else None,
+                [self.rotation, self.stackHeight],
+                [self.tabIndex, self.tabIndexBack, self.tabOffset, self.tabOffsetBack, self.closestSide],
+                [self.textTypeFront, self.textTypeBack],
+                [self.cropOnTop, self.cropOnBottom, self.cropOnLeft, self.cropOnRight] if cropmarks else None,
+                [self.cardWidth, self.cardHeight, self.tabWidth, self.tabHeight, self.lineType, self.wrapper]]
 
     def translateCropmarkEnable(self, side):
         # Returns True if a cropmark is needed on that side of the card
@@ -298,12 +451,22 @@ class Plotter(object):
     # one point to the next.  The default plotting in reportlab requires both
     # ends of the line in absolute sense.  Thus calculations can become increasingly more
     # complicated given various options.  Using this object simplifies the calculations significantly.
+    # With usePath, the lines and dots are collected in a single path that is drawn with one stroke
+    # by stroke(), rather than each drawn on its own.
+    # Given a set as marks, cropmarks are not drawn but added to it as lines in page coordinates,
+    # with matrix (see CardPlot.pageMatrix) taking the plotted points to the page.
 
-    def __init__(self, canvas, x=0, y=0, cropmarkLength=-1, cropmarkSpacing=-1):
+    def __init__(self, canvas, x=0, y=0, cropmarkLength=-1, cropmarkSpacing=-1, usePath=False, marks=None,
+                 matrix=(1, 0, 0, 1, 0, 0)):
         self.canvas = canvas
         self.x = x
         self.y = y
-        self.LEFT, self.RIGHT, self.TOP, self.BOTTOM, self.LINE, self.NO_LINE, self.DOT = range(1, 8)  # Constants
+        self.usePath = usePath
+        self.path = None
+        self.pathXY = None  # end of the path so far, to continue it without a move
+        self.marks = marks
+        self.matrix = matrix
+        self.LEFT, self.RIGHT, self.TOP, self.BOTTOM, self.LINE, self.NO_LINE, self.DOT, self.MARK = range(1, 9)
         if cropmarkLength < 0:
             cropmarkLength = 0.2
         if cropmarkSpacing < 0:
@@ -331,10 +494,27 @@ class Plotter(object):
         x, y = self.getXY()  # get current point
         new_x = x + delta_x  # calculate new point from delta
         new_y = y + delta_y
-        if pen == self.LINE:
-            self.canvas.line(x, y, new_x, new_y)
-        if pen == self.DOT:
-            self.canvas.circle(new_x, new_y, self.DotSize)
+        if pen == self.MARK:
+            if self.marks is not None:
+                self.marks.add(self.pageLine(x, y, new_x, new_y))
+                pen = self.NO_LINE
+            else:
+                pen = self.LINE
+        if self.usePath:
+            if pen == self.LINE:
+                path = self.getPath()
+                if self.pathXY != (x, y):
+                    path.moveTo(x, y)
+                path.lineTo(new_x, new_y)
+                self.pathXY = (new_x, new_y)
+            if pen == self.DOT:
+                self.getPath().circle(new_x, new_y, self.DotSize)
+                self.pathXY = None
+        else:
+            if pen == self.LINE:
+                self.canvas.line(x, y, new_x, new_y)
+            if pen == self.DOT:
+                self.canvas.circle(new_x, new_y, self.DotSize)
         self.setXY(new_x, new_y)  # save the new point
 
         # Make sure cropmarks is a list
@@ -355,6 +535,25 @@ class Plotter(object):
             if direction in self.CropEnable:
                 self.cropmark(direction, enable)
 
+    def pageLine(self, x0, y0, x1, y1):
+        # The line between the two points in page coordinates, rounded so that the same line
+        # from different dividers compares equal
+        a, b, c, d, e, f = self.matrix
+        points = [(round(a * x + c * y + e, 3), round(b * x + d * y + f, 3)) for x, y in [(x0, y0), (x1, y1)]]
+        return tuple(sorted(points))
+
+    def getPath(self):
+        if self.path is None:
+            self.path = self.canvas.beginPath()
+        return self.path
+
+    def stroke(self):
+        # Draw the path collected so far (with the current stroke settings) and start a new one
+        if self.path is not None:
+            self.canvas.drawPath(self.path, stroke=1, fill=0)
+        self.path = None
+        self.pathXY = None
+
     def cropmark(self, direction, enabled=False):
         # From current point, draw a cropmark in the correct direction and return to starting point
         if enabled:
@@ -362,41 +561,218 @@ class Plotter(object):
 
             if direction == self.TOP:
                 self.plot(0, self.CropMarkSpacing)
-                self.plot(0, self.CropMarkLength, self.LINE)
+                self.plot(0, self.CropMarkLength, self.MARK)
             if direction == self.BOTTOM:
                 self.plot(0, -self.CropMarkSpacing)
-                self.plot(0, -self.CropMarkLength, self.LINE)
+                self.plot(0, -self.CropMarkLength, self.MARK)
             if direction == self.RIGHT:
                 self.plot(self.CropMarkSpacing, 0)
-                self.plot(self.CropMarkLength, 0, self.LINE)
+                self.plot(self.CropMarkLength, 0, self.MARK)
             if direction == self.LEFT:
                 self.plot(-self.CropMarkSpacing, 0)
-                self.plot(-self.CropMarkLength, 0, self.LINE)
+                self.plot(-self.CropMarkLength, 0, self.MARK)
             self.setXY(x, y)  # Restore to starting point
 
 
 class DividerDrawer(object):
+    # Options that have no effect on how the divider pages look
+    # (the card selection options show up in the cards on each page instead)
+    NON_DRAWING_OPTIONS = ['outfile', 'argv', 'help', 'incremental', 'num_pages', 'preview', 'write_json',
+                           'expansions', 'fan', 'layout_only', 'card_database', 'layout_workers', 'fit_cache',
+                           'thumbnails', 'thumbnail_dpi', 'thumbnail_sprite', 'thumbnail_workers']
+    # Options the LayoutPlan depends on
+    LAYOUT_OPTIONS = ['dominionCardWidth', 'dominionCardHeight', 'paperwidth', 'paperheight',
+                      'minmarginwidth', 'minmarginheight', 'orientation', 'rotate', 'label', 'tab_side', 'tabwidth',
+                      'vertical_gap', 'horizontal_gap', 'wrapper', 'pack_wrappers', 'no_page_footer', 'order']
+    # Options the tabs of the dividers depend on, besides the cards (see tabPlan)
+    TAB_OPTIONS = ['tab_number', 'tab_side', 'tab_serpentine', 'expansion_dividers', 'expansion_reset_tabs',
+                   'centre_expansion_dividers']
+    FOOTER_RESERVE = 12  # room for the page footer below packed wrappers
+    TEXT_HORIZONTAL_MARGIN = .5 * cm  # between the edges of the divider and its text
+    TEXT_VERTICAL_MARGIN = .3 * cm
+    resampledImages = LRUCache(512)  # (file name, dpi, drawn size) -> resampled copy, shared by all drawers
+    resampleDir = None
+    variantSizes = {}  # prebuilt image variant -> pixel size
+    layoutPlans = LRUCache(64)  # LAYOUT_OPTIONS and stack heights -> LayoutPlan, shared by all drawers
+    streamEncoding = StreamEncoding()  # rl_config.useA85 for all drawers in the process
+
     def __init__(self, options=None):
         self.canvas = None
         self.pages = None
         self.options = options
+        self.layoutOptions = None  # the options given to the drawer, before the LayoutPlan was added to its copy
+        self.plan = None  # the LayoutPlan of the options
+        self.previousPages = None  # fingerprint -> page of the previous output, when incremental
+        self.pageFingerprints = []
+        self.dividerKeys = {}  # (CardPlot id, isBack) -> content fingerprint, for dividers drawn more than once
+        self.dividerForms = set()  # names of the dividers already drawn as forms
+        self.cropmarkForms = {}  # cropmarks of a page -> name of the form they were drawn in
+        self.gridDividersPerPage = None  # dividers per page without packing the wrappers
+        self.outputSize = None
+        self.baseStyles = None  # the reportlab sample stylesheet, built on first use
+        self.paragraphStyles = {}  # (base, font, alignment, size, leading) -> style, see paragraphStyle
+        self.textLayouts = {}  # textJob -> TextLayout
+        self.fontFiles = []  # the ttf files of the fonts, if they are used
+        self.fitCache = None  # the FitCache of --fit-cache
+        self.pageCardState = None  # Card.getClassState of each page, if they differ (see calculateSectionPages)
+        self.imageSizes = None  # image file -> drawn size, given to layout workers instead of imageDrawSizes
 
     @staticmethod
-    def get_image_filepath(fname):
+    def get_image_filepath(fname, dpi=None, size=None):
+        # With a resolution and the size (in points) the image is drawn at, pick the smallest of
+        # the prebuilt variants (see resample.py) that is still good enough, if there is one.
+        if dpi and size:
+            return resample.select_variant(pkg_resources.resource_filename('domdiv', 'images'), fname, dpi, size,
+                                           DividerDrawer.variantSizes)
         return pkg_resources.resource_filename('domdiv', os.path.join('images', fname))
 
+    @staticmethod
+    def imageDrawSizes():
+        # The drawn sizes of the tab banners and set icons, the images that are not drawn at resample.ICON_SIZE
+        sizes = {t.getTabImageFile(): (CardPlot.tabWidth - 2, CardPlot.tabHeight - 1) for t in Card.types.values()}
+        for s in Card.sets.values():
+            if s.get('image'):
+                sizes.setdefault(s['image'], resample.SET_ICON_SIZE)
+        return sizes
+
+    def imageDrawSize(self, fname):
+        # The largest size (in points) an image file is drawn at in this document
+        sizes = self.imageSizes if self.imageSizes is not None else self.imageDrawSizes()
+        if fname in sizes:
+            return sizes[fname]
+        if fname.endswith('_set.png'):
+            return resample.SET_ICON_SIZE
+        return resample.ICON_SIZE
+
+    def imagePath(self, fname):
+        # The image file to embed for fname.  With --image-dpi this is the best prebuilt variant,
+        # or else a copy resampled down to that resolution at the largest size the image is drawn at.
+        # Every use of a file in a document gets the same path, so reportlab embeds each image only once.
+        dpi = self.options.image_dpi
+        if not dpi or dpi <= 0:
+            return DividerDrawer.get_image_filepath(fname)
+
+        size = self.imageDrawSize(fname)
+        key = (fname, dpi, size)
+        path = DividerDrawer.resampledImages.get(key)
+        if path is None:
+            path = self.resampleImage(DividerDrawer.get_image_filepath(fname, dpi, size), dpi, size)
+            DividerDrawer.resampledImages[key] = path
+        return path
+
+    @staticmethod
+    def resampleImage(path, dpi, size):
+        if DividerDrawer.resampleDir is None:
+            DividerDrawer.resampleDir = tempfile.mkdtemp(prefix='domdiv-images-')
+            atexit.register(shutil.rmtree, DividerDrawer.resampleDir, True)
+        resampled = os.path.join(DividerDrawer.resampleDir, '{}-{}dpi-{:.0f}x{:.0f}.png'.format(
+            os.path.splitext(os.path.basename(path))[0], dpi, size[0], size[1]))
+        if resample.resample_image(path, resampled, size, dpi):
+            return resampled
+        return path
+
     def draw(self, cards=[], options=None):
         if options is not None:
+            # New options: the pages are laid out again from them and the cards
             self.options = options
+            self.layoutOptions = None
+            self.plan = None
+            self.pages = None
+            self.pageCardState = None
 
         self.registerFonts()
-        self.canvas = canvas.Canvas(
-            self.options.outfile,
-            pagesize=(self.options.paperwidth, self.options.paperheight))
-        self.drawDividers(cards)
-        if self.options.info or self.options.info_all:
-            self.drawInfo()
-        self.canvas.save()
+        if self.options.fit_cache:
+            self.fitCache = fitcache.FitCache(self.options.fit_cache,
+                                              fitcache.font_hash(self.fontFiles, [reportlab.Version]))
+        if self.options.incremental:
+            self.loadPreviousPages()
+        # --optimize-size: binary streams instead of the 25% larger ASCII85 encoded ones
+        with DividerDrawer.streamEncoding.use(0 if self.options.optimize_size else None):
+            self.canvas = canvas.Canvas(
+                self.options.outfile,
+                pagesize=(self.options.paperwidth, self.options.paperheight),
+                pageCompression=0 if self.options.no_page_compression else 1)
+            self.drawDividers(cards)
+            if self.options.info or self.options.info_all:
+                self.drawInfo()
+            self.canvas.save()
+        if hasattr(self.options.outfile, 'getvalue'):
+            self.outputSize = len(self.options.outfile.getvalue())
+        elif not hasattr(self.options.outfile, 'write'):
+            self.outputSize = os.path.getsize(self.options.outfile)
+        if self.previousPages is not None:
+            self.saveManifest()
+        if self.fitCache is not None:
+            self.fitCache.save()
+
+    def manifestPath(self):
+        return os.path.splitext(self.options.outfile)[0] + '.pages.json'
+
+    def loadPreviousPages(self):
+        # For incremental generation: find the pages of the last output of this file,
+        # indexed by their fingerprint, so unchanged pages can be copied instead of drawn again.
+        self.previousPages = None
+        self.pageFingerprints = []
+        if hasattr(self.options.outfile, 'write'):
+            print("Warning, incremental generation needs an output file name, drawing all pages.", file=sys.stderr)
+            return
+        try:
+            from pdfrw import PdfReader
+        except ImportError:
+            print("Warning, incremental generation needs the pdfrw package, drawing all pages.", file=sys.stderr)
+            return
+
+        self.previousPages = {}
+        manifest_path = self.manifestPath()
+        if not (os.path.exists(manifest_path) and os.path.exists(self.options.outfile)):
+            return
+        with open(manifest_path) as manifest_file:
+            manifest = json.load(manifest_file)
+        if manifest.get('version') != __version__:
+            return
+        # PdfReader reads the whole file, so it is safe to overwrite it afterwards
+        pages = PdfReader(self.options.outfile).pages
+        if len(pages) < len(manifest['pages']):
+            return
+        for page, fingerprint in zip(pages, manifest['pages']):
+            self.previousPages[fingerprint] = page
+
+    def saveManifest(self):
+        reused = len([f for f in self.pageFingerprints if f in self.previousPages])
+        print("Reused {} of {} pages from the previous output".format(reused, len(self.pageFingerprints)))
+        with open(self.manifestPath(), 'w') as manifest_file:
+            json.dump({'version': __version__, 'pages': self.pageFingerprints}, manifest_file)
+
+    def drawingFingerprint(self):
+        # The options, fonts and text settings shared by every page
+        settings = dict((key, value) for key, value in vars(self.options).items()
+                        if key not in self.NON_DRAWING_OPTIONS)
+        return [__version__, settings, self.font_mapping, Card.bonus_regex]
+
+    def dividerFingerprint(self, item, isBack):
+        # cropmarks are drawn for the whole page, not with each divider
+        data = json.dumps([item.fingerprintData(position=False, cropmarks=False), isBack],
+                          sort_keys=True, default=repr)
+        return 'divider' + hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+    def findRepeatedDividers(self, sides, pages=None):
+        # Find the dividers that get drawn more than once in this document (same card, tab, text and outline).
+        # These get drawn into a form the first time, and each later copy just places that form.
+        keys = {}
+        counts = Counter()
+        for hMargin, vMargin, page in self.pages if pages is None else pages:
+            for item in page:
+                for isBack in sides:
+                    key = self.dividerFingerprint(item, isBack)
+                    keys[(id(item), isBack)] = key
+                    counts[key] += 1
+        self.dividerKeys = dict((k, key) for k, key in keys.items() if counts[key] > 1)
+        self.dividerForms = set()
+
+    def pageFingerprint(self, page, isBack, hMargin, vMargin):
+        data = [self.drawingFingerprint(), isBack, hMargin, vMargin] + [item.fingerprintData() for item in page]
+        data = json.dumps(data, sort_keys=True, default=lambda o: sorted(o) if isinstance(o, set) else repr(o))
+        return hashlib.sha1(data.encode('utf-8')).hexdigest()
 
     def registerFonts(self):
         # the following are filenames from both an Adobe Reader install and a download from fontsgeek
@@ -407,6 +783,7 @@ class DividerDrawer(object):
                          'Minion Pro Bold.ttf',
                          'Minion Pro Italic.ttf']
         # first figure out which, if any, are present
+        self.fontFiles = []
         fontpaths = [os.path.join('fonts', fname) for fname in fontfilenames]
         fontpaths = [fpath for fpath in fontpaths if pkg_resources.resource_exists('domdiv', fpath)]
         self.font_mapping = {'Regular': [fpath for fpath in fontpaths if 'Regular' in fpath],
@@ -420,20 +797,39 @@ class DividerDrawer(object):
                 self.font_mapping = {'Regular': 'Times-Roman',
                                      'Bold': 'Times-Bold',
                                      'Italic': 'Times-Oblique'}
+                self.fontFiles = []
                 break
             else:
                 # and finally register and tag one for each type
+                # (only once per process, parsing the ttf files is expensive)
                 ftag = 'MinionPro-{}'.format(fonttype)
-                pdfmetrics.registerFont(TTFont(ftag,
-                                               pkg_resources.resource_filename('domdiv',
-                                                                               self.font_mapping[fonttype][0])))
+                fontfile = pkg_resources.resource_filename('domdiv', self.font_mapping[fonttype][0])
+                if ftag not in pdfmetrics.getRegisteredFontNames():
+                    pdfmetrics.registerFont(TTFont(ftag, fontfile))
                 self.font_mapping[fonttype] = ftag
+                self.fontFiles.append(fontfile)
         self.font_mapping['Monospaced'] = 'Courier'
 
+    def paragraphStyle(self, fontName, alignment, fontSize=None, leading=None, base='BodyText'):
+        # The base style of the sample stylesheet with the given font, alignment and (if given) size.
+        # The styles are shared by all paragraphs that use them, so they must not be changed; for
+        # another size, ask for that one.
+        if self.baseStyles is None:
+            self.baseStyles = getSampleStyleSheet()
+        parent = self.baseStyles[base]
+        if fontSize is None:
+            fontSize = parent.fontSize
+        if leading is None:
+            leading = parent.leading
+        key = (base, fontName, alignment, fontSize, leading)
+        if key not in self.paragraphStyles:
+            self.paragraphStyles[key] = ParagraphStyle(
+                '{}-{}'.format(base, len(self.paragraphStyles)), parent=parent,
+                fontName=fontName, alignment=alignment, fontSize=fontSize, leading=leading)
+        return self.paragraphStyles[key]
+
     def drawTextPages(self, pages, margin=1.0, fontsize=10, leading=10, spacer=0.05):
-        s = getSampleStyleSheet()['BodyText']
-        s.fontName = self.font_mapping['Monospaced']
-        s.alignment = TA_LEFT
+        fontName = self.font_mapping['Monospaced']
 
         textHorizontalMargin = margin * cm
         textVerticalMargin = margin * cm
@@ -442,8 +838,7 @@ class DividerDrawer(object):
         minSpacerHeight = 0.05 * cm
 
         for page in pages:
-            s.fontsize = fontsize
-            s.leading = leading
+            s = self.paragraphStyle(fontName, TA_LEFT, fontsize, leading)
             spacerHeight = spacer * cm
             text = re.split("\n", page)
             while True:
@@ -458,8 +853,7 @@ class DividerDrawer(object):
                 if h <= textBoxHeight or s.fontSize <= 1 or s.leading <= 1:
                     break
                 else:
-                    s.fontSize -= 0.2
-                    s.leading -= 0.2
+                    s = self.paragraphStyle(fontName, TA_LEFT, s.fontSize - 0.2, s.leading - 0.2)
                     spacerHeight = max(spacerHeight - 1, minSpacerHeight)
 
             h = self.options.paperheight - textVerticalMargin
@@ -528,8 +922,11 @@ class DividerDrawer(object):
     def wantCentreTab(self, card):
         return (card.isExpansion() and self.options.centre_expansion_dividers) or self.options.tab_side == "centre"
 
-    def drawOutline(self, item, isBack=False):
+    def drawOutline(self, item, isBack=False, lines=True, cropmarks=True, matrix=(1, 0, 0, 1, 0, 0)):
         # draw outline or cropmarks
+        # lines=False leaves out the outline itself, cropmarks=False the cropmarks,
+        # and a set for cropmarks collects them in page coordinates (with matrix, see CardPlot.pageMatrix)
+        # rather than drawing them
         if isBack and not self.options.cropmarks:
             return
         if self.options.linewidth <= 0.0:
@@ -541,10 +938,15 @@ class DividerDrawer(object):
         if isBack:
             self.canvas.translate(item.cardWidth, 0)
             self.canvas.scale(-1, 1)
+            a, b, c, d, e, f = matrix
+            matrix = (-a, -b, c, d, a * item.cardWidth + e, b * item.cardWidth + f)
 
         plotter = Plotter(self.canvas,
                           cropmarkLength=self.options.cropmarkLength,
-                          cropmarkSpacing=self.options.cropmarkSpacing)
+                          cropmarkSpacing=self.options.cropmarkSpacing,
+                          usePath=True,
+                          marks=cropmarks if isinstance(cropmarks, set) else None,
+                          matrix=matrix)
 
         dividerWidth = item.cardWidth
         dividerHeight = item.cardHeight + item.tabHeight
@@ -559,7 +961,10 @@ class DividerDrawer(object):
         left2tab = left2tab if left2tab > nearZero else 0
         right2tab = right2tab if right2tab > nearZero else 0
 
-        if item.lineType.lower() == 'line':
+        if not lines:
+            lineType = plotter.NO_LINE
+            lineTypeNoDot = plotter.NO_LINE
+        elif item.lineType.lower() == 'line':
             lineType = plotter.LINE
             lineTypeNoDot = plotter.LINE
         elif item.lineType.lower() == 'dot':
@@ -582,10 +987,11 @@ class DividerDrawer(object):
         TOP = plotter.TOP
         NO_LINE = plotter.NO_LINE
 
-        plotter.setCropEnable(RIGHT, self.options.cropmarks and item.translateCropmarkEnable(item.RIGHT))
-        plotter.setCropEnable(LEFT, self.options.cropmarks and item.translateCropmarkEnable(item.LEFT))
-        plotter.setCropEnable(TOP, self.options.cropmarks and item.translateCropmarkEnable(item.TOP))
-        plotter.setCropEnable(BOTTOM, self.options.cropmarks and item.translateCropmarkEnable(item.BOTTOM))
+        cropmarks = self.options.cropmarks and cropmarks is not False
+        plotter.setCropEnable(RIGHT, cropmarks and item.translateCropmarkEnable(item.RIGHT))
+        plotter.setCropEnable(LEFT, cropmarks and item.translateCropmarkEnable(item.LEFT))
+        plotter.setCropEnable(TOP, cropmarks and item.translateCropmarkEnable(item.TOP))
+        plotter.setCropEnable(BOTTOM, cropmarks and item.translateCropmarkEnable(item.BOTTOM))
 
         if not item.wrapper:
             # Normal Card Outline
@@ -748,17 +1154,20 @@ class DividerDrawer(object):
             plotter.plot(0, -body_minus_notches, lineStyle[6])                                    # FF to GG
 
             # Add fold lines
+            foldLine = plotter.LINE if lines else NO_LINE
+            plotter.stroke()
             self.canvas.setStrokeGray(0.9)
             plotter.setXY(left2tab, dividerHeight + stackHeight + dividerBaseHeight)  # ?  to X
-            plotter.plot(theTabWidth, 0, plotter.LINE)                                # X  to S
+            plotter.plot(theTabWidth, 0, foldLine)                                    # X  to S
             plotter.plot(0, stackHeight)                                              # S  to T
-            plotter.plot(-theTabWidth, 0, plotter.LINE)                               # V  to S
+            plotter.plot(-theTabWidth, 0, foldLine)                                   # V  to S
 
             plotter.setXY(notch2, dividerHeight)                                      # ?  to DD
-            plotter.plot(dividerWidth - notch2 - notch3, 0, plotter.LINE)             # DD to L
+            plotter.plot(dividerWidth - notch2 - notch3, 0, foldLine)                 # DD to L
             plotter.plot(0, stackHeight)                                              # L  to M
-            plotter.plot(-dividerWidth + notch2 + notch3, 0, plotter.LINE)            # M  to CC
+            plotter.plot(-dividerWidth + notch2 + notch3, 0, foldLine)                # M  to CC
 
+        plotter.stroke()
         self.canvas.restoreState()
 
     def add_inline_images(self, text, fontsize):
@@ -780,7 +1189,7 @@ class DividerDrawer(object):
                                           '<font size={}>\\1</font>'.format(fontsize * text_fontsize_multiplier),
                                           tag)
                     replace = font_replace + replace
-                replace = replace.format(fpath=DividerDrawer.get_image_filepath(fname),
+                replace = replace.format(fpath=self.imagePath(fname),
                                          width=fontsize * fontsize_multiplier,
                                          height_percent=height_percent)
                 text = text[:match.start() + offset] + replace + text[match.end() + offset:]
@@ -851,14 +1260,14 @@ class DividerDrawer(object):
 
         return text.strip().strip('\n')
 
-    def drawCardCount(self, card, x, y, offset=-1):
+    def drawCardCount(self, render, x, y, offset=-1):
         # Note that this is right justified.
         # x represents the right most for the image (image grows to the left)
-        if card.getCardCount() < 1:
+        if render.card_count < 1:
             return 0
 
-        #  draw_list = [(card.getCardCount(), 1)]
-        draw_list = sorted([(i, card.count.count(i)) for i in set(card.count)])
+        #  draw_list = [(render.card_count, 1)]
+        draw_list = sorted([(i, render.count.count(i)) for i in set(render.count)])
 
         cardIconHeight = y + offset
         countHeight = cardIconHeight - 4
@@ -869,7 +1278,7 @@ class DividerDrawer(object):
             width += 16
             x -= 16
             self.canvas.drawImage(
-                DividerDrawer.get_image_filepath('card.png'),
+                self.imagePath('card.png'),
                 x,
                 countHeight,
                 16,
@@ -891,7 +1300,20 @@ class DividerDrawer(object):
 
         return width + 1
 
-    def drawCost(self, card, x, y, costOffset=-1):
+    # hasCoinCost and costWidth only read the cost, potcost and debtcost of costs, which can be a
+    # CardRender or, while resolveCard works out the CardRender, the Card itself.
+    @staticmethod
+    def hasCoinCost(costs):
+        return not (costs.cost == "" or
+                    (costs.debtcost and int(costs.cost) == 0) or
+                    (costs.potcost and int(costs.cost) == 0))
+
+    @classmethod
+    def costWidth(cls, costs):
+        # The width drawCost takes up
+        return 2 + 16 * (cls.hasCoinCost(costs) + bool(costs.debtcost)) + 11 * bool(costs.potcost)
+
+    def drawCost(self, render, x, y, costOffset=-1):
         # width starts at 2 (1 pt border on each side)
         width = 2
 
@@ -900,12 +1322,10 @@ class DividerDrawer(object):
         potHeight = y - 3
         potSize = 11
 
-        if (not(card.cost == "" or
-                (card.debtcost and int(card.cost) == 0) or
-                (card.potcost and int(card.cost) == 0))):
+        if self.hasCoinCost(render):
 
             self.canvas.drawImage(
-                DividerDrawer.get_image_filepath('coin_small.png'),
+                self.imagePath('coin_small.png'),
                 x,
                 coinHeight,
                 16,
@@ -913,14 +1333,14 @@ class DividerDrawer(object):
                 preserveAspectRatio=True,
                 mask='auto')
             self.canvas.setFont(self.font_mapping['Bold'], 12)
-            self.canvas.drawCentredString(x + 8, costHeight, str(card.cost))
+            self.canvas.drawCentredString(x + 8, costHeight, str(render.cost))
             self.canvas.setFillColorRGB(0, 0, 0)
             x += 17
             width += 16
 
-        if card.debtcost:
+        if render.debtcost:
             self.canvas.drawImage(
-                DividerDrawer.get_image_filepath('debt.png'),
+                self.imagePath('debt.png'),
                 x,
                 coinHeight,
                 16,
@@ -929,14 +1349,14 @@ class DividerDrawer(object):
                 mask=[170, 255, 170, 255, 170, 255])
             self.canvas.setFillColorRGB(1, 1, 1)
             self.canvas.setFont(self.font_mapping['Bold'], 12)
-            self.canvas.drawCentredString(x + 8, costHeight, str(card.debtcost))
+            self.canvas.drawCentredString(x + 8, costHeight, str(render.debtcost))
             self.canvas.setFillColorRGB(0, 0, 0)
             x += 17
             width += 16
 
-        if card.potcost:
+        if render.potcost:
             self.canvas.drawImage(
-                DividerDrawer.get_image_filepath('potion.png'),
+                self.imagePath('potion.png'),
                 x,
                 potHeight,
                 potSize,
@@ -951,7 +1371,7 @@ class DividerDrawer(object):
         # set image
         w = 2
         self.canvas.drawImage(
-            DividerDrawer.get_image_filepath(setImage),
+            self.imagePath(setImage),
             x,
             y,
             14,
@@ -972,24 +1392,155 @@ class DividerDrawer(object):
                                         fontSize - 2)
         return w
 
+    def drawName(self, name, x, y, fontSize):
+        # Draw name in small caps from (x, y) as a single text object: the first letter of each
+        # word at fontSize, the rest 2pt smaller.  Only the changes of size are written out.
+        # This leaves the font of the page out of step with the one the canvas keeps track of,
+        # so the canvas font has to be set before drawing any other strings.
+        runs = []  # [size, text] of each run of letters of the same size
+        for i, word in enumerate(name.split()):
+            for text, size in [(' ' if i != 0 else '', fontSize), (word[0], fontSize), (word[1:], fontSize - 2)]:
+                if runs and runs[-1][0] == size:
+                    runs[-1][1] += text
+                elif text:
+                    runs.append([size, text])
+        textObject = self.canvas.beginText(x, y)
+        for size, text in runs:
+            textObject.setFont(self.font_mapping['Regular'], size)
+            textObject.textOut(text)
+        self.canvas.drawText(textObject)
+
+    def fitName(self, name, textWidth):
+        # The font size, from 12 down to 8, that fits the name into textWidth on the tab, and its width at that size
+        key = ('tab', self.font_mapping['Regular'], name, textWidth)
+        if self.fitCache is not None:
+            fit = self.fitCache.get(key)
+            if fit is not None:
+                return tuple(fit)
+        fontSize = 12
+        width = self.nameWidth(name, fontSize)
+        while width > textWidth and fontSize > 8:
+            fontSize -= .01
+            width = self.nameWidth(name, fontSize)
+        if self.fitCache is not None:
+            self.fitCache.put(key, [fontSize, width])
+        return fontSize, width
+
+    def resolveCard(self, card):
+        # Work out the CardRender of the card
+        cardType = card.getType()
+        isBlank = card.isBlank()
+        isExpansion = card.isExpansion()
+        name = card.name.upper()
+
+        setImage = None
+        textIcon = None
+        if not isBlank:
+            if self.options.use_text_set_icon:
+                textIcon = card.setTextIcon()
+            if (not self.options.use_text_set_icon or
+                    ('body-top' in self.options.set_icon and not isExpansion)):
+                setImage = card.setImage()
+
+        tabCost = False
+        if not isExpansion and not isBlank and not card.isLandmark() and not card.isType('Trash'):
+            if 'tab' in self.options.cost:
+                tabCost = True
+                textInset = 4 + self.costWidth(card)
+            else:
+                textInset = 6
+        else:
+            textInset = 13
+
+        # always need to offset from right edge, to make sure it stays on banner
+        if self.options.use_text_set_icon:
+            textInsetRight = 15
+        elif setImage and 'tab' in self.options.set_icon:
+            textInsetRight = 20
+        else:
+            textInsetRight = 6
+
+        # fit the name on the tab, allowing for 3 pt border on each side
+        textWidth = CardPlot.tabWidth - 6 - textInset - textInsetRight
+        fontSize, width = self.fitName(name, textWidth)
+        tooLong = width > textWidth
+        if tooLong:
+            name_lines = name.partition(' / ')
+            if name_lines[1]:
+                name_lines = (name_lines[0] + ' /', name_lines[2])
+            else:
+                name_lines = tuple(name.split(None, 1))
+        else:
+            name_lines = (name, )
+
+        description = card.description
+        extra = card.extra
+        if not isExpansion:
+            if description:
+                description = self.add_inline_text(card, description)
+            if extra:
+                extra = self.add_inline_text(card, extra)
+
+        return CardRender(
+            name=card.name,
+            upper_name=name,
+            cardset=card.cardset,
+            types_name=card.types_name,
+            cost=card.cost,
+            potcost=card.potcost,
+            debtcost=card.debtcost,
+            count=tuple(card.count),
+            card_count=card.getCardCount(),
+            is_blank=isBlank,
+            is_expansion=isExpansion,
+            centre_tab=self.wantCentreTab(card),
+            set_image=setImage,
+            text_icon=textIcon,
+            tab_image=cardType.getTabImageFile(),
+            tab_text_offset=cardType.getTabTextHeightOffset(),
+            tab_cost_offset=cardType.getTabCostHeightOffset(),
+            tab_cost=tabCost,
+            tab_text_inset=textInset,
+            tab_text_inset_right=textInsetRight,
+            tab_font_size=fontSize,
+            tab_name_lines=name_lines,
+            tab_name_too_long=tooLong,
+            tab_name_widths=tuple(self.nameWidth(line, fontSize) for line in name_lines),
+            wrapper_name_width=self.nameWidth(name, 8) if self.options.wrapper else None,
+            description=description,
+            extra=extra)
+
+    def resolveCards(self, items):
+        # The resolve stage: give every divider the CardRender of its card, working it out once per card
+        renders = {}
+        for item in items:
+            if id(item.card) not in renders:
+                renders[id(item.card)] = self.resolveCard(item.card)
+            item.render = renders[id(item.card)]
+
+    def cardRender(self, item):
+        if item.render is None:
+            item.render = self.resolveCard(item.card)
+        return item.render
+
     def drawTab(self, item, wrapper="no", backside=False):
-        card = item.card
+        render = self.cardRender(item)
         # Skip blank cards
-        if card.isBlank():
+        if render.is_blank:
             return
 
         # draw tab flap
         self.canvas.saveState()
 
         translate_y = item.cardHeight
-        if self.wantCentreTab(card):
+        if render.centre_tab:
             translate_x = item.cardWidth / 2 - item.tabWidth / 2
         else:
             translate_x = item.getTabOffset(backside=backside)
 
         if wrapper == "back":
             translate_y = item.tabHeight
-            if self.wantCentreTab(card):
+            if render.centre_tab:
                 translate_x = item.cardWidth / 2 + item.tabWidth / 2
             else:
                 translate_x = item.getTabOffset(backside=False) + item.tabWidth
@@ -1008,19 +1559,16 @@ class DividerDrawer(object):
             self.canvas.rect(0, 0, item.tabWidth, item.tabHeight, fill=True)
             self.canvas.restoreState()
 
-        # allow for 3 pt border on each side
-        textWidth = item.tabWidth - 6
         textHeight = 7
         if self.options.no_tab_artwork:
             textHeight = 4
-        textHeight = item.tabHeight / 2 - textHeight + \
-            card.getType().getTabTextHeightOffset()
+        textHeight = item.tabHeight / 2 - textHeight + render.tab_text_offset
 
         # draw banner
-        img = card.getType().getTabImageFile()
+        img = render.tab_image
         if not self.options.no_tab_artwork and img:
             self.canvas.drawImage(
-                DividerDrawer.get_image_filepath(img),
+                self.imagePath(img),
                 1,
                 0,
                 item.tabWidth - 2,
@@ -1030,62 +1578,31 @@ class DividerDrawer(object):
                 mask='auto')
 
         # draw cost
-        if not card.isExpansion() and not card.isBlank(
-        ) and not card.isLandmark() and not card.isType('Trash'):
-            if 'tab' in self.options.cost:
-                textInset = 4
-                textInset += self.drawCost(
-                    card, textInset, textHeight,
-                    card.getType().getTabCostHeightOffset())
-            else:
-                textInset = 6
-        else:
-            textInset = 13
+        if render.tab_cost:
+            self.drawCost(render, 4, textHeight, render.tab_cost_offset)
+        textInset = render.tab_text_inset
 
         # draw set image
-        # always need to offset from right edge, to make sure it stays on
-        # banner
-        textInsetRight = 6
+        textInsetRight = render.tab_text_inset_right
         if self.options.use_text_set_icon:
-            setImageHeight = card.getType().getTabTextHeightOffset()
-            setText = card.setTextIcon()
+            setText = render.text_icon
             self.canvas.setFont(self.font_mapping['Italic'], 8)
             if setText is None:
                 setText = ""
 
             self.canvas.drawCentredString(item.tabWidth - 10,
                                           textHeight + 2, setText)
-            textInsetRight = 15
-        else:
-            setImage = card.setImage()
-            if setImage and 'tab' in self.options.set_icon:
-                setImageHeight = 3 + card.getType().getTabTextHeightOffset()
-
-                self.drawSetIcon(setImage, item.tabWidth - 20,
-                                 setImageHeight)
+        elif render.set_image and 'tab' in self.options.set_icon:
+            setImageHeight = 3 + render.tab_text_offset
 
-                textInsetRight = 20
+            self.drawSetIcon(render.set_image, item.tabWidth - 20,
+                             setImageHeight)
 
         # draw name
-        fontSize = 12
-        name = card.name.upper()
-
-        textWidth -= textInset
-        textWidth -= textInsetRight
-
-        width = self.nameWidth(name, fontSize)
-        while width > textWidth and fontSize > 8:
-            fontSize -= .01
-            width = self.nameWidth(name, fontSize)
-        tooLong = width > textWidth
-        if tooLong:
-            name_lines = name.partition(' / ')
-            if name_lines[1]:
-                name_lines = (name_lines[0] + ' /', name_lines[2])
-            else:
-                name_lines = name.split(None, 1)
-        else:
-            name_lines = [name]
+        fontSize = render.tab_font_size
+        name = render.upper_name
+        tooLong = render.tab_name_too_long
+        name_lines = render.tab_name_lines
 
         for linenum, line in enumerate(name_lines):
             h = textHeight
@@ -1095,7 +1612,6 @@ class DividerDrawer(object):
                 else:
                     h -= h / 2
 
-            words = line.split()
             NotRightEdge = (
                 not self.options.tab_name_align == "right" and
                 (self.options.tab_name_align == "centre" or
@@ -1104,28 +1620,15 @@ class DividerDrawer(object):
             if wrapper == "back" and not self.options.tab_name_align == "centre":
                 NotRightEdge = not NotRightEdge
             if NotRightEdge:
-                if (self.options.tab_name_align == "centre" or self.wantCentreTab(card)
+                if (self.options.tab_name_align == "centre" or render.centre_tab
                         or (item.getClosestSide(backside=backside) == CardPlot.CENTRE)):
-                    w = item.tabWidth / 2 - self.nameWidth(line, fontSize) / 2
+                    w = item.tabWidth / 2 - render.tab_name_widths[linenum] / 2
                 else:
                     w = textInset
-
-                def drawWordPiece(text, fontSize):
-                    self.canvas.setFont(self.font_mapping['Regular'], fontSize)
-                    if text != ' ':
-                        self.canvas.drawString(w, h, text)
-                    return pdfmetrics.stringWidth(text, self.font_mapping['Regular'],
-                                                  fontSize)
-
-                for i, word in enumerate(words):
-                    if i != 0:
-                        w += drawWordPiece(' ', fontSize)
-                    w += drawWordPiece(word[0], fontSize)
-                    w += drawWordPiece(word[1:], fontSize - 2)
             else:
                 # align text to the right if tab is on right side
-                if self.options.tab_name_align == "centre" or self.wantCentreTab(card):
-                    w = item.tabWidth / 2 - self.nameWidth(line, fontSize) / 2
+                if self.options.tab_name_align == "centre" or render.centre_tab:
+                    w = item.tabWidth / 2 - render.tab_name_widths[linenum] / 2
                     w = item.tabWidth - w
                 else:
                     w = item.tabWidth - textInsetRight
@@ -1133,53 +1636,26 @@ class DividerDrawer(object):
                 # to make tabs easier to read when grouped together extra 3pt is for
                 # space between text + set symbol
                 w -= 3
+                w -= render.tab_name_widths[linenum]
 
-                words.reverse()
-
-                def drawWordPiece(text, fontSize):
-                    self.canvas.setFont(self.font_mapping['Regular'], fontSize)
-                    if text != ' ':
-                        self.canvas.drawRightString(w, h, text)
-                    return -pdfmetrics.stringWidth(text, self.font_mapping['Regular'],
-                                                   fontSize)
+            self.drawName(line, w, h, fontSize)
 
-                for i, word in enumerate(words):
-                    w += drawWordPiece(word[1:], fontSize - 2)
-                    w += drawWordPiece(word[0], fontSize)
-                    if i != len(words) - 1:
-                        w += drawWordPiece(' ', fontSize)
-
-        if wrapper == "front" and card.getCardCount() >= 5:
+        if wrapper == "front" and render.card_count >= 5:
             # Print smaller version of name on the top wrapper edge
             self.canvas.translate(0, -item.stackHeight)  # move into area used by the wrapper
             fontSize = 8  # use the smallest font
-            self.canvas.setFont(self.font_mapping['Regular'], fontSize)
 
             textHeight = fontSize - 2
             textHeight = item.stackHeight / 2 - textHeight / 2
-            h = textHeight
-            words = name.split()
-            w = item.tabWidth / 2 - self.nameWidth(name, fontSize) / 2
-
-            def drawWordPiece(text, fontSize):
-                self.canvas.setFont(self.font_mapping['Regular'], fontSize)
-                if text != ' ':
-                    self.canvas.drawString(w, h, text)
-                return pdfmetrics.stringWidth(text, self.font_mapping['Regular'],
-                                              fontSize)
-
-            for i, word in enumerate(words):
-                if i != 0:
-                    w += drawWordPiece(' ', fontSize)
-                w += drawWordPiece(word[0], fontSize)
-                w += drawWordPiece(word[1:], fontSize - 2)
+            w = item.tabWidth / 2 - render.wrapper_name_width / 2
+            self.drawName(name, w, textHeight, fontSize)
 
         self.canvas.restoreState()
 
     def drawText(self, item, divider_text="card", wrapper="no"):
-        card = item.card
+        render = self.cardRender(item)
         # Skip blank cards
-        if card.isBlank():
+        if render.is_blank:
             return
 
         self.canvas.saveState()
@@ -1199,27 +1675,22 @@ class DividerDrawer(object):
                 usedHeight += self.options.notch_height * cm
 
         # Add 'body-top' items
-        drewTopIcon = False
         Image_x_left = 4
-        if 'body-top' in self.options.cost and not card.isExpansion():
-            Image_x_left += self.drawCost(card, Image_x_left, totalHeight - usedHeight - 0.5 * cm)
-            drewTopIcon = True
+        if 'body-top' in self.options.cost and not render.is_expansion:
+            Image_x_left += self.drawCost(render, Image_x_left, totalHeight - usedHeight - 0.5 * cm)
 
         Image_x_right = item.cardWidth - 4
-        if 'body-top' in self.options.set_icon and not card.isExpansion():
-            setImage = card.setImage()
-            if setImage:
+        if 'body-top' in self.options.set_icon and not render.is_expansion:
+            if render.set_image:
                 Image_x_right -= 16
-                self.drawSetIcon(setImage, Image_x_right,
+                self.drawSetIcon(render.set_image, Image_x_right,
                                  totalHeight - usedHeight - 0.5 * cm - 3)
-                drewTopIcon = True
 
         if self.options.count:
-            Image_x_right -= self.drawCardCount(card, Image_x_right,
+            Image_x_right -= self.drawCardCount(render, Image_x_right,
                                                 totalHeight - usedHeight - 0.5 * cm)
-            drewTopIcon = True
 
-        if (self.options.types and not card.isExpansion()):
+        if (self.options.types and not render.is_expansion):
 
             #  Calculate how much width have for printing
             #  Want centered, but number of other items can limit
@@ -1235,7 +1706,7 @@ class DividerDrawer(object):
             #  use all the available space, even if it is not centered on the card
             fontSize = 8
             failover = False
-            width = stringWidth(card.types_name, self.font_mapping['Regular'], fontSize)
+            width = stringWidth(render.types_name, self.font_mapping['Regular'], fontSize)
             while width > textWidth:
                 fontSize -= .01
                 if fontSize < 6 and not failover:
@@ -1244,81 +1715,175 @@ class DividerDrawer(object):
                     w = left_margin + (textWidth2 / 2)
                     fontSize = 8
                     failover = True
-                width = stringWidth(card.types_name, self.font_mapping['Regular'], fontSize)
+                width = stringWidth(render.types_name, self.font_mapping['Regular'], fontSize)
 
             #  Print out the text in the right spot
             h = totalHeight - usedHeight - 0.5 * cm
             self.canvas.setFont(self.font_mapping['Regular'], fontSize)
-            if card.types_name != ' ':
-                self.canvas.drawCentredString(w, h, card.types_name)
-            drewTopIcon = True
+            if render.types_name != ' ':
+                self.canvas.drawCentredString(w, h, render.types_name)
 
-        if drewTopIcon:
+        if self.drawsBodyTop(render):
             usedHeight += 15
 
-        # Figure out what text is to be printed on this divider
-        descriptions = None
-        if divider_text == "card" and card.description:
-            # Add the card text to the divider
-            descriptions = card.description
-        elif divider_text == "rules" and card.extra:
-            # Add the extra rules text to the divider
-            descriptions = card.extra
-
-        if descriptions is None:
+        job = self.textJob(item, render, divider_text, wrapper)
+        if job is None:
             # No text to print, so exit early and cleanly
             self.canvas.restoreState()
             return
 
-        s = getSampleStyleSheet()['BodyText']
-        s.fontName = "Times-Roman"
-        if divider_text == "card" and not card.isExpansion():
-            s.alignment = TA_CENTER
+        layout, paragraphs = self.layoutText(job, self.knownTextLayout(job))
+        self.storeTextLayout(job, layout)
+        spacerHeight = layout.spacer_height
+
+        h = totalHeight - usedHeight - self.TEXT_VERTICAL_MARGIN
+        for p in paragraphs:
+            h -= p.height
+            p.drawOn(self.canvas, self.TEXT_HORIZONTAL_MARGIN, h)
+            h -= spacerHeight
+
+        self.canvas.restoreState()
+
+    def drawsBodyTop(self, render):
+        # Whether drawText puts a line of icons and types above the text of the card
+        if self.options.count:
+            return True
+        if render.is_expansion:
+            return False
+        return ('body-top' in self.options.cost or
+                ('body-top' in self.options.set_icon and bool(render.set_image)) or
+                self.options.types)
+
+    def textJob(self, item, render, divider_text="card", wrapper="no"):
+        # What layoutText needs to fit the text that drawText puts on a side of the divider:
+        # (card name, text, is expansion, alignment, text box width, text box height), or None
+        # if there is no text on that side.
+        if render.is_blank:
+            return None
+        if divider_text == "card" and render.description:
+            # Add the card text to the divider
+            descriptions = render.description
+        elif divider_text == "rules" and render.extra:
+            # Add the extra rules text to the divider
+            descriptions = render.extra
+        else:
+            return None
+
+        if divider_text == "card" and not render.is_expansion:
+            alignment = TA_CENTER
         else:
-            s.alignment = TA_JUSTIFY
+            alignment = TA_JUSTIFY
 
-        textHorizontalMargin = .5 * cm
-        textVerticalMargin = .3 * cm
-        textBoxWidth = item.cardWidth - 2 * textHorizontalMargin
-        textBoxHeight = totalHeight - usedHeight - 2 * textVerticalMargin
-        spacerHeight = 0.2 * cm
+        usedHeight = 0
+        if wrapper == "front" or wrapper == "back":
+            if self.options.notch_length > 0:
+                usedHeight += self.options.notch_height * cm
+        if self.drawsBodyTop(render):
+            usedHeight += 15
+        textBoxWidth = item.cardWidth - 2 * self.TEXT_HORIZONTAL_MARGIN
+        textBoxHeight = item.cardHeight - usedHeight - 2 * self.TEXT_VERTICAL_MARGIN
+        return (render.name, descriptions, render.is_expansion, alignment, textBoxWidth, textBoxHeight)
+
+    def layoutText(self, job, layout=None):
+        # Fit the text of a textJob into its box, making it smaller until it does.  Returns the
+        # TextLayout and the paragraphs wrapped to it.  Given the TextLayout from an earlier
+        # call, the paragraphs are only wrapped once.
+        name, descriptions, isExpansion, alignment, textBoxWidth, textBoxHeight = job
+        if layout is None:
+            layout = TextLayout(font_size=None, leading=None, spacer_height=0.2 * cm)
+        s = self.paragraphStyle("Times-Roman", alignment, layout.font_size, layout.leading)
+        spacerHeight = layout.spacer_height
         minSpacerHeight = 0.05 * cm
 
-        if not card.isExpansion():
-            descriptions = self.add_inline_text(card, descriptions)
         descriptions = re.split("\n", descriptions)
         while True:
             paragraphs = []
             # this accounts for the spacers we insert between paragraphs
             h = (len(descriptions) - 1) * spacerHeight
             for d in descriptions:
-                if card.isExpansion():
+                if isExpansion:
                     dmod = d
                 else:
                     dmod = self.add_inline_images(d, s.fontSize)
                 try:
                     p = Paragraph(dmod, s)
                 except ValueError as e:
-                    raise ValueError(u'Error rendering text from "{}": {} ("{}")'.format(card.name, e, dmod))
+                    raise ValueError(u'Error rendering text from "{}": {} ("{}")'.format(name, e, dmod))
                 h += p.wrap(textBoxWidth, textBoxHeight)[1]
                 paragraphs.append(p)
 
             if h <= textBoxHeight or s.fontSize <= 1 or s.leading <= 1:
                 break
             else:
-                s.fontSize -= 1
-                s.leading -= 1
+                s = self.paragraphStyle("Times-Roman", alignment, s.fontSize - 1, s.leading - 1)
                 spacerHeight = max(spacerHeight - 1, minSpacerHeight)
 
-        h = totalHeight - usedHeight - textVerticalMargin
-        for p in paragraphs:
-            h -= p.height
-            p.drawOn(self.canvas, textHorizontalMargin, h)
-            h -= spacerHeight
+        return TextLayout(s.fontSize, s.leading, spacerHeight), paragraphs
+
+    def knownTextLayout(self, job):
+        # The TextLayout of a textJob if it was worked out before, in this run or with --fit-cache in an earlier one
+        layout = self.textLayouts.get(job)
+        if layout is None and self.fitCache is not None:
+            fit = self.fitCache.get(('text', self.options.image_dpi) + job)
+            if fit is not None:
+                layout = self.textLayouts[job] = TextLayout(*fit)
+        return layout
+
+    def storeTextLayout(self, job, layout):
+        if job not in self.textLayouts:
+            self.textLayouts[job] = layout
+            if self.fitCache is not None:
+                self.fitCache.put(('text', self.options.image_dpi) + job, list(layout))
+
+    def layoutDividers(self, items):
+        # The layout stage: with --layout-workers, fit the text of every side of the dividers
+        # into its box ahead of drawing, spread over that many processes.  Drawing then only
+        # has to wrap each text once, at the size worked out here.
+        if not self.options.layout_workers or self.options.tabs_only:
+            return
+        if self.options.wrapper:
+            sides = [("front", False), ("back", True)]
+        elif self.hasBacks():
+            sides = [("no", False), ("no", True)]
+        else:
+            sides = [("no", False)]
+        jobs = set()
+        for item in items:
+            render = self.cardRender(item)
+            for wrapper, isBack in sides:
+                job = self.textJob(item, render, item.textTypeBack if isBack else item.textTypeFront, wrapper)
+                if job is not None and self.knownTextLayout(job) is None:
+                    jobs.add(job)
+        if not jobs:
+            return
 
-        self.canvas.restoreState()
+        jobs = sorted(jobs)
+        if 'fork' not in multiprocessing.get_all_start_methods():
+            # Only forked workers start quickly enough to pay off, without fork the texts are laid out here
+            for job in jobs:
+                self.storeTextLayout(job, self.layoutText(job)[0])
+            return
 
-    def drawDivider(self, item, isBack=False, horizontalMargin=-1, verticalMargin=-1):
+        # The workers get the drawing options only: the others (like an outfile that is a file object)
+        # need not be picklable
+        options = argparse.Namespace(**{name: value for name, value in vars(self.options).items()
+                                        if name not in self.NON_DRAWING_OPTIONS})
+        imageSizes = self.imageDrawSizes()
+        workers = min(self.options.layout_workers, len(jobs))
+        chunks = [jobs[i::workers] for i in range(workers)]
+        pool = multiprocessing.get_context('fork').Pool(workers)
+        try:
+            for chunk, layouts in zip(chunks, pool.map(layoutTexts, [(options, imageSizes, chunk)
+                                                                     for chunk in chunks])):
+                for job, layout in zip(chunk, layouts):
+                    self.storeTextLayout(job, layout)
+        finally:
+            pool.close()
+            pool.join()
+
+    def drawDivider(self, item, isBack=False, horizontalMargin=-1, verticalMargin=-1, cropmarks=None):
+        # Given a set for cropmarks, the divider's cropmarks are added to it (see drawCropmarks)
+        # rather than drawn with it.
         # First save canvas state
         self.canvas.saveState()
 
@@ -1331,17 +1896,56 @@ class DividerDrawer(object):
         # apply the transforms to get us to the corner of the current card
         self.canvas.resetTransforms()
         pageWidth = self.options.paperwidth - (2 * horizontalMargin)
-        self.canvas.translate(horizontalMargin, verticalMargin)
+        x0, y0 = horizontalMargin, verticalMargin
         if isBack:
-            self.canvas.translate(self.options.back_offset,
-                                  self.options.back_offset_height)
+            x0 += self.options.back_offset
+            y0 += self.options.back_offset_height
             pageWidth -= 2 * self.options.back_offset
+        self.canvas.translate(x0, y0)
 
         item.translate(self.canvas, pageWidth, isBack)
 
-        # actual drawing
+        if cropmarks is not None and not self.options.tabs_only:
+            self.drawOutline(item, isBack, lines=False, cropmarks=cropmarks,
+                             matrix=item.pageMatrix(pageWidth, isBack, x0, y0))
+
+        key = self.dividerKeys.get((id(item), isBack))
+        if key is None:
+            self.drawDividerContent(item, isBack, cropmarks=cropmarks is None)
+        else:
+            if key not in self.dividerForms:
+                # leave room around the divider for the cropmarks
+                margin = (self.options.cropmarkLength + self.options.cropmarkSpacing + 1) * cm
+                width = item.cardWidth
+                height = item.cardHeight + item.tabHeight
+                if item.wrapper:
+                    height = 2 * (height + item.stackHeight)
+                self.canvas.beginForm(key, -margin, -margin, width + margin, height + margin)
+                self.drawDividerContent(item, isBack, cropmarks=cropmarks is None)
+                self.canvas.endForm()
+                self.dividerForms.add(key)
+            self.canvas.doForm(key)
+
+        # retore the canvas state to the way we found it
+        self.canvas.restoreState()
+
+    def drawSingleDivider(self, item, isBack=False):
+        # Draw one divider, without cropmarks, on a page of the divider's size (see main.render_divider)
+        self.registerFonts()
+        width = item.cardWidth
+        height = item.cardHeight + item.tabHeight
+        if item.wrapper:
+            height = 2 * (height + item.stackHeight)
+        self.canvas = canvas.Canvas(self.options.outfile, pagesize=(width, height))
+        self.cardRender(item)
+        self.drawDividerContent(item, isBack, cropmarks=False)
+        self.canvas.showPage()
+        self.canvas.save()
+
+    def drawDividerContent(self, item, isBack=False, cropmarks=True):
+        # Draw the divider, with the canvas already set up so that (0,0) is its lower left corner
         if not self.options.tabs_only:
-            self.drawOutline(item, isBack)
+            self.drawOutline(item, isBack, cropmarks=cropmarks)
 
         if self.options.wrapper:
             wrap = "front"
@@ -1360,9 +1964,6 @@ class DividerDrawer(object):
                 self.drawTab(item, wrapper="back", backside=True)
                 self.drawText(item, item.textTypeBack, wrapper="back")
 
-        # retore the canvas state to the way we found it
-        self.canvas.restoreState()
-
     def drawSetNames(self, pageItems):
         # print sets for this page
         self.canvas.saveState()
@@ -1426,7 +2027,102 @@ class DividerDrawer(object):
         finally:
             self.canvas.restoreState()
 
-    def calculatePages(self, cards):
+    def calculatePages(self, cards, maxPages=None):
+        maxStackHeight = 0
+        if self.options.wrapper:
+            # Use the maximum thickness of any divider so we know anything will fit.
+            maxStackHeight = max(c.getStackHeight(self.options.thickness) for c in cards)
+            print("Max Card Stack Height: {:.2f}cm ".format(maxStackHeight/10.0))
+
+        stackHeights = [c.getStackHeight(self.options.thickness) for c in cards]
+        self.calculateGrid(maxStackHeight, stackHeights)
+        # With --num-pages, only the cards on those pages get a CardPlot.  The tabs and the
+        # packing of the wrappers go in card order, so they come out the same as for all cards.
+        packedRows = self.packWrapperRows(stackHeights) if self.packWrappers() else None
+        maxPages = self.options.num_pages if maxPages is None else maxPages
+        if 0 < maxPages:
+            if packedRows is None:
+                drawn = maxPages * self.options.numDividersVertical * self.options.numDividersHorizontal
+            else:
+                drawn = sum(len(row) for rows in packedRows[:maxPages] for row in rows)
+            cards = cards[:drawn]
+        items = self.setupCardPlots(self.options, cards)  # Turn cards into items to plot
+        if packedRows is not None:
+            self.pages = self.convert2packedPages(self.options, items)
+            gridPages = -(-len(stackHeights) // self.gridDividersPerPage)
+            print("Packed the wrappers onto {} pages instead of {}".format(len(packedRows), gridPages))
+        else:
+            self.pages = self.convert2pages(self.options, items)  # plot items into pages
+
+    def calculateSectionPages(self, sections):
+        # Pages for several lists of cards one after the other, each starting on a new page.
+        # sections are (cards, Card.getClassState() to lay them out and draw them with), e.g. the same cards in
+        # several languages.  Card's class state is put back after.
+        pages = []
+        self.pageCardState = []
+        state = Card.getClassState()
+        try:
+            for cards, sectionState in sections:
+                if 0 < self.options.num_pages <= len(pages):
+                    break
+                Card.setClassState(sectionState)
+                self.calculatePages(cards, self.options.num_pages - len(pages) if self.options.num_pages > 0 else 0)
+                pages.extend(self.pages)
+                self.pageCardState.extend([sectionState] * len(self.pages))
+        finally:
+            Card.setClassState(state)
+        self.pages = pages
+
+    def packWrappers(self):
+        return self.options.wrapper and self.options.pack_wrappers and self.options.rotate in [0, 180]
+
+    def packWrapperRows(self, stackHeights, columns=None, packHeight=None):
+        # Shelf packing of wrappers of different heights: in order, the wrappers go into rows
+        # as many across as fit, each row as high as its tallest wrapper, and rows go onto a page
+        # for as long as they fit.  Returns the pages, each a list of rows of wrapper indexes.
+        options = self.options
+        columns = columns or options.numDividersHorizontal
+        packHeight = packHeight or options.packHeight
+        heights = [2 * (options.dividerHeight + stackHeight) for stackHeight in stackHeights]
+        pages = [[]]
+        used = 0
+        for start in range(0, len(heights), columns):
+            row = list(range(start, min(start + columns, len(heights))))
+            needed = max(heights[i] for i in row)
+            if pages[-1]:
+                needed += options.verticalBorderSpace
+                if used + needed > packHeight:
+                    pages.append([])
+                    used = 0
+                    needed -= options.verticalBorderSpace
+            pages[-1].append(row)
+            used += needed
+        return pages
+
+    def calculateGrid(self, maxStackHeight=0, stackHeights=None):
+        # Work out the divider sizes, how many fit on a page and the page margins as the LayoutPlan of the options.
+        # This only depends on the options (and the tallest stack for wrappers), not on the cards.
+        # Packed wrappers (see packWrapperRows) also use all of the stack heights to pick the paper orientation.
+        # The options given to the drawer are left alone: it goes on with a copy of them with the plan added,
+        # and a later call starts from the given options again.
+        if self.layoutOptions is None:
+            self.layoutOptions = self.options
+        self.options = argparse.Namespace(**vars(self.layoutOptions))
+        if 'label' not in self.options:
+            self.options.label = None
+
+        key = json.dumps([getattr(self.options, name, None) for name in self.LAYOUT_OPTIONS] +
+                         [maxStackHeight, stackHeights if self.packWrappers() else None], sort_keys=True)
+        self.plan = DividerDrawer.layoutPlans.get(key)
+        if self.plan is None:
+            self.plan = self.planLayout(maxStackHeight, stackHeights)
+            DividerDrawer.layoutPlans[key] = self.plan
+        for name, value in self.plan._asdict().items():
+            setattr(self.options, name, value)
+        self.gridDividersPerPage = self.plan.gridDividersPerPage
+
+    def planLayout(self, maxStackHeight=0, stackHeights=None):
+        # The LayoutPlan of calculateGrid, worked out on the drawer's copy of the options
         options = self.options
 
         # Adjust for Vertical vs Horizontal
@@ -1437,7 +2133,7 @@ class DividerDrawer(object):
 
         options.fixedMargins = False
         options.spin = 0
-        options.label = options.label if 'label' in options else None
+        options.packHeight = None
         if options.label is not None:
             # Set Margins
             options.minmarginheight = (options.label['margin-top'] + options.label['pad-vertical']) * cm
@@ -1492,10 +2188,8 @@ class DividerDrawer(object):
         options.dividerHeightReserved = options.dividerHeight
 
         if options.wrapper:
-            # Adjust height for wrapper.  Use the maximum thickness of any divider so we know anything will fit.
-            maxStackHeight = max(c.getStackHeight(options.thickness) for c in cards)
+            # Adjust height for wrapper.
             options.dividerHeightReserved = 2 * (options.dividerHeightReserved + maxStackHeight)
-            print("Max Card Stack Height: {:.2f}cm ".format(maxStackHeight/10.0))
 
         # Adjust for rotation
         if options.rotate == 90 or options.rotate == 270:
@@ -1522,18 +2216,37 @@ class DividerDrawer(object):
             (options.paperheight - 2 * options.minmarginheight + options.horizontalBorderSpace) /
             options.dividerWidthReserved)
 
-        if ((numDividersVerticalL * numDividersHorizontalL > numDividersVerticalP *
-             numDividersHorizontalP) and not options.fixedMargins) and options.rotate == 0:
+        landscape = ((numDividersVerticalL * numDividersHorizontalL > numDividersVerticalP *
+                      numDividersHorizontalP) and not options.fixedMargins) and options.rotate == 0
+        if landscape:
+            gridDividersPerPage = numDividersVerticalL * numDividersHorizontalL
+        else:
+            gridDividersPerPage = numDividersVerticalP * numDividersHorizontalP
+        footerReserve = 0
+        if self.packWrappers() and not options.no_page_footer and options.order != "global":
+            footerReserve = self.FOOTER_RESERVE
+        if (self.packWrappers() and stackHeights and numDividersHorizontalL > 0 and numDividersHorizontalP > 0 and
+                not options.fixedMargins and options.rotate == 0):
+            # Packed wrappers do not fill the grid, so see which way round takes fewer pages
+            pagesL = self.packWrapperRows(stackHeights, numDividersHorizontalL,
+                                          options.paperwidth - 2 * options.minmarginwidth - footerReserve)
+            pagesP = self.packWrapperRows(stackHeights, numDividersHorizontalP,
+                                          options.paperheight - 2 * options.minmarginheight - footerReserve)
+            landscape = len(pagesL) < len(pagesP)
+
+        if landscape:
             options.numDividersVertical = numDividersVerticalL
             options.numDividersHorizontal = numDividersHorizontalL
             options.minHorizontalMargin = options.minmarginheight
             options.minVerticalMargin = options.minmarginwidth
             options.paperheight, options.paperwidth = options.paperwidth, options.paperheight
+            minTopBottomMargin = options.minmarginwidth
         else:
             options.numDividersVertical = numDividersVerticalP
             options.numDividersHorizontal = numDividersHorizontalP
             options.minHorizontalMargin = options.minmarginheight
             options.minVerticalMargin = options.minmarginwidth
+            minTopBottomMargin = options.minmarginheight
 
         assert options.numDividersVertical > 0, "Could not vertically fit the divider on the page"
         assert options.numDividersHorizontal > 0, "Could not horizontally fit the divider on the page"
@@ -1548,8 +2261,15 @@ class DividerDrawer(object):
             options.horizontalMargin = options.minmarginwidth
             options.verticalMargin = options.minmarginheight
 
-        items = self.setupCardPlots(options, cards)  # Turn cards into items to plot
-        self.pages = self.convert2pages(options, items)  # plot items into pages
+        if self.packWrappers():
+            # The rows of wrappers start right below the minimum top margin (see packWrapperRows),
+            # with the rest of the space at the bottom, leaving at least enough for the page footer
+            options.verticalMargin = minTopBottomMargin + footerReserve
+            options.packHeight = options.paperheight - options.verticalMargin - minTopBottomMargin
+
+        return LayoutPlan(gridDividersPerPage=gridDividersPerPage,
+                          **dict((name, getattr(options, name)) for name in LayoutPlan._fields
+                                 if name != 'gridDividersPerPage'))
 
     def setupCardPlots(self, options, cards=[]):
         # First, set up common information for the dividers
@@ -1557,7 +2277,11 @@ class DividerDrawer(object):
         # just in case the dividers need to be reordered on the page.
         # By setting up first, any tab or text flipping will be correct,
         # even if the divider moves around a bit on the pages.
+        self.setupTabs(options)
+        return [self.cardPlot(options, card, tabIndex, tabNumber)
+                for card, (tabIndex, tabNumber) in zip(cards, self.tabPlan(options, cards))]
 
+    def setupTabs(self, options):
         # Drawing line type
         if options.cropmarks:
             if 'dot' in options.linetype.lower():
@@ -1597,8 +2321,11 @@ class DividerDrawer(object):
                           serpentine=options.tab_serpentine,
                           wrapper=options.wrapper)
 
-        # Now go through all the cards and create their plotter information record...
-        items = []
+    def tabPlan(self, options, cards):
+        # The tab of each of the cards, in order, as the tabIndex and CardPlot.tabNumber to make its
+        # CardPlot with (see cardPlot).  This only depends on the card order and the TAB_OPTIONS.
+        # Needs setupTabs first.
+        tabs = []
         nextTabIndex = CardPlot.tabRestart()
         lastCardSet = None
         reset_expansion_tabs = options.expansion_dividers and options.expansion_reset_tabs
@@ -1622,23 +2349,27 @@ class DividerDrawer(object):
                 thisTabIndex = 0
             else:
                 thisTabIndex = nextTabIndex
-
-            item = CardPlot(card,
-                            rotation=options.spin if options.spin != 0 else options.rotate,
-                            tabIndex=thisTabIndex,
-                            textTypeFront=options.text_front,
-                            textTypeBack=options.text_back,
-                            stackHeight=card.getStackHeight(options.thickness)
-                            )
-            if options.flip and (options.tab_number == 2) and (thisTabIndex != CardPlot.tabStart):
-                item.flipFront2Back()  # Instead of flipping the tab, flip the whole divider front to back
+            tabs.append((thisTabIndex, CardPlot.tabNumber))
 
             # Before moving on, setup the tab for the next item if this tab slot was used
             if thisTabIndex == nextTabIndex:
-                nextTabIndex = item.nextTab(nextTabIndex)  # already used, so move on to the next tab
-
-            items.append(item)
-        return items
+                nextTabIndex = CardPlot.nextTab(nextTabIndex)  # already used, so move on to the next tab
+        return tabs
+
+    def cardPlot(self, options, card, tabIndex, tabNumber):
+        # The CardPlot of a card with its tab from tabPlan
+        if CardPlot.tabNumber != tabNumber:
+            CardPlot.tabSetup(tabNumber=tabNumber)
+        item = CardPlot(card,
+                        rotation=options.spin if options.spin != 0 else options.rotate,
+                        tabIndex=tabIndex,
+                        textTypeFront=options.text_front,
+                        textTypeBack=options.text_back,
+                        stackHeight=card.getStackHeight(options.thickness)
+                        )
+        if options.flip and (options.tab_number == 2) and (tabIndex != CardPlot.tabStart):
+            item.flipFront2Back()  # Instead of flipping the tab, flip the whole divider front to back
+        return item
 
     def convert2pages(self, options, items=[]):
         # Take the layout and all the items and separate the items into pages.
@@ -1674,39 +2405,177 @@ class DividerDrawer(object):
             pages.append((options.horizontalMargin, options.verticalMargin, page))
         return pages
 
+    def hasBacks(self):
+        # Whether each sheet of dividers also gets a page with their backs
+        return not (self.options.tabs_only or self.options.text_back == "none" or self.options.wrapper)
+
+    def drawnPages(self):
+        # The pages drawDividers draws, only the first ones with --num-pages
+        if 0 < self.options.num_pages:
+            return self.pages[:self.options.num_pages]
+        return self.pages
+
+    def countPages(self, sheets):
+        # The number of sheets and pdf pages drawDividers makes for this many sheets of dividers.
+        # --num-pages stops right after the front of the last sheet.
+        sides = 2 if self.hasBacks() else 1
+        if 0 < self.options.num_pages <= sheets:
+            return self.options.num_pages, self.options.num_pages * sides - (sides - 1)
+        return sheets, sheets * sides
+
+    def getLayout(self):
+        # The computed page plan: where each divider goes on which page, for use without drawing anything
+        options = self.options
+        pages = []
+        for pageNum, (hMargin, vMargin, page) in enumerate(self.pages):
+            if pageNum == options.num_pages:
+                break
+            dividers = []
+            for item in page:
+                dividers.append({'card_tag': item.card.card_tag,
+                                 'cardset_tag': item.card.cardset_tag,
+                                 'name': item.card.name,
+                                 'x': item.x,
+                                 'y': item.y,
+                                 'rotation': item.rotation,
+                                 'stack_height': item.stackHeight,
+                                 'tab_index': item.tabIndex,
+                                 'tab_index_back': item.tabIndexBack,
+                                 'crop': {'top': item.cropOnTop,
+                                          'bottom': item.cropOnBottom,
+                                          'left': item.cropOnLeft,
+                                          'right': item.cropOnRight}})
+            pages.append({'page': pageNum + 1,
+                          'horizontal_margin': hMargin,
+                          'vertical_margin': vMargin,
+                          'dividers': dividers})
+        sheets, pdfPages = self.countPages(len(self.pages))
+        return {'version': __version__,
+                'units': 'pt',
+                'paper_width': options.paperwidth,
+                'paper_height': options.paperheight,
+                'divider_width': options.dividerWidthReserved,
+                'divider_height': options.dividerHeightReserved,
+                'dividers_horizontal': options.numDividersHorizontal,
+                'dividers_vertical': options.numDividersVertical,
+                'backs': self.hasBacks(),
+                'sheets': sheets,
+                'pdf_pages': pdfPages,
+                'pages': pages}
+
+    def convert2packedPages(self, options, items=[]):
+        # Like convert2pages, but with the rows of wrappers from packWrapperRows.
+        # The wrappers in a row line up at the top.
+        cropLength = (options.cropmarkLength + options.cropmarkSpacing) * cm
+        RoomForCropH = options.horizontalBorderSpace > 2 * cropLength
+        RoomForCropV = options.verticalBorderSpace > 2 * cropLength
+        columns = options.numDividersHorizontal
+
+        pages = []
+        for pageNum, rows in enumerate(self.packWrapperRows([item.stackHeight for item in items])):
+            page = []
+            top = options.packHeight
+            for rowNum, row in enumerate(rows):
+                heights = [2 * (items[i].cardHeight + items[i].tabHeight + items[i].stackHeight) for i in row]
+                rowHeight = max(heights)
+                for i, height in zip(row, heights):
+                    x = i % columns
+                    item = items[i]
+                    item.x = x * options.dividerWidthReserved
+                    item.y = top - height
+                    item.cropOnTop = rowNum == 0 or RoomForCropV
+                    item.cropOnBottom = rowNum == len(rows) - 1 or RoomForCropV or rowHeight - height > cropLength
+                    item.cropOnLeft = (x == 0) or RoomForCropH
+                    item.cropOnRight = (x == columns - 1) or RoomForCropH
+                    item.page = pageNum + 1
+                    page.append(item)
+                top -= rowHeight + options.verticalBorderSpace
+            pages.append((options.horizontalMargin, options.verticalMargin, page))
+        return pages
+
     def drawDividers(self, cards=[]):
         if not self.pages:
             self.calculatePages(cards)
+        # Only the cards on the pages that get drawn are resolved and laid out
+        pages = self.drawnPages()
+        if self.pageCardState:
+            state = Card.getClassState()
+            try:
+                for (hMargin, vMargin, page), pageState in zip(pages, self.pageCardState):
+                    Card.setClassState(pageState)
+                    self.resolveCards(page)
+            finally:
+                Card.setClassState(state)
+        else:
+            self.resolveCards(item for hMargin, vMargin, page in pages for item in page)
+        self.layoutDividers([item for hMargin, vMargin, page in pages for item in page])
+
+        if self.hasBacks():
+            self.findRepeatedDividers([False, True], pages)
+        else:
+            self.findRepeatedDividers([False], pages)
+        self.cropmarkForms = {}
 
         # Now go page by page and print the dividers
-        for pageNum, pageInfo in enumerate(self.pages):
+        for pageNum, pageInfo in enumerate(pages):
             hMargin, vMargin, page = pageInfo
 
-            # Front page footer
-            if not self.options.no_page_footer and (
-                    not self.options.tabs_only and
-                    self.options.order != "global"):
-                self.drawSetNames(page)
-
             # Front page
-            for item in page:
-                # print the dividor
-                self.drawDivider(item, isBack=False, horizontalMargin=hMargin, verticalMargin=vMargin)
-            self.canvas.showPage()
+            self.drawPage(page, isBack=False, horizontalMargin=hMargin, verticalMargin=vMargin)
             if pageNum + 1 == self.options.num_pages:
                 break
-            if self.options.tabs_only or self.options.text_back == "none" or self.options.wrapper:
+            if not self.hasBacks():
                 # Don't print the sheets with the back of the dividers
                 continue
 
-            # back page footer
-            if not self.options.no_page_footer and self.options.order != "global":
-                self.drawSetNames(page)
-
             # Back page
-            for item in page:
-                # print the dividor
-                self.drawDivider(item, isBack=True, horizontalMargin=hMargin, verticalMargin=vMargin)
-            self.canvas.showPage()
+            self.drawPage(page, isBack=True, horizontalMargin=hMargin, verticalMargin=vMargin)
             if pageNum + 1 == self.options.num_pages:
                 break
+
+    def drawPage(self, page, isBack=False, horizontalMargin=-1, verticalMargin=-1):
+        if self.previousPages is not None:
+            fingerprint = self.pageFingerprint(page, isBack, horizontalMargin, verticalMargin)
+            self.pageFingerprints.append(fingerprint)
+            if fingerprint in self.previousPages:
+                # Nothing changed on this page since the last run, so copy it from there
+                from pdfrw.buildxobj import pagexobj
+                from pdfrw.toreportlab import makerl
+                self.canvas.doForm(makerl(self.canvas, pagexobj(self.previousPages[fingerprint])))
+                self.canvas.showPage()
+                return
+
+        # page footer
+        if not self.options.no_page_footer and (
+                not self.options.tabs_only and
+                self.options.order != "global"):
+            self.drawSetNames(page)
+
+        cropmarks = set() if self.options.cropmarks else None
+        for item in page:
+            # print the dividor
+            self.drawDivider(item, isBack=isBack, horizontalMargin=horizontalMargin, verticalMargin=verticalMargin,
+                             cropmarks=cropmarks)
+        if cropmarks:
+            self.drawCropmarks(cropmarks)
+        self.canvas.showPage()
+
+    def drawCropmarks(self, cropmarks):
+        # Draw the cropmarks collected from all of the dividers on the page as a single path, so that
+        # a mark shared by neighbouring dividers is only drawn once.  Pages with the same layout have
+        # the same marks, so the path goes into a form that each of those pages reuses.
+        # The marks themselves are the key, so a page costs a set lookup rather than a serialised hash.
+        cropmarks = frozenset(cropmarks)
+        name = self.cropmarkForms.get(cropmarks)
+        if name is None:
+            name = 'cropmarks{}'.format(len(self.cropmarkForms))
+            self.canvas.beginForm(name)
+            self.canvas.setLineWidth(self.options.linewidth)
+            path = self.canvas.beginPath()
+            for start, end in sorted(cropmarks):
+                path.moveTo(*start)
+                path.lineTo(*end)
+            self.canvas.drawPath(path, stroke=1, fill=0)
+            self.canvas.endForm()
+            self.cropmarkForms[cropmarks] = name
+        self.canvas.doForm(name)
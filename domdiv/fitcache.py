@@ -0,0 +1,115 @@
+###########################################################################
+# A cache of the text fitting results, kept in a file between runs
+#
+# Finding the font size that makes a card name fit its tab, or the text of a card fit the
+# body of the divider, is a search that only depends on the text, the size of the box and
+# the fonts.  With --fit-cache <file>, DividerDrawer keeps the results of those searches in
+# this file, so that later runs with the same box sizes look them up instead.
+#
+# The entries are keyed by a hash of everything the search depends on.  The fonts are
+# fingerprinted as a whole (see font_hash()); a cache written with other fonts is started
+# over.  Only the max_entries most recently used entries are kept when the file is saved.
+# A run that only looks entries up leaves the file alone, their last use is only written
+# along with new entries.
+###########################################################################
+from __future__ import print_function
+
+import hashlib
+import json
+import os
+import tempfile
+
+CACHE_MAGIC = 'domdiv-fit-cache 1'
+MAX_ENTRIES = 20000
+replace_file = getattr(os, 'replace', os.rename)  # python 2 has no os.replace, os.rename replaces on posix
+FONT_HASHES = {}  # font files and extra -> font_hash, the fonts are only read once in a process
+
+
+def font_hash(font_files, extra=()):
+    # Fingerprint of the font files and anything else (e.g. the reportlab version for its
+    # built in fonts) the fitting depends on
+    key = (tuple(sorted(font_files)), repr(tuple(extra)))
+    if key not in FONT_HASHES:
+        fingerprint = hashlib.sha1()
+        for path in key[0]:
+            with open(path, 'rb') as font_file:
+                fingerprint.update(hashlib.sha1(font_file.read()).digest())
+        for value in extra:
+            fingerprint.update(repr(value).encode('utf-8'))
+        FONT_HASHES[key] = fingerprint.hexdigest()
+    return FONT_HASHES[key]
+
+
+def file_mode(path):
+    # The permissions of the file at path, or the ones a new file gets (0666 less the umask)
+    try:
+        return os.stat(path).st_mode & 0o777
+    except OSError:
+        umask = os.umask(0)
+        os.umask(umask)
+        return 0o666 & ~umask
+
+
+def entry_key(key):
+    return hashlib.sha1(json.dumps(key, sort_keys=True, separators=(',', ':')).encode('utf-8')).hexdigest()
+
+
+class FitCache(object):
+
+    def __init__(self, path, fonts, max_entries=MAX_ENTRIES):
+        # fonts is the font_hash() of the fonts the entries are for
+        self.path = path
+        self.fonts = fonts
+        self.max_entries = max_entries
+        self.entries = {}  # entry_key -> [last use, value]
+        self.clock = 0
+        self.changed = False
+        try:
+            with open(path) as cache_file:
+                content = json.load(cache_file)
+        except (IOError, OSError, ValueError):
+            return
+        if content.get('magic') == CACHE_MAGIC and content.get('fonts') == fonts:
+            self.entries = content['entries']
+            self.clock = content['clock']
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        # The value stored for key, a json serializable value, or None
+        entry = self.entries.get(entry_key(key))
+        if entry is None:
+            return None
+        self.clock += 1
+        entry[0] = self.clock
+        return entry[1]
+
+    def put(self, key, value):
+        self.clock += 1
+        self.entries[entry_key(key)] = [self.clock, value]
+        self.changed = True
+
+    def save(self):
+        # Only if entries were put.  The file is written next to the cache and then moved over it,
+        # so other runs never read a half written cache.  It keeps the permissions of the old file
+        # (mkstemp makes the temporary file private).
+        if not self.changed:
+            return
+        if len(self.entries) > self.max_entries:
+            newest = sorted(self.entries.items(), key=lambda item: item[1][0])[-self.max_entries:]
+            self.entries = dict(newest)
+        directory = os.path.dirname(os.path.abspath(self.path))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        handle, temp_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(self.path), suffix='.tmp')
+        try:
+            with os.fdopen(handle, 'w') as cache_file:
+                json.dump({'magic': CACHE_MAGIC, 'fonts': self.fonts, 'clock': self.clock, 'entries': self.entries},
+                          cache_file, separators=(',', ':'))
+            os.chmod(temp_path, file_mode(self.path))
+            replace_file(temp_path, self.path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+        self.changed = False
@@ -0,0 +1,159 @@
+###########################################################################
+# Thumbnails of the dividers
+#
+# export() draws each divider of a set of options on a page of its own (see
+# DividerDrawer.drawSingleDivider), rasterizes it and saves it as a png in a directory.
+# With several languages, each of them gets its own thumbnails, named after the language.
+# The dividers are laid out once, and drawn by a pool of processes forked after that, so
+# the workers share the layout (without fork, they are drawn in the process itself).  A
+# manifest in the directory keeps the fingerprint each png was drawn from, so the dividers
+# that have not changed since the last export are left alone.  Optionally the pngs are
+# also put together into a single sprite sheet, with a json index of where each divider is on it.
+#
+# Rasterizing needs wand, like --preview.  The sprite sheet is put together with Pillow.
+###########################################################################
+from __future__ import print_function, absolute_import
+
+import hashlib
+import json
+import multiprocessing
+import os
+import re
+from collections import Counter
+from io import BytesIO
+
+from . import main
+from .cards import Card
+from .draw import DividerDrawer
+
+MANIFEST = 'thumbnails.json'  # png file name -> fingerprint of the divider it shows
+SPRITE = 'sprite.png'
+SPRITE_INDEX = 'sprite.json'
+LAYOUTS = []  # the layouts of the export in progress, for render in the processes forked from it
+
+
+def layout(options):
+    # For each language of the options: the drawer with the pages laid out, all of their dividers
+    # in order and the Card.getClassState to draw them with
+    layouts = []
+    for language in options.languages:
+        languageOptions = options.replace(language=language, languages=[language])
+        cards = main.selected_cards(languageOptions)
+        dd = DividerDrawer(main.calculate_dimensions(languageOptions))
+        dd.calculatePages(cards)
+        layouts.append((dd, [item for hMargin, vMargin, page in dd.pages for item in page], Card.getClassState()))
+    return layouts
+
+
+def thumbnails(dd, items, prefix=''):
+    # (png file name, index into items, isBack) of each thumbnail, the backs too if the dividers have them
+    sides = [False, True] if dd.hasBacks() else [False]
+    seen = Counter()
+    for index, item in enumerate(items):
+        for isBack in sides:
+            name = '{}{}-{}'.format(prefix, re.sub(r'\W+', '_', item.card.card_tag), 'back' if isBack else 'front')
+            seen[name] += 1
+            if seen[name] > 1:
+                # another divider of the same card
+                name = '{}-{}'.format(name, seen[name])
+            yield name + '.png', index, isBack
+
+
+def render(args):
+    # Draw and rasterize some of the thumbnails of export(), from its LAYOUTS
+    directory, dpi, jobs = args
+    for name, number, index, isBack in jobs:
+        dd, items, state = LAYOUTS[number]
+        Card.setClassState(state)
+        dd.options.outfile = BytesIO()
+        dd.drawSingleDivider(items[index], isBack)
+        with open(os.path.join(directory, name), 'wb') as png:
+            png.write(main.rasterize(dd.options.outfile.getvalue(), dpi))
+    return len(jobs)
+
+
+def write_sprite(directory, names, columns=None):
+    # Put the pngs side by side into rows, each row as high as its highest png
+    from PIL import Image
+    images = [Image.open(os.path.join(directory, name)) for name in names]
+    columns = columns or max(1, int(len(images) ** 0.5 + 0.5))
+    index = {}
+    width = height = 0
+    for start in range(0, len(images), columns):
+        x = 0
+        for name, image in zip(names[start:start + columns], images[start:start + columns]):
+            index[name] = {'x': x, 'y': height, 'width': image.size[0], 'height': image.size[1]}
+            x += image.size[0]
+        width = max(width, x)
+        height += max(image.size[1] for image in images[start:start + columns])
+
+    sprite = Image.new('RGBA', (width, height), (255, 255, 255, 0))
+    for name, image in zip(names, images):
+        sprite.paste(image, (index[name]['x'], index[name]['y']))
+    sprite.save(os.path.join(directory, SPRITE))
+    with open(os.path.join(directory, SPRITE_INDEX), 'w') as index_file:
+        json.dump({'image': SPRITE, 'width': width, 'height': height, 'thumbnails': index},
+                  index_file, indent=2, sort_keys=True)
+
+
+def export(options, directory, dpi=72, sprite=False, workers=None):
+    # Make the thumbnails of all dividers of the (cleaned) options in directory, at dpi.  workers is the
+    # number of processes to draw them in, by default one for each cpu.  Returns the png file names in order.
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    state = Card.getClassState()
+    try:
+        LAYOUTS[:] = layout(options)
+        return export_layouts(directory, dpi, sprite, workers)
+    finally:
+        del LAYOUTS[:]
+        Card.setClassState(state)
+
+
+def export_layouts(directory, dpi, sprite, workers):
+    manifest_path = os.path.join(directory, MANIFEST)
+    try:
+        with open(manifest_path) as manifest_file:
+            previous = json.load(manifest_file)
+    except (IOError, OSError, ValueError):
+        previous = {}
+
+    manifest = {}
+    names = []
+    jobs = []
+    for number, (dd, items, state) in enumerate(LAYOUTS):
+        Card.setClassState(state)
+        dd.registerFonts()
+        drawing = dd.drawingFingerprint()
+        prefix = dd.options.language + '-' if len(LAYOUTS) > 1 else ''
+        for name, index, isBack in thumbnails(dd, items, prefix):
+            data = json.dumps([drawing, dd.dividerFingerprint(items[index], isBack), dpi], sort_keys=True,
+                              default=repr)
+            manifest[name] = hashlib.sha1(data.encode('utf-8')).hexdigest()
+            names.append(name)
+            if previous.get(name) != manifest[name] or not os.path.exists(os.path.join(directory, name)):
+                jobs.append((name, number, index, isBack))
+
+    if jobs:
+        workers = min(workers or multiprocessing.cpu_count(), len(jobs))
+        if workers == 1 or 'fork' not in multiprocessing.get_all_start_methods():
+            render((directory, dpi, jobs))
+        else:
+            pool = multiprocessing.get_context('fork').Pool(workers)
+            try:
+                pool.map(render, [(directory, dpi, jobs[i::workers]) for i in range(workers)])
+            finally:
+                pool.close()
+                pool.join()
+
+    # the thumbnails of dividers that are gone
+    for name in previous:
+        if name not in manifest and os.path.exists(os.path.join(directory, name)):
+            os.remove(os.path.join(directory, name))
+    with open(manifest_path, 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2, sort_keys=True)
+
+    if sprite:
+        write_sprite(directory, names)
+    print("Drew {} of {} thumbnails into {}".format(len(jobs), len(names), directory))
+    return names
@@ -9,14 +9,17 @@ import copy
 import fnmatch
 import pkg_resources
 import unicodedata
-from collections import Counter, defaultdict
+from collections import Counter, defaultdict, namedtuple
+from io import BytesIO
 
 import reportlab.lib.pagesizes as pagesizes
 from reportlab.lib.units import cm
 
 from .cards import Card
 from .cards import CardType
-from .draw import DividerDrawer
+from .draw import DividerDrawer, LRUCache
+from . import sqlitedb
+from . import textindex
 
 LOCATION_CHOICES = ["tab", "body-top", "hide"]
 NAME_ALIGN_CHOICES = ["left", "right", "centre", "edge"]
@@ -35,7 +38,16 @@ EXPANSION_CHOICES = ["adventures", "alchemy", "base", "cornucopia", "dark ages",
 FAN_CHOICES = ["animals"]
 ORDER_CHOICES = ["expansion", "global", "colour", "cost"]
 
+# The options that decide which dividers there are
+SELECTION_OPTIONS = ['base_cards_with_expansion', 'cardlist', 'curse10', 'edition', 'exclude_events',
+                     'exclude_landmarks', 'exclude_prizes', 'expansion_dividers', 'expansion_dividers_long_name',
+                     'expansions', 'fan', 'include_blanks', 'language', 'no_trash', 'order', 'special_card_groups',
+                     'start_decks', 'upgrade_with_expansion']
+SELECTED_CARDS = LRUCache(16)  # selection_key -> the selected cards and their Card.getClassState, see selected_cards
+TAB_PLANS = LRUCache(64)  # selection_key and TAB_OPTIONS -> card_tag -> tab of its first divider (render_divider)
+
 LANGUAGE_DEFAULT = 'en_us'  # the primary language used if a language's parts are missing
+CARD_TEXT_FIELDS = ['name', 'description', 'extra']
 LANGUAGE_XX = 'xx'          # a dummy language for starting translations
 
 
@@ -59,10 +71,58 @@ def get_languages(path):
 LANGUAGE_CHOICES = get_languages("card_db")
 
 
+# Contents of package resources that have been read ahead of time (see preload_resources), keyed by path
+RESOURCE_CACHE = {}
+
+
+# The parsed card, set and type databases and the set and type text of the languages (see parsed_resource),
+# keyed by path
+PARSED_RESOURCES = {}
+
+
+# Offset indexed card text files that have been opened (see get_card_text_index), keyed by language
+CARD_TEXT_INDEXES = {}
+
+# SQLite card databases that have been opened (see get_card_database), keyed by path
+CARD_DATABASES = {}
+
+
 def get_resource_stream(path):
+    if path in RESOURCE_CACHE:
+        return codecs.EncodedFile(BytesIO(RESOURCE_CACHE[path]), "utf-8")
     return codecs.EncodedFile(pkg_resources.resource_stream('domdiv', path), "utf-8")
 
 
+def parsed_resource(path):
+    # The parsed json of a package resource, only parsed the first time.  It is shared by everyone
+    # who asks for it, so it must not be changed.
+    if path not in PARSED_RESOURCES:
+        with get_resource_stream(path) as resource_file:
+            PARSED_RESOURCES[path] = json.loads(resource_file.read().decode('utf-8'))
+    return PARSED_RESOURCES[path]
+
+
+def preload_resources(languages=None):
+    # Read the card, set, type and label databases plus the text files of the given languages
+    # (default: all of them) into memory, so later requests never go back to the package resources.
+    # The card, set and type databases and the set and type text are parsed as well (see parsed_resource).
+    if languages is None:
+        languages = LANGUAGE_CHOICES
+    paths = [os.path.join("card_db", name) for name in
+             ["cards_db.json", "sets_db.json", "types_db.json", "labels_db.json"]]
+    for language in set([LANGUAGE_DEFAULT] + list(languages)):
+        language = language.lower()
+        for kind in ["cards", "sets", "types", "bonuses"]:
+            paths.append(os.path.join("card_db", language, "{}_{}.json".format(kind, language)))
+    for path in paths:
+        if path not in RESOURCE_CACHE and pkg_resources.resource_exists('domdiv', path):
+            RESOURCE_CACHE[path] = pkg_resources.resource_string('domdiv', path)
+            name = os.path.basename(path)
+            if name in ["cards_db.json", "sets_db.json", "types_db.json"] or name.split('_')[0] in ["sets", "types"]:
+                parsed_resource(path)
+    return RESOURCE_CACHE
+
+
 # Load Label information
 LABEL_INFO = None
 LABEL_CHOICES = []
@@ -79,12 +139,84 @@ for label in LABEL_INFO:
         LABEL_CHOICES.extend(label['names'])
 
 
+# The argparse parser of the command line options, its help text, and the defaults and actions of the
+# options, see get_parser
+PARSER_CACHE = {}
+# What options_from_dict needs to know about an option: the argparse Action that add_argument returned for it,
+# and the kind of action it was added with ('store', 'store_true', 'append', ...)
+OptionAction = namedtuple('OptionAction', ['action', 'kind'])
+
+
+class FrozenDict(dict):
+    # A dict that can't be changed, for the dicts in Options.  It still pickles, copies and
+    # converts to json like a dict.
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError("Can't change the dict, the options are read only after clean_opts")
+
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = _read_only
+
+    def __reduce__(self):
+        return FrozenDict, (dict(self), )
+
+
+def frozen(value):
+    # A copy of an option value that can't be changed: lists become tuples and dicts FrozenDicts, also inside them
+    if isinstance(value, (list, tuple)):
+        return tuple(frozen(item) for item in value)
+    if isinstance(value, dict):
+        return FrozenDict((key, frozen(item)) for key, item in value.items())
+    return value
+
+
+class Options(argparse.Namespace):
+    # The options after clean_opts.  They can't be changed any more, so the same options can be shared
+    # between jobs, kept in caches and used again.  replace() gives a copy with some of them changed,
+    # and a DividerDrawer works on a copy of its own with the sizes of the layout added (see calculate_dimensions).
+    # Their lists are tuples and their dicts FrozenDicts, so they can't be changed in place either.
+
+    def __init__(self, **kwargs):
+        self.__dict__.update((name, frozen(value)) for name, value in kwargs.items())
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Can't set {}, the options are read only after clean_opts".format(name))
+
+    def __delattr__(self, name):
+        raise AttributeError("Can't delete {}, the options are read only after clean_opts".format(name))
+
+    def replace(self, **changes):
+        # A copy of the options with some of them changed.  These are not cleaned again.
+        values = dict(vars(self))
+        values.update(changes)
+        return Options(**values)
+
+
 def add_opt(options, option, value):
     assert not hasattr(options, option)
     setattr(options, option, value)
 
 
-def parse_opts(cmdline_args=None):
+class OptionGroup(object):
+    # An argument group of the parser that also keeps the OptionAction of each option added to it
+    # in actions, under its dest and its option names
+
+    def __init__(self, group, actions):
+        self.group = group
+        self.actions = actions
+
+    def add_argument(self, *args, **kwargs):
+        action = self.group.add_argument(*args, **kwargs)
+        option = OptionAction(action, kwargs.get('action', 'store'))
+        for name in [action.dest] + list(action.option_strings):
+            self.actions[name.lstrip('-').replace('-', '_')] = option
+        return action
+
+
+def build_parser(actions=None):
+    # The parser of the command line options.  Given a dict for actions, the OptionAction of each option
+    # goes into it (see OptionGroup).
+    if actions is None:
+        actions = {}
     parser = argparse.ArgumentParser(
         formatter_class=argparse.ArgumentDefaultsHelpFormatter,
         description="Generate Dominion Dividers",
@@ -92,9 +224,9 @@ def parse_opts(cmdline_args=None):
         "An online version can be found at 'http://domtabs.sandflea.org/'. ")
 
     # Basic Divider Information
-    group_basic = parser.add_argument_group(
+    group_basic = OptionGroup(parser.add_argument_group(
         'Basic Divider Options',
-        'Basic choices for the dividers.')
+        'Basic choices for the dividers.'), actions)
     group_basic.add_argument(
         '--outfile', '-o',
         dest="outfile",
@@ -110,9 +242,11 @@ def parse_opts(cmdline_args=None):
     group_basic.add_argument(
         "--language", "-l",
         dest="language",
+        nargs="+",
         default=LANGUAGE_DEFAULT,
         choices=LANGUAGE_CHOICES,
-        help="Language of divider text.")
+        help="Language of divider text. With several languages, the document has the dividers "
+        "in each of them, one language after the other.")
     group_basic.add_argument(
         "--orientation",
         choices=["horizontal", "vertical"],
@@ -142,9 +276,9 @@ def parse_opts(cmdline_args=None):
         " 'cost' will sort by expansion, then card cost, then name.")
 
     # Divider Body
-    group_body = parser.add_argument_group(
+    group_body = OptionGroup(parser.add_argument_group(
         'Divider Body',
-        'Changes what is displayed on the body of the dividers.')
+        'Changes what is displayed on the body of the dividers.'), actions)
     group_body.add_argument(
         "--front",
         choices=TEXT_CHOICES,
@@ -177,9 +311,9 @@ def parse_opts(cmdline_args=None):
         help="Display card type on the body of the divider.")
 
     # Divider Tab
-    group_tab = parser.add_argument_group(
+    group_tab = OptionGroup(parser.add_argument_group(
         'Divider Tab',
-        'Changes what is displayed on on the Divider Tab.')
+        'Changes what is displayed on on the Divider Tab.'), actions)
     group_tab.add_argument(
         "--tab-side",
         choices=TAB_SIDE_CHOICES,
@@ -256,9 +390,9 @@ def parse_opts(cmdline_args=None):
         help="Use text/letters to represent a card's set instead of the set icon.")
 
     # Expanion Dividers
-    group_expansion = parser.add_argument_group(
+    group_expansion = OptionGroup(parser.add_argument_group(
         'Expansion Dividers',
-        'Adding separator dividers for each expansion.')
+        'Adding separator dividers for each expansion.'), actions)
     group_expansion.add_argument(
         "--expansion-dividers",
         action="store_true",
@@ -284,9 +418,9 @@ def parse_opts(cmdline_args=None):
         "Without this, the shorter expansion name is used on the expansion divider tab.")
 
     # Divider Selection
-    group_select = parser.add_argument_group(
+    group_select = OptionGroup(parser.add_argument_group(
         'Divider Selection',
-        'What expansions are used, and grouping of dividers.')
+        'What expansions are used, and grouping of dividers.'), actions)
     group_select.add_argument(
         "--expansions", "--expansion",
         nargs="*",
@@ -375,9 +509,9 @@ def parse_opts(cmdline_args=None):
         help="Group all 'Landmark' cards across all expansions into one divider.")
 
     # Divider Sleeves/Wrappers
-    group_wrapper = parser.add_argument_group(
+    group_wrapper = OptionGroup(parser.add_argument_group(
         'Card Sleeves/Wrappers',
-        'Generating dividers that are card sleeves/wrappers.')
+        'Generating dividers that are card sleeves/wrappers.'), actions)
     group_wrapper.add_argument(
         "--wrapper",
         action="store_true",
@@ -413,11 +547,18 @@ def parse_opts(cmdline_args=None):
         action="store_true",
         dest="notch",
         help="Same as --notch_length thickness 1.5.")
+    group_wrapper.add_argument(
+        "--pack-wrappers",
+        action="store_true",
+        dest="pack_wrappers",
+        help="Fit more wrappers on a page by packing them in rows, each row only as high as the tallest "
+        "wrapper in it, rather than leaving room for the tallest wrapper of all everywhere. "
+        "The wrappers stay in order. Only with --rotate 0 or 180.")
 
     # Printing
-    group_printing = parser.add_argument_group(
+    group_printing = OptionGroup(parser.add_argument_group(
         'Printing',
-        'Changes how the Dividers are printed.')
+        'Changes how the Dividers are printed.'), actions)
     group_printing.add_argument(
         "--minmargin",
         dest="minmargin",
@@ -530,10 +671,50 @@ def parse_opts(cmdline_args=None):
         type=int,
         default=150,
         help="resolution in DPI to render preview at, for --preview option")
+    group_printing.add_argument(
+        "--thumbnails",
+        dest="thumbnails",
+        help="Instead of the pdf, write a png thumbnail of each divider into this directory. "
+        "Dividers that did not change since the last time are not drawn again.")
+    group_printing.add_argument(
+        "--thumbnail-dpi",
+        type=int,
+        default=72,
+        dest="thumbnail_dpi",
+        help="resolution in DPI of the --thumbnails (default %(default)s).")
+    group_printing.add_argument(
+        "--thumbnail-sprite",
+        action="store_true",
+        dest="thumbnail_sprite",
+        help="Also put the --thumbnails together into sprite.png, with their positions in sprite.json.")
+    group_printing.add_argument(
+        "--thumbnail-workers",
+        type=int,
+        default=0,
+        dest="thumbnail_workers",
+        help="Number of processes drawing the --thumbnails (default: one for each cpu).")
+    group_printing.add_argument(
+        "--image-dpi",
+        type=int,
+        dest="image_dpi",
+        default=0,
+        help="Resample the images down to this resolution in DPI at the size they are printed. "
+        "0 keeps the original images.")
+    group_printing.add_argument(
+        "--no-page-compression",
+        action="store_true",
+        dest="no_page_compression",
+        help="Do not compress the page contents of the PDF.")
+    group_printing.add_argument(
+        "--optimize-size",
+        action="store_true",
+        dest="optimize_size",
+        help="Make the PDF as small as practical: compressed pages, binary rather than ASCII encoded "
+        "streams and images at 300 DPI unless --image-dpi is given.")
     # Special processing
-    group_special = parser.add_argument_group(
+    group_special = OptionGroup(parser.add_argument_group(
         'Miscellaneous',
-        'These options are generally not used.')
+        'These options are generally not used.'), actions)
     group_special.add_argument(
         "--cardlist",
         dest="cardlist",
@@ -543,15 +724,140 @@ def parse_opts(cmdline_args=None):
         action="store_true",
         dest="write_json",
         help="Write json version of card definitions and extras.")
+    group_special.add_argument(
+        "--incremental",
+        action="store_true",
+        dest="incremental",
+        help="Only draw the pages that changed since the last time this output file was generated, "
+        "copying the others from the existing file. Needs the pdfrw package.")
+    group_special.add_argument(
+        "--layout-only",
+        action="store_true",
+        dest="layout_only",
+        help="Do not draw anything, just write the page layout (pages, divider positions, rotations, "
+        "tabs and crop marks) as json, to the output file name with a .json extension.")
+    group_special.add_argument(
+        "--card-database",
+        dest="card_database",
+        help="Read the cards, sets, types and their text from this SQLite database built with "
+        "domdiv/sqlitedb.py instead of from the json files.")
+    group_special.add_argument(
+        "--layout-workers",
+        type=int,
+        default=0,
+        dest="layout_workers",
+        help="Fit the text of the dividers to them in this many processes before drawing "
+        "(default %(default)s: fit each text while drawing it).")
+    group_special.add_argument(
+        "--fit-cache",
+        dest="fit_cache",
+        help="Keep the font sizes that fit the names and text of the dividers in this file, "
+        "and reuse them in later runs.")
 
-    options = parser.parse_args(args=cmdline_args)
-    # Need to do these while we have access to the parser
+    return parser
+
+
+def get_parser():
+    # The parser of the command line options.  It is built the first time it is needed and kept
+    # in PARSER_CACHE, along with the defaults of all options and the OptionAction of each one.
+    if 'parser' not in PARSER_CACHE:
+        actions = {}
+        parser = build_parser(actions)
+        PARSER_CACHE['defaults'] = vars(parser.parse_args([]))
+        PARSER_CACHE['actions'] = actions
+        PARSER_CACHE['parser'] = parser
+    return PARSER_CACHE['parser']
+
+
+def get_help():
+    if 'help' not in PARSER_CACHE:
+        PARSER_CACHE['help'] = get_parser().format_help()
+    return PARSER_CACHE['help']
+
+
+def parse_opts(cmdline_args=None):
+    options = get_parser().parse_args(args=cmdline_args)
     options.argv = sys.argv if options.info or options.info_all else None
-    options.help = parser.format_help() if options.info_all else None
+    options.help = get_help() if options.info_all else None
     return options
 
 
+def option_value(option, value):
+    # A value given for an option (its OptionAction) in options_from_dict, checked and converted like argparse would
+    action = option.action
+
+    def convert(item):
+        if action.type is not None and item is not None and not isinstance(item, action.type):
+            try:
+                item = action.type(item)
+            except (TypeError, ValueError):
+                raise ValueError("Invalid value for {}: {!r}".format(action.option_strings[0], item))
+        if action.choices is not None and item not in action.choices:
+            raise ValueError("Invalid choice for {}: {!r} (choose from {})".format(
+                action.option_strings[0], item, ", ".join(repr(c) for c in action.choices)))
+        return item
+
+    if option.kind in ['store_true', 'store_false']:
+        return bool(value)
+    if value is None:
+        return None
+    if option.kind == 'append' and action.nargs in ['*', '+']:
+        # a list of lists, one for each time the option was given
+        if not isinstance(value, (list, tuple)):
+            value = [value]
+        if not all(isinstance(item, (list, tuple)) for item in value):
+            value = [value]
+        return [[convert(item) for item in items] for items in value]
+    if option.kind == 'append' or action.nargs in ['*', '+']:
+        if not isinstance(value, (list, tuple)):
+            value = [value]
+        return [convert(item) for item in value]
+    return convert(value)
+
+
+def options_from_dict(values):
+    # The options for values, a dict of option names (the dest, like 'tab_side' or 'text_front', or as on
+    # the command line, like 'tab-side' or '--front') to their values, without going through the argparse parser.
+    # Options that are not given have their default.  A value is what the option ends up as after
+    # parsing, e.g. {'expansions': ['base', 'intrigue'], 'cost': ['tab', 'body-top']}; strings are
+    # converted to the type of the option.  Raises ValueError for unknown options and invalid values.
+    # Like the result of parse_opts, the options still need to be passed through clean_opts.
+    get_parser()
+    actions = PARSER_CACHE['actions']
+    options = argparse.Namespace()
+    for dest, default in PARSER_CACHE['defaults'].items():
+        setattr(options, dest, copy.deepcopy(default))
+    for name, value in values.items():
+        option = actions.get(name.lstrip('-').replace('-', '_'))
+        if option is None:
+            raise ValueError("Unknown option: {}".format(name))
+        setattr(options, option.action.dest, option_value(option, value))
+    options.argv = sys.argv if options.info or options.info_all else None
+    options.help = get_help() if options.info_all else None
+    return options
+
+
+def flatten_names(names):
+    # The lowercase names of --expansions and --fan, given as a list of lists (one for each time
+    # the option was used) or, when the options are cleaned again, already as one list
+    flat = []
+    for item in names:
+        flat.extend([name.lower() for name in item] if isinstance(item, (list, tuple)) else [item.lower()])
+    return flat
+
+
 def clean_opts(options):
+    # Normalizes the options from parse_opts (or options_from_dict) and returns them as read only Options.
+    # Options that are already clean are returned as they are.  Raises ValueError for options that conflict.
+    if isinstance(options, Options):
+        return options
+
+    # --language can give several languages, options.language is the first of them
+    if isinstance(options.language, list):
+        options.languages = options.language
+        options.language = options.languages[0]
+    elif options.language not in getattr(options, 'languages', []):
+        options.languages = [options.language]
 
     if "center" in options.tab_side:
         options.tab_side = str(options.tab_side).replace("center", "centre")
@@ -618,7 +924,7 @@ def clean_opts(options):
         options.expansions = ['*']
     else:
         # options.expansions is a list of lists.  Reduce to single lowercase list
-        options.expansions = [item.lower() for sublist in options.expansions for item in sublist]
+        options.expansions = flatten_names(options.expansions)
     if 'none' in options.expansions:
         # keyword to indicate no options.  Same as --expansions without any expansions given.
         options.expansions = []
@@ -628,11 +934,20 @@ def clean_opts(options):
         options.fan = []
     else:
         # options.fan is a list of lists.  Reduce to single lowercase list
-        options.fan = [item.lower() for sublist in options.fan for item in sublist]
+        options.fan = flatten_names(options.fan)
     if 'none' in options.fan:
         # keyword to indicate no options.  Same as --fan without any expansions given
         options.fan = []
 
+    if getattr(options, 'preview', False) and len(options.languages) > 1:
+        raise ValueError("--preview is one page in one language, it can't be used with several --language")
+
+    if options.optimize_size:
+        if options.no_page_compression:
+            raise ValueError("--optimize-size compresses the pages, it can't be used with --no-page-compression")
+        if options.image_dpi <= 0:
+            options.image_dpi = 300
+
     if options.tabs_only and options.label_name is None:
         # default is Avery 8867
         options.label_name = "8867"
@@ -641,7 +956,7 @@ def clean_opts(options):
     if options.label_name is not None:
         for label in LABEL_INFO:
             if options.label_name.upper() in [n.upper() for n in label['names']]:
-                options.label = label
+                options.label = dict(label)  # a copy, the defaults below are not for all uses of LABEL_INFO
                 break
 
         assert options.label is not None, "Label '{}' not defined".format(options.label_name)
@@ -684,7 +999,7 @@ def clean_opts(options):
             options.tab_side = "full"
         options.label = label
 
-    return options
+    return Options(**vars(options))
 
 
 def parseDimensions(dimensionsStr):
@@ -692,18 +1007,24 @@ def parseDimensions(dimensionsStr):
     return (float(x) * cm, float(y) * cm)
 
 
-def generate_sample(options):
-    from io import BytesIO
+def rasterize(pdf, resolution):
+    # The pdf (its first page) as a png at resolution dpi
     from wand.image import Image
+    image_out = BytesIO()
+    with Image(blob=pdf, resolution=resolution) as image:
+        image.format = 'png'
+        image.save(image_out)
+        return image_out.getvalue()
+
+
+def generate_sample(options):
+    # The first page of the dividers as a png.  It is in one language, so only one can be asked for.
+    options = clean_opts(options)
+    if len(options.languages) > 1:
+        raise ValueError("A sample is one page in one language, not {}".format(', '.join(options.languages)))
     buf = BytesIO()
-    options.num_pages = 1
-    options.outfile = buf
-    generate(options)
-    sample_out = BytesIO()
-    with Image(blob=buf.getvalue(), resolution=options.preview_resolution) as sample:
-        sample.format = 'png'
-        sample.save(sample_out)
-        return sample_out.getvalue()
+    generate(options.replace(num_pages=1, outfile=buf))
+    return rasterize(buf.getvalue(), options.preview_resolution)
 
 
 def parse_papersize(spec):
@@ -773,10 +1094,13 @@ def find_index_of_object(lst=[], attributes={}):
 
 def read_card_data(options):
 
+    database = get_card_database(options)
+
     # Read in the card types
-    types_db_filepath = os.path.join("card_db", "types_db.json")
-    with get_resource_stream(types_db_filepath) as typefile:
-        Card.types = json.loads(typefile.read().decode('utf-8'), object_hook=CardType.decode_json)
+    if database:
+        Card.types = [CardType.decode_json(t) for t in database.types()]
+    else:
+        Card.types = [CardType.decode_json(t) for t in parsed_resource(os.path.join("card_db", "types_db.json"))]
     assert Card.types, "Could not load any card types from database"
 
     # extract unique types
@@ -791,21 +1115,24 @@ def read_card_data(options):
     # turn Card.types into a dictionary for later
     Card.types = dict(((c.getTypeNames(), c) for c in Card.types))
 
-    # Read in the card database
-    card_db_filepath = os.path.join("card_db", "cards_db.json")
-    with get_resource_stream(card_db_filepath) as cardfile:
-        cards = json.loads(cardfile.read().decode('utf-8'), object_hook=Card.decode_json)
-    assert cards, "Could not load any cards from database"
-
-    set_db_filepath = os.path.join("card_db", "sets_db.json")
-    with get_resource_stream(set_db_filepath) as setfile:
-        Card.sets = json.loads(setfile.read().decode('utf-8'))
+    if database:
+        Card.sets = database.sets()
+    else:
+        # a copy, the sets get the text of the language and more added to them
+        Card.sets = copy.deepcopy(parsed_resource(os.path.join("card_db", "sets_db.json")))
     assert Card.sets, "Could not load any sets from database"
     for s in Card.sets:
         # Make sure these are set either True or False
         Card.sets[s]['no_randomizer'] = Card.sets[s].get('no_randomizer', False)
         Card.sets[s]['fan'] = Card.sets[s].get('fan', False)
 
+    # Read in the card database, from a database only the cards the options can select
+    if database:
+        cards = [Card.decode_json(c) for c in database.cards_in_sets(*database_selection(options))]
+    else:
+        cards = [Card.decode_json(c) for c in parsed_resource(os.path.join("card_db", "cards_db.json"))]
+    assert cards, "Could not load any cards from database"
+
     # Remove the Trash card. Do early before propagating to various sets.
     if options.no_trash:
         i = find_index_of_object(cards, {'card_tag': 'Trash'})
@@ -965,8 +1292,81 @@ class CardSorter(object):
         return self.sort_key(card)
 
 
-def add_card_text(cards, language='en_us'):
+def get_card_text_index(language):
+    # The offset indexed card text of the language (see textindex.py), None if there is no usable index
+    if language not in CARD_TEXT_INDEXES:
+        CARD_TEXT_INDEXES[language] = None
+        index_path = os.path.join("card_index", textindex.index_name(language))
+        if pkg_resources.resource_exists('domdiv', index_path):
+            card_text_filepath = os.path.join("card_db", language, "cards_" + language + ".json")
+            try:
+                CARD_TEXT_INDEXES[language] = textindex.CardTextIndex(
+                    pkg_resources.resource_filename('domdiv', index_path),
+                    pkg_resources.resource_filename('domdiv', card_text_filepath))
+            except ValueError as e:
+                print("Warning, not using the card text index, {}".format(e), file=sys.stderr)
+    return CARD_TEXT_INDEXES[language]
+
+
+def get_card_database(options):
+    # The SQLite card database of --card-database (see sqlitedb.py), None to read the json files.
+    # A database that was not built from the json files of this package is not used.  That is checked
+    # by the size and modification time of the json files kept in the database, see sqlitedb.source_changed.
+    if not options.card_database:
+        return None
+    if options.card_database not in CARD_DATABASES:
+        database = sqlitedb.CardDatabase(options.card_database)
+        sources = database.sources()
+        stale = ["{}/cards_{}.json".format(language, language) for language in LANGUAGE_CHOICES
+                 if "{}/cards_{}.json".format(language, language) not in sources]
+        for source, stamp in sources.items():
+            path = pkg_resources.resource_filename('domdiv', os.path.join("card_db", *source.split('/')))
+            if sqlitedb.source_changed(path, *stamp):
+                stale.append(source)
+        if stale:
+            print("Warning, the card database {} is out of date ({}), reading the json files instead".format(
+                options.card_database, ", ".join(sorted(stale))), file=sys.stderr)
+            database = None
+        CARD_DATABASES[options.card_database] = database
+    return CARD_DATABASES[options.card_database]
+
+
+# The cards read_card_data changes the counts of or removes, whichever sets are selected
+ADJUSTED_CARDS = ['Copper', 'Curse', 'Estate', 'Start Deck', 'Trash']
+
+
+def database_selection(options):
+    # The arguments of CardDatabase.cards_in_sets for the cards the options can select, so that only those
+    # are read from the database: the cards of the wanted sets of the edition (and of the upgrades that go
+    # with them), all Events and Landmarks if they are grouped into one divider, and the ADJUSTED_CARDS.
+    # Needs Card.sets and Card.type_names.
+    if not isinstance(options, Options):
+        options = clean_opts(argparse.Namespace(**vars(options)))
+    pipeline = CardPipeline(options)
+    pipeline.plan()
+    cardset_tags = set(pipeline.wantedSets)
+    if options.upgrade_with_expansion:
+        cardset_tags.update(upgrade_tag for upgrade_tag, set_tag in UPGRADE_SETS.items() if set_tag in cardset_tags)
+    if pipeline.keep_sets is not None:
+        cardset_tags &= pipeline.keep_sets
+    types = []
+    if options.exclude_events:
+        types.append("Event")
+    if options.exclude_landmarks:
+        types.append("Landmark")
+    return sorted(cardset_tags), types, ADJUSTED_CARDS
+
+
+def read_card_text(language='en_us', card_tags=None, database=None):
+    # The card text of the language, only for the given card_tags if there is an index to look them up
     language = language.lower()
+    if database:
+        return database.card_text(language, card_tags)
+    if card_tags is not None:
+        index = get_card_text_index(language)
+        if index is not None:
+            return index.select(card_tags)
+
     # Read in the card text file
     card_text_filepath = os.path.join("card_db",
                                       language,
@@ -974,16 +1374,23 @@ def add_card_text(cards, language='en_us'):
     with get_resource_stream(card_text_filepath) as card_text_file:
         card_text = json.loads(card_text_file.read().decode('utf-8'))
     assert language, "Could not load card text for %r" % language
+    return card_text
+
+
+def set_card_text(card, card_text, fields=CARD_TEXT_FIELDS):
+    if card.card_tag in card_text:
+        for field in fields:
+            if field in card_text[card.card_tag]:
+                setattr(card, field, card_text[card.card_tag][field])
+
+
+def add_card_text(cards, language='en_us', fields=CARD_TEXT_FIELDS, card_text=None):
+    if card_text is None:
+        card_text = read_card_text(language, set(card.card_tag for card in cards))
 
     # Now apply to all the cards
     for card in cards:
-        if card.card_tag in card_text:
-            if 'name' in card_text[card.card_tag].keys():
-                card.name = card_text[card.card_tag]['name']
-            if 'description' in card_text[card.card_tag].keys():
-                card.description = card_text[card.card_tag]['description']
-            if 'extra' in card_text[card.card_tag].keys():
-                card.extra = card_text[card.card_tag]['extra']
+        set_card_text(card, card_text, fields)
     return cards
 
 
@@ -993,8 +1400,11 @@ def add_set_text(options, sets, language='en_us'):
     set_text_filepath = os.path.join("card_db",
                                      language,
                                      "sets_{}.json".format(language))
-    with get_resource_stream(set_text_filepath) as set_text_file:
-        set_text = json.loads(set_text_file.read().decode('utf-8'))
+    database = get_card_database(options)
+    if database:
+        set_text = database.set_text(language)
+    else:
+        set_text = parsed_resource(set_text_filepath)
     assert set_text, "Could not load set text for %r" % language
 
     # Now apply to all the sets
@@ -1005,14 +1415,16 @@ def add_set_text(options, sets, language='en_us'):
     return sets
 
 
-def add_type_text(types={}, language='en_us'):
+def add_type_text(types={}, language='en_us', database=None):
     language = language.lower()
     # Read in the type text and store for later
     type_text_filepath = os.path.join("card_db",
                                       language,
                                       "types_{}.json".format(language))
-    with get_resource_stream(type_text_filepath) as type_text_file:
-        type_text = json.loads(type_text_file.read().decode('utf-8'))
+    if database:
+        type_text = database.type_text(language)
+    else:
+        type_text = parsed_resource(type_text_filepath)
     assert type_text, "Could not load type text for %r" % language
 
     # Now apply to all the types
@@ -1035,8 +1447,12 @@ def add_bonus_regex(options, language='en_us'):
     bonus_regex_filepath = os.path.join("card_db",
                                         language,
                                         "bonuses_{}.json".format(language))
-    with get_resource_stream(bonus_regex_filepath) as bonus_regex_file:
-        bonus_regex = json.loads(bonus_regex_file.read().decode('utf-8'))
+    database = get_card_database(options)
+    if database:
+        bonus_regex = database.bonuses(language)
+    else:
+        with get_resource_stream(bonus_regex_filepath) as bonus_regex_file:
+            bonus_regex = json.loads(bonus_regex_file.read().decode('utf-8'))
     assert bonus_regex, "Could not load bonus keywords for %r" % language
 
     if not bonus_regex:
@@ -1045,7 +1461,9 @@ def add_bonus_regex(options, language='en_us'):
     return bonus_regex
 
 
-def combine_cards(cards, old_card_type, new_card_tag, new_cardset_tag, new_type):
+def combined_cards(cards, old_card_type, new_card_tag, new_cardset_tag, new_type):
+    # Generator version of combine_cards: passes on the cards that are not of old_card_type and
+    # yields the card that stands for all of those at the end.
 
     holder = Card(name='*Replace Later*',
                   card_tag=new_card_tag,
@@ -1055,155 +1473,32 @@ def combine_cards(cards, old_card_type, new_card_tag, new_cardset_tag, new_type)
                   count=0)
     holder.image = holder.setImage()
 
-    filteredCards = []
     for c in cards:
         if c.isType(old_card_type):
             holder.addCardCount(c.count)  # keep track of count and skip card
         else:
-            filteredCards.append(c)  # Not the right type, keep card
+            yield c  # Not the right type, keep card
 
     if holder.getCardCount() > 0:
-        filteredCards.append(holder)
-
-    return filteredCards
-
-
-def filter_sort_cards(cards, options):
-
-    # Filter out cards by edition
-    if options.edition and options.edition != "all":
-        keep_sets = []
-        for set_tag in Card.sets:
-            for edition in Card.sets[set_tag]["edition"]:
-                if options.edition == edition:
-                    keep_sets.append(set_tag)
-
-        keep_cards = []  # holds the cards that are to be kept
-        for card in cards:
-            if card.cardset_tag in keep_sets:
-                keep_cards.append(card)
-
-        cards = keep_cards
-
-    # Combine upgrade cards with their expansion
-    if options.upgrade_with_expansion:
-        for card in cards:
-            if card.cardset_tag == 'dominion2ndEditionUpgrade':
-                card.cardset_tag = 'dominion1stEdition'
-                options.expansions.append(card.cardset_tag.lower())
-            elif card.cardset_tag == 'intrigue2ndEditionUpgrade':
-                card.cardset_tag = 'intrigue1stEdition'
-                options.expansions.append(card.cardset_tag.lower())
-
-    # Combine all Events across all expansions
-    if options.exclude_events:
-        cards = combine_cards(cards,
-                              old_card_type="Event",
-                              new_type="Events",
-                              new_card_tag='events',
-                              new_cardset_tag='extras'
-                              )
-        if options.expansions:
-            options.expansions.append("extras")
-
-    # Combine all Landmarks across all expansions
-    if options.exclude_landmarks:
-        cards = combine_cards(cards,
-                              old_card_type="Landmark",
-                              new_type="Landmarks",
-                              new_card_tag='landmarks',
-                              new_cardset_tag='extras'
-                              )
-        if options.expansions:
-            options.expansions.append("extras")
-
-    # Take care of any blank cards
-    if options.include_blanks > 0:
-        if options.expansions:
-            options.expansions.append("extras")
+        yield holder
 
-    # FIX THIS: Combine all Prizes across all expansions
-    # if options.exclude_prizes:
-    #    cards = combine_cards(cards, 'Prize', 'prizes')
 
-    # Group all the special cards together
-    if options.special_card_groups:
-        keep_cards = []   # holds the cards that are to be kept
-        group_cards = {}  # holds the cards for each group
-        for card in cards:
-            if not card.group_tag:
-                keep_cards.append(card)  # not part of a group, so just keep the card
-            else:
-                # have a card in a group
-                if card.group_tag not in group_cards:
-                    # First card of a group
-                    group_cards[card.group_tag] = card  # save to update cost later
-                    # this card becomes the card holder for the whole group.
-                    card.card_tag = card.group_tag
-                    # These text fields should be updated later if there is a translation for this group_tag.
-                    error_msg = "ERROR: Missing language entry for group_tab '%s'." % card.group_tag
-                    card.name = card.group_tag  # For now, change the name to the group_tab
-                    card.description = error_msg
-                    card.extra = error_msg
-                    if card.isType('Event') or card.isType('Project'):
-                        card.cost = "*"
-                    if card.isType('Landmark'):
-                        card.cost = ""
-                    # now save the card
-                    keep_cards.append(card)
-                else:
-                    # subsequent cards in the group. Update group info, but don't keep the card.
-                    if card.group_top:
-                        # this is a designated card to represent the group, so update important data
-                        group_cards[card.group_tag].cost = card.cost
-                        group_cards[card.group_tag].potcost = card.potcost
-                        group_cards[card.group_tag].debtcost = card.debtcost
-                        group_cards[card.group_tag].types = card.types
-                        group_cards[card.group_tag].randomizer = card.randomizer
-                        group_cards[card.group_tag].image = card.image
-
-                    group_cards[card.group_tag].addCardCount(card.count)    # increase the count
-                    # group_cards[card.group_tag].set_lowest_cost(card)  # set holder to lowest cost of the two cards
-
-        cards = keep_cards
-
-        # Now fix up card costs
-        for card in cards:
-            if card.card_tag in group_cards:
-                if group_cards[card.group_tag].isType('Event') or group_cards[card.group_tag].isType('Project'):
-                    group_cards[card.group_tag].cost = "*"
-                    group_cards[card.group_tag].debtcost = 0
-                    group_cards[card.group_tag].potcost = 0
-                if group_cards[card.group_tag].isType('Landmark'):
-                    group_cards[card.group_tag].cost = ""
-                    group_cards[card.group_tag].debtcost = 0
-                    group_cards[card.group_tag].potcost = 0
-
-    # Get the final type names in the requested language
-    Card.type_names = add_type_text(Card.type_names, LANGUAGE_DEFAULT)
-    if options.language != LANGUAGE_DEFAULT:
-        Card.type_names = add_type_text(Card.type_names, options.language)
-    for card in cards:
-        card.types_name = ' - '.join([Card.type_names[t] for t in card.types]).upper()
+def combine_cards(cards, old_card_type, new_card_tag, new_cardset_tag, new_type):
+    return list(combined_cards(cards, old_card_type, new_card_tag, new_cardset_tag, new_type))
 
-    # Get the card bonus keywords in the requested language
-    bonus = add_bonus_regex(options, LANGUAGE_DEFAULT)
-    Card.addBonusRegex(bonus)
-    if options.language != LANGUAGE_DEFAULT:
-        bonus = add_bonus_regex(options, options.language)
-        Card.addBonusRegex(bonus)
 
-    # Fix up cardset text.  Waited as long as possible.
-    Card.sets = add_set_text(options, Card.sets, LANGUAGE_DEFAULT)
-    if options.language != LANGUAGE_DEFAULT:
-        Card.sets = add_set_text(options, Card.sets, options.language)
+def select_sets(options, expansions=None, fan=None):
+    # The sets requested by the expansion and fan options (or the given expansions and fan instead of them),
+    # needs the set text (for the set names)
+    expansions = options.expansions if expansions is None else expansions
+    fan = options.fan if fan is None else fan
+    wantedSets = set()  # Will hold all the sets requested for printing
 
     # Split out Official and Fan set information
     Official_sets = set()  # Will hold official sets
     Official_search = []  # Will hold official sets for searching, both set key and set_name
     Fan_sets = set()  # Will hold fan sets
     Fan_search = []  # Will hold fan sets for searching, both set key and set_name
-    wantedSets = set()  # Will hold all the sets requested for printing
     for s in Card.sets:
         if Card.sets[s].get("fan", False):
             # Fan Expansion
@@ -1216,10 +1511,10 @@ def filter_sort_cards(cards, options):
 
     # If expansion names given, then find out which expansions are requested
     # Expansion names can be the names from the language or the cardset_tag
-    if options.expansions:
+    if expansions:
         # Expand out any wildcards, matching set key or set name in the given language
         expanded_expansions = []
-        for e in options.expansions:
+        for e in expansions:
             matches = fnmatch.filter(Official_search, e)
             if matches:
                 expanded_expansions.extend(matches)
@@ -1227,25 +1522,25 @@ def filter_sort_cards(cards, options):
                 expanded_expansions.append(e)
 
         # Now get the actual sets that are matched above
-        options.expansions = set([e for e in expanded_expansions])  # Remove duplicates
+        expansions = set([e for e in expanded_expansions])  # Remove duplicates
         knownExpansions = set()
-        for e in options.expansions:
+        for e in expansions:
             for s in Official_sets:
                 if (s.lower() == e or Card.sets[s].get('set_name', "").lower() == e):
                     wantedSets.add(s)
                     knownExpansions.add(e)
         # Give indication if an imput did not match anything
-        unknownExpansions = options.expansions - knownExpansions
+        unknownExpansions = expansions - knownExpansions
         if unknownExpansions:
             print(("Error - unknown expansion(s): {}".format(", ".join(unknownExpansions))))
 
     # Take care of fan expansions.  Fan expansions must be explicitly named to be added.
     # If no --fan is given, then no fan cards are added.
     # Fan expansion names can be the names from the language or the cardset_tag
-    if options.fan:
+    if fan:
         # Expand out any wildcards, matching set key or set name in the given language
         expanded_expansions = []
-        for e in options.fan:
+        for e in fan:
             matches = fnmatch.filter(Fan_search, e)
             if matches:
                 expanded_expansions.extend(matches)
@@ -1253,61 +1548,316 @@ def filter_sort_cards(cards, options):
                 expanded_expansions.append(e)
 
         # Now get the actual sets that are matched above
-        options.fan = set([e for e in expanded_expansions])  # Remove duplicates
+        fan = set([e for e in expanded_expansions])  # Remove duplicates
         knownExpansions = set()
-        for e in options.fan:
+        for e in fan:
             for s in Fan_sets:
                 if (s.lower() == e or Card.sets[s].get('set_name', "").lower() == e):
                     wantedSets.add(s)
                     knownExpansions.add(e)
         # Give indication if an imput did not match anything
-        unknownExpansions = options.fan - knownExpansions
+        unknownExpansions = fan - knownExpansions
         if unknownExpansions:
             print("Error - unknown fan expansion(s): %s" % ", ".join(unknownExpansions))
 
-    # Now keep only the cards that are in the sets that have been requested
-    keep_cards = []
-    for c in cards:
-        if c.cardset_tag in wantedSets:
-            # Add the cardset informaiton to the card and add it to the list of cards to use
-            c.cardset = Card.sets[c.cardset_tag].get('set_name', c.cardset_tag)
-            keep_cards.append(c)
-    cards = keep_cards
-
-    # Now add text to the cards.  Waited as long as possible to catch all groupings
-    cards = add_card_text(cards, LANGUAGE_DEFAULT)
-    if options.language != LANGUAGE_DEFAULT:
-        cards = add_card_text(cards, options.language)
-
-    # Get list of cards from a file
-    if options.cardlist:
+    return wantedSets
+
+
+# Upgrade sets -> the expansion their cards go with for --upgrade-with-expansion
+UPGRADE_SETS = {'dominion2ndEditionUpgrade': 'dominion1stEdition',
+                'intrigue2ndEditionUpgrade': 'intrigue1stEdition'}
+
+
+class CardPipeline(object):
+    # The filtering, grouping and text of filter_sort_cards as a list of stages.
+    #
+    # Everything that only depends on the sets (the editions, the wanted sets, the set text) is
+    # decided up front by plan().  The card stages are generators that take the cards coming out of
+    # the stage before them and yield the ones they pass on, so chained together the cards go
+    # through all stages of a pass in one traversal.  A new pass only starts where a stage has to
+    # see all cards first: the card text is looked up for all the card_tags left after grouping,
+    # and the sorter needs the names of all base cards left after the card list.
+    #
+    # Stages can be added to or taken out of the three lists before calling run().
+    #
+    # run_languages() makes the selection once and then runs the name and text passes for each of
+    # several languages, on copies of the selected cards.
+
+    def __init__(self, options):
+        self.options = options
+        self.language = options.language
+        self.database = get_card_database(options)
+        self.select_stages = [self.filter_editions, self.upgrade_with_expansion, self.combine_events,
+                              self.combine_landmarks, self.filter_sets, self.group_special_cards]
+        self.name_stages = [self.add_names, self.filter_cardlist]
+        self.text_stages = [self.filter_base_cards, self.add_text, self.add_type_names, self.collect_expansions]
+        self.group_cards = {}  # holds the cards for each group
+        self.card_texts = []
+        self.cardSorter = None
+        self.cardnamesByExpansion = defaultdict(dict)
+        self.randomizerCountByExpansion = Counter()
+
+    @staticmethod
+    def run_stages(cards, stages):
+        for stage in stages:
+            cards = stage(cards)
+        return list(cards)
+
+    def run(self, cards):
+        self.plan()
+        cards = self.run_stages(cards, self.select_stages)
+        self.fix_group_costs()
+        return self.run_text(cards)
+
+    def run_languages(self, cards, languages):
+        # The cards in each of the languages, as a list of (language, cards, Card.getClassState() to draw them
+        # with).  Each language starts from copies of Card.sets and Card.type_names, which are put back after.
+        state = Card.getClassState()
+        sets = copy.deepcopy(Card.sets)
+        type_names = copy.deepcopy(Card.type_names)
+        sections = []
+        try:
+            Card.sets, Card.type_names = copy.deepcopy(sets), copy.deepcopy(type_names)
+            self.language = languages[0]
+            self.plan()
+            selected = self.run_stages(cards, self.select_stages)
+            self.fix_group_costs()
+
+            for language in languages:
+                self.language = language
+                if language != languages[0]:
+                    Card.sets, Card.type_names = copy.deepcopy(sets), copy.deepcopy(type_names)
+                    self.plan_language()
+                self.cardnamesByExpansion = defaultdict(dict)
+                self.randomizerCountByExpansion = Counter()
+                cards = [copy.copy(card) for card in selected]
+                for card in cards:
+                    card.cardset = Card.sets[card.cardset_tag].get('set_name', card.cardset_tag)
+                sections.append((language, self.run_text(cards), Card.getClassState()))
+        finally:
+            Card.setClassState(state)
+        return sections
+
+    def run_text(self, cards):
+        # The name and text passes on the selected cards, and the sorting
+        self.read_text(cards)
+        cards = self.run_stages(cards, self.name_stages)
+
+        # Set up the card sorter
+        self.cardSorter = CardSorter(
+            self.options.order,
+            {card.card_tag: card.name for card in cards
+             if 'base' in [set_name.lower() for set_name in card.cardset_tags]})
+        cards = self.run_stages(cards, self.text_stages)
+
+        # Add expansion divider
+        if self.options.expansion_dividers:
+            cards.extend(self.expansion_dividers())
+
+        # Now sort what is left
+        cards.sort(key=self.cardSorter)
+        return cards
+
+    def plan(self):
+        options = self.options
+
+        # The sets of the edition
+        self.keep_sets = None
+        if options.edition and options.edition != "all":
+            if self.database:
+                self.keep_sets = self.database.edition_sets(options.edition)
+            else:
+                self.keep_sets = set()
+                for set_tag in Card.sets:
+                    for edition in Card.sets[set_tag]["edition"]:
+                        if options.edition == edition:
+                            self.keep_sets.add(set_tag)
+
+        # Combine upgrade cards with their expansion
+        expansions = list(options.expansions)
+        if options.upgrade_with_expansion:
+            for upgrade_tag, set_tag in sorted(UPGRADE_SETS.items()):
+                if self.keep_sets is None or upgrade_tag in self.keep_sets:
+                    expansions.append(set_tag.lower())
+
+        # All Events and Landmarks across all expansions go into extras, as do the blank cards
+        if options.exclude_events and expansions:
+            expansions.append("extras")
+        if options.exclude_landmarks and expansions:
+            expansions.append("extras")
+        if options.include_blanks > 0 and expansions:
+            expansions.append("extras")
+
+        # FIX THIS: Combine all Prizes across all expansions
+        # if options.exclude_prizes:
+        #    cards = combine_cards(cards, 'Prize', 'prizes')
+
+        # Work out the requested sets, so that the cards of all others are dropped before they are
+        # grouped and get their text.
+        self.plan_language()
+        self.wantedSets = select_sets(options, expansions)
+
+    def plan_language(self):
+        # The set text, type names and bonus keywords of the language
+        options = self.options
+        Card.sets = add_set_text(options, Card.sets, LANGUAGE_DEFAULT)
+        if self.language != LANGUAGE_DEFAULT:
+            Card.sets = add_set_text(options, Card.sets, self.language)
+
+        # Get the final type names in the requested language
+        Card.type_names = add_type_text(Card.type_names, LANGUAGE_DEFAULT, self.database)
+        if self.language != LANGUAGE_DEFAULT:
+            Card.type_names = add_type_text(Card.type_names, self.language, self.database)
+
+        # Get the card bonus keywords in the requested language
+        Card.bonus_regex = []  # start over, this may not be the first run in this process
+        bonus = add_bonus_regex(options, LANGUAGE_DEFAULT)
+        Card.addBonusRegex(bonus)
+        if self.language != LANGUAGE_DEFAULT:
+            bonus = add_bonus_regex(options, self.language)
+            Card.addBonusRegex(bonus)
+
+    def filter_editions(self, cards):
+        for card in cards:
+            if self.keep_sets is None or card.cardset_tag in self.keep_sets:
+                yield card
+
+    def upgrade_with_expansion(self, cards):
+        for card in cards:
+            if self.options.upgrade_with_expansion and card.cardset_tag in UPGRADE_SETS:
+                card.cardset_tag = UPGRADE_SETS[card.cardset_tag]
+            yield card
+
+    def combine_events(self, cards):
+        if not self.options.exclude_events:
+            return cards
+        return combined_cards(cards,
+                              old_card_type="Event",
+                              new_type="Events",
+                              new_card_tag='events',
+                              new_cardset_tag='extras'
+                              )
+
+    def combine_landmarks(self, cards):
+        if not self.options.exclude_landmarks:
+            return cards
+        return combined_cards(cards,
+                              old_card_type="Landmark",
+                              new_type="Landmarks",
+                              new_card_tag='landmarks',
+                              new_cardset_tag='extras'
+                              )
+
+    def filter_sets(self, cards):
+        # Now keep only the cards that are in the sets that have been requested
+        for c in cards:
+            if c.cardset_tag in self.wantedSets:
+                # Add the cardset informaiton to the card and add it to the list of cards to use
+                c.cardset = Card.sets[c.cardset_tag].get('set_name', c.cardset_tag)
+                yield c
+
+    def group_special_cards(self, cards):
+        # Group all the special cards together
+        group_cards = self.group_cards
+        for card in cards:
+            if not self.options.special_card_groups or not card.group_tag:
+                yield card  # not part of a group, so just keep the card
+            else:
+                # have a card in a group
+                if card.group_tag not in group_cards:
+                    # First card of a group
+                    group_cards[card.group_tag] = card  # save to update cost later
+                    # this card becomes the card holder for the whole group.
+                    card.card_tag = card.group_tag
+                    # These text fields should be updated later if there is a translation for this group_tag.
+                    error_msg = "ERROR: Missing language entry for group_tab '%s'." % card.group_tag
+                    card.name = card.group_tag  # For now, change the name to the group_tab
+                    card.description = error_msg
+                    card.extra = error_msg
+                    if card.isType('Event') or card.isType('Project'):
+                        card.cost = "*"
+                    if card.isType('Landmark'):
+                        card.cost = ""
+                    # now save the card
+                    yield card
+                else:
+                    # subsequent cards in the group. Update group info, but don't keep the card.
+                    if card.group_top:
+                        # this is a designated card to represent the group, so update important data
+                        group_cards[card.group_tag].cost = card.cost
+                        group_cards[card.group_tag].potcost = card.potcost
+                        group_cards[card.group_tag].debtcost = card.debtcost
+                        group_cards[card.group_tag].types = card.types
+                        group_cards[card.group_tag].randomizer = card.randomizer
+                        group_cards[card.group_tag].image = card.image
+
+                    group_cards[card.group_tag].addCardCount(card.count)    # increase the count
+                    # group_cards[card.group_tag].set_lowest_cost(card)  # set holder to lowest cost of the two cards
+
+    def fix_group_costs(self):
+        # Now fix up the costs of the group cards, once all of their cards have been seen
+        for card in self.group_cards.values():
+            if card.isType('Event') or card.isType('Project'):
+                card.cost = "*"
+                card.debtcost = 0
+                card.potcost = 0
+            if card.isType('Landmark'):
+                card.cost = ""
+                card.debtcost = 0
+                card.potcost = 0
+
+    def read_text(self, cards):
+        # The card text for the cards that are left, in the default and the requested language
+        card_tags = set(card.card_tag for card in cards)
+        self.card_texts = [read_card_text(LANGUAGE_DEFAULT, card_tags, self.database)]
+        if self.language != LANGUAGE_DEFAULT:
+            self.card_texts.append(read_card_text(self.language, card_tags, self.database))
+
+    def add_names(self, cards):
+        # The names come first, the card list and the removal of base cards select on them
+        for card in cards:
+            for card_text in self.card_texts:
+                set_card_text(card, card_text, ['name'])
+            yield card
+
+    def filter_cardlist(self, cards):
+        # Get list of cards from a file
         cardlist = set()
-        with open(options.cardlist) as cardfile:
-            for line in cardfile:
-                cardlist.add(line.strip())
-        if cardlist:
-            cards = [card for card in cards if card.name in cardlist]
-
-    # Set up the card sorter
-    cardSorter = CardSorter(
-        options.order,
-        {card.card_tag: card.name for card in cards if 'base' in [set_name.lower() for set_name in card.cardset_tags]})
-
-    # Optionally remove base cards from expansions that have them
-    if not options.base_cards_with_expansion:
-        cards = [card for card in cards
-                 if not cardSorter.isBaseExpansionCard(card)]
-
-    # Add expansion divider
-    if options.expansion_dividers:
-
-        cardnamesByExpansion = defaultdict(dict)
-        randomizerCountByExpansion = Counter()
+        if self.options.cardlist:
+            with open(self.options.cardlist) as cardfile:
+                for line in cardfile:
+                    cardlist.add(line.strip())
+        for card in cards:
+            if not cardlist or card.name in cardlist:
+                yield card
+
+    def filter_base_cards(self, cards):
+        # Optionally remove base cards from expansions that have them
+        for card in cards:
+            if self.options.base_cards_with_expansion or not self.cardSorter.isBaseExpansionCard(card):
+                yield card
+
+    def add_text(self, cards):
+        for card in cards:
+            for card_text in self.card_texts:
+                set_card_text(card, card_text, ['description', 'extra'])
+            yield card
+
+    def add_type_names(self, cards):
+        for card in cards:
+            card.types_name = ' - '.join([Card.type_names[t] for t in card.types]).upper()
+            yield card
+
+    def collect_expansions(self, cards):
+        # Save off information about the cards to be used on the expansion dividers
+        cardSorter = self.cardSorter
+        cardnamesByExpansion = self.cardnamesByExpansion
         for c in cards:
-            if cardSorter.isBaseExpansionCard(c) or c.isBlank():
+            yield c
+            if not self.options.expansion_dividers or cardSorter.isBaseExpansionCard(c) or c.isBlank():
                 continue
             if c.randomizer:
-                randomizerCountByExpansion[c.cardset] += 1
+                self.randomizerCountByExpansion[c.cardset] += 1
 
             if c.card_tag in cardnamesByExpansion[c.cardset]:
                 # Already have one, so just update the count (for extra Curses, Start Decks, etc)
@@ -1323,18 +1873,20 @@ def filter_sort_cards(cards, options):
                                                                'count': 1,
                                                                'sort': "%03d%s" % (order, c.name.strip(),)}
 
+    def expansion_dividers(self):
+        cardnamesByExpansion = self.cardnamesByExpansion
         for set_tag, set_values in Card.sets.items():
             exp = set_values["set_name"]
             if exp in cardnamesByExpansion:
                 exp_name = exp
 
-                count = randomizerCountByExpansion[exp]
+                count = self.randomizerCountByExpansion[exp]
                 Card.sets[set_tag]['count'] = count
                 if 'no_randomizer' in set_values:
                     if set_values['no_randomizer']:
                         count = 0
 
-                if not options.expansion_dividers_long_name:
+                if not self.options.expansion_dividers_long_name:
                     if 'short_name' in set_values:
                         exp_name = set_values['short_name']
 
@@ -1348,61 +1900,188 @@ def filter_sort_cards(cards, options):
                         n['name'] = u"{}&nbsp;\u00d7&nbsp;".format(n['count']) + n['name']
                     card_names.append(n['name'])
 
-                c = Card(name=exp_name,
-                         cardset=exp,
-                         cardset_tag=set_tag,
-                         types=("Expansion", ),
-                         cost=None,
-                         description=' | '.join(card_names),
-                         extra=set_values.get("set_text", ""),
-                         count=count,
-                         card_tag=set_tag)
-                cards.append(c)
+                yield Card(name=exp_name,
+                           cardset=exp,
+                           cardset_tag=set_tag,
+                           types=("Expansion", ),
+                           cost=None,
+                           description=' | '.join(card_names),
+                           extra=set_values.get("set_text", ""),
+                           count=count,
+                           card_tag=set_tag)
 
-    # Now sort what is left
-    cards.sort(key=cardSorter)
 
-    return cards
+def filter_sort_cards(cards, options):
+    return CardPipeline(options).run(cards)
 
 
-def calculate_layout(options, cards=[]):
-    # This is in place to allow for test cases to it call directly to get
-    options = clean_opts(options)
+def calculate_dimensions(options):
+    # The options for a DividerDrawer: a copy of the cleaned options that it can add its layout to
+    options = argparse.Namespace(**vars(clean_opts(options)))
     options.dominionCardWidth, options.dominionCardHeight = parse_cardsize(options.size, options.sleeved)
     options.paperwidth, options.paperheight = parse_papersize(options.papersize)
     options.minmarginwidth, options.minmarginheight = parseDimensions(options.minmargin)
+    return options
 
-    dd = DividerDrawer(options)
-    dd.calculatePages(cards)
+
+def calculate_layout(options, cards=[], sections=None):
+    # This is in place to allow for test cases to it call directly to get
+    # the drawer with its pages laid out.  The options are left as they are, the
+    # sizes and margins of the layout are in dd.plan (and dd.options).
+    dd = DividerDrawer(calculate_dimensions(options))
+    if sections:
+        dd.calculateSectionPages([(cards, state) for language, cards, state in sections])
+    else:
+        dd.calculatePages(cards)
     return dd
 
 
+def selection_key(options):
+    # The selection options, and the size and modification time of the --cardlist file so that
+    # a changed list selects the cards again
+    key = [getattr(options, name, None) for name in SELECTION_OPTIONS]
+    cardlist = getattr(options, 'cardlist', None)
+    if cardlist:
+        try:
+            stat = os.stat(cardlist)
+            key.append([stat.st_size, stat.st_mtime])
+        except OSError:
+            key.append(None)
+    return json.dumps(key, default=sorted)
+
+
+def selected_cards(options):
+    # The sorted cards the (cleaned) options select, kept for each card selection.
+    # This also puts back the Card.sets, types, type_names and bonus_regex they were selected with.
+    selection = selection_key(options)
+    selected = SELECTED_CARDS.get(selection)
+    if selected is None:
+        cards = filter_sort_cards(read_card_data(options), options)
+        selected = SELECTED_CARDS[selection] = (cards, Card.getClassState())
+    cards, state = selected
+    Card.setClassState(state)
+    return cards
+
+
+def estimate(options):
+    # Quickly work out how many pages the (cleaned) options give, without laying out any text or drawing.
+    # Only the number of dividers and their stack heights are needed from the cards.  The cards are cached
+    # for each card selection, so after the first time it is just the arithmetic of DividerDrawer.calculateGrid.
+    cards = selected_cards(options)
+    count = len(cards)
+    stackHeights = [c.getStackHeight(options.thickness) for c in cards] if options.wrapper else [0]
+
+    dd = DividerDrawer(calculate_dimensions(options))
+    dd.calculateGrid(max(stackHeights), stackHeights)
+    perPage = dd.plan.numDividersHorizontal * dd.plan.numDividersVertical
+    # each language starts on a new sheet
+    languages = len(options.languages)
+    if dd.packWrappers():
+        sheets, pdfPages = dd.countPages(languages * len(dd.packWrapperRows(stackHeights)))
+    else:
+        sheets, pdfPages = dd.countPages(languages * ((count + perPage - 1) // perPage))
+    count *= languages
+    return {'dividers': count,
+            'dividers_per_page': perPage,
+            'sheets': sheets,
+            'pdf_pages': pdfPages}
+
+
+def render_divider(options, card_tag, side='front', fmt='pdf'):
+    # Draw just one divider of the (cleaned) options, the first one for card_tag, on a page of its own
+    # that is as big as the divider.  It has the tab it gets in the whole document.  side is 'front' or
+    # 'back', fmt 'pdf' or 'png' (at --preview-resolution, needs wand like --preview).  Returns the bytes.
+    # With the cards of the selection kept by selected_cards and their tabs by TAB_PLANS, only the CardPlot
+    # of this one divider is made, resolved and drawn.
+    if side not in ['front', 'back']:
+        raise ValueError("side must be 'front' or 'back', not {}".format(side))
+    if fmt not in ['pdf', 'png']:
+        raise ValueError("fmt must be 'pdf' or 'png', not {}".format(fmt))
+    if len(options.languages) > 1:
+        raise ValueError("A divider is drawn in one language, not {}".format(', '.join(options.languages)))
+    cards = selected_cards(options)
+    card = next((card for card in cards if card.card_tag == card_tag), None)
+    if card is None:
+        raise ValueError("There is no divider for {} in this selection of cards".format(card_tag))
+
+    selection = selection_key(options)
+    options = calculate_dimensions(options)
+    options.outfile = BytesIO()
+    dd = DividerDrawer(options)
+    stackHeights = [c.getStackHeight(options.thickness) for c in cards]
+    dd.calculateGrid(max(stackHeights) if options.wrapper else 0, stackHeights)
+    dd.setupTabs(dd.options)
+    key = json.dumps([selection] + [getattr(dd.options, name, None) for name in DividerDrawer.TAB_OPTIONS])
+    tabs = TAB_PLANS.get(key)
+    if tabs is None:
+        tabs = TAB_PLANS[key] = {}
+        for c, tab in zip(cards, dd.tabPlan(dd.options, cards)):
+            tabs.setdefault(c.card_tag, tab)
+    item = dd.cardPlot(dd.options, card, *tabs[card_tag])
+    dd.drawSingleDivider(item, isBack=side == 'back')
+    if fmt == 'pdf':
+        return options.outfile.getvalue()
+    return rasterize(options.outfile.getvalue(), options.preview_resolution)
+
+
+def write_layout(options, dd):
+    layout = dd.getLayout()
+    text = json.dumps(layout, indent=2, sort_keys=True)
+    if hasattr(options.outfile, 'write'):
+        options.outfile.write(text.encode('utf-8'))
+        return
+    fname = '{}.{}'.format(os.path.splitext(options.outfile)[0], 'json')
+    with codecs.open(fname, 'w', 'utf-8') as layout_file:
+        layout_file.write(text)
+    print("Wrote layout of {} pages to {}".format(layout['pdf_pages'], fname))
+
+
 def generate(options):
 
     cards = read_card_data(options)
     assert cards, "No cards after reading"
-    cards = filter_sort_cards(cards, options)
+    sections = None
+    if len(options.languages) > 1:
+        # The same cards in each of the languages, one after the other
+        sections = CardPipeline(options).run_languages(cards, options.languages)
+        cards = [card for language, section, state in sections for card in section]
+    else:
+        cards = filter_sort_cards(cards, options)
     assert cards, "No cards after filtering/sorting"
 
-    dd = calculate_layout(options, cards)
+    dd = calculate_layout(options, cards, sections)
 
+    plan = dd.plan
     print("Paper dimensions: {:.2f}cm (w) x {:.2f}cm (h)".format(
-        options.paperwidth / cm, options.paperheight / cm))
+        plan.paperwidth / cm, plan.paperheight / cm))
     print("Tab dimensions: {:.2f}cm (w) x {:.2f}cm (h)".format(
-        options.dividerWidthReserved / cm, options.dividerHeightReserved / cm))
+        plan.dividerWidthReserved / cm, plan.dividerHeightReserved / cm))
     print('{} dividers horizontally, {} vertically'.format(
-        options.numDividersHorizontal, options.numDividersVertical))
+        plan.numDividersHorizontal, plan.numDividersVertical))
     print("Margins: {:.2f}cm h, {:.2f}cm v\n".format(
-        options.horizontalMargin / cm, options.verticalMargin / cm))
+        plan.horizontalMargin / cm, plan.verticalMargin / cm))
+
+    if options.layout_only:
+        write_layout(options, dd)
+        return
 
     dd.draw(cards)
+    if dd.outputSize is not None:
+        print("Output size: {:.1f}KB".format(dd.outputSize / 1024.0))
 
 
 def main():
     options = parse_opts()
-    options = clean_opts(options)
+    try:
+        options = clean_opts(options)
+    except ValueError as e:
+        get_parser().error(str(e))
     if options.preview:
         fname = '{}.{}'.format(os.path.splitext(options.outfile)[0], 'png')
-        open(fname, 'wb').write(generate_sample(options).getvalue())
+        open(fname, 'wb').write(generate_sample(options))
+    elif options.thumbnails:
+        from . import gallery
+        gallery.export(options, options.thumbnails, dpi=options.thumbnail_dpi, sprite=options.thumbnail_sprite,
+                       workers=options.thumbnail_workers)
     else:
         generate(options)
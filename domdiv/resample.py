@@ -0,0 +1,128 @@
+###########################################################################
+# Lower resolution variants of the images in domdiv/images
+#
+# The images are drawn a lot smaller than their source resolution (a set icon is 14x12pt, a
+# tab banner about 4x0.9cm), so a copy resampled to the printed size is all a PDF needs.
+# build_variants() writes such copies for the default drawn sizes into images/<dpi>dpi/,
+# it is run by setup.py when building the package, or directly with
+#     python domdiv/resample.py
+# to build them in place.  Only images that actually get smaller have a variant.
+#
+# This module only needs Pillow (and only for the resampling itself), so that setup.py can
+# run it without importing the domdiv package.
+###########################################################################
+from __future__ import print_function
+
+import argparse
+import json
+import math
+import os
+
+VARIANT_DPIS = [300, 600]
+
+# Largest sizes (in points) the images are drawn at
+SET_ICON_SIZE = (14, 12)
+ICON_SIZE = (24, 24)  # inline icons go up to 2.4 times the 10pt body text
+TAB_SIZE = (4.0 / 2.54 * 72 - 2, 0.9 / 2.54 * 72 - 1)  # banner on the default 4cm x 0.9cm tab
+
+VARIANT_SIZES = {}  # variant path -> its pixel size (None if there is no such variant), see select_variant
+
+
+def pixel_size(drawn_size, dpi):
+    return (drawn_size[0] * dpi / 72.0, drawn_size[1] * dpi / 72.0)
+
+
+def resampled_size(size, drawn_size, dpi):
+    # Pixel size to scale an image of size down to for printing it at drawn_size points and dpi,
+    # keeping its aspect ratio.  None if the image is not (noticeably) larger than that already.
+    width, height = size
+    needed = pixel_size(drawn_size, dpi)
+    scale = max(needed[0] / width, needed[1] / height)
+    if width * scale > width - 1:
+        return None
+    return (int(math.ceil(width * scale)), int(math.ceil(height * scale)))
+
+
+def resample_image(path, outpath, drawn_size, dpi):
+    # Write a copy of the image at path resampled for drawn_size and dpi to outpath.
+    # Returns False (and writes nothing) if it is small enough already.
+    from PIL import Image
+
+    image = Image.open(path)
+    size = resampled_size(image.size, drawn_size, dpi)
+    if size is None:
+        return False
+    image = image.convert('RGBA' if 'A' in image.mode or 'transparency' in image.info else 'RGB')
+    image.resize(size, Image.LANCZOS).save(outpath, optimize=True)
+    return True
+
+
+def select_variant(image_dir, fname, dpi, drawn_size, sizes=None):
+    # The smallest variant of image_dir/fname that is still large enough to print it at
+    # drawn_size points and dpi, or the image itself if there is none.
+    # sizes caches the pixel sizes of the variants that were looked at, by default in VARIANT_SIZES.
+    from PIL import Image
+
+    if sizes is None:
+        sizes = VARIANT_SIZES
+    needed = pixel_size(drawn_size, dpi)
+    for variant_dpi in sorted(VARIANT_DPIS):
+        path = os.path.join(image_dir, '{}dpi'.format(variant_dpi), fname)
+        if path not in sizes:
+            sizes[path] = Image.open(path).size if os.path.exists(path) else None
+        size = sizes[path]
+        if size is not None and size[0] > needed[0] - 1 and size[1] > needed[1] - 1:
+            return path
+    return os.path.join(image_dir, fname)
+
+
+def drawn_sizes(image_dir, db_dir):
+    # The size every image in image_dir is drawn at with the default options
+    with open(os.path.join(db_dir, 'types_db.json')) as typefile:
+        tab_images = set(t['card_type_image'] for t in json.load(typefile))
+    with open(os.path.join(db_dir, 'sets_db.json')) as setfile:
+        set_images = set(s.get('image') for s in json.load(setfile).values())
+
+    sizes = {}
+    for fname in os.listdir(image_dir):
+        if not fname.endswith('.png'):
+            continue
+        if fname in tab_images:
+            sizes[fname] = TAB_SIZE
+        elif fname.endswith('_set.png') or fname in set_images:
+            sizes[fname] = SET_ICON_SIZE
+        else:
+            sizes[fname] = ICON_SIZE
+    return sizes
+
+
+def build_variants(image_dir, db_dir, out_dir=None, dpis=VARIANT_DPIS):
+    if out_dir is None:
+        out_dir = image_dir
+    sizes = drawn_sizes(image_dir, db_dir)
+    for dpi in dpis:
+        dpi_dir = os.path.join(out_dir, '{}dpi'.format(dpi))
+        if not os.path.isdir(dpi_dir):
+            os.makedirs(dpi_dir)
+        count = 0
+        for fname, drawn_size in sorted(sizes.items()):
+            if resample_image(os.path.join(image_dir, fname), os.path.join(dpi_dir, fname), drawn_size, dpi):
+                count += 1
+        print("{} of {} images resampled to {} dpi in {}".format(count, len(sizes), dpi, dpi_dir))
+
+
+def main():
+    here = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description="Build the lower resolution image variants")
+    parser.add_argument('--images', default=os.path.join(here, 'images'), help="Directory of the source images.")
+    parser.add_argument('--card-db', default=os.path.join(here, 'card_db'), help="Card database directory.")
+    parser.add_argument('--output', default=None, help="Where to put the <dpi>dpi directories, "
+                        "default is the source image directory.")
+    parser.add_argument('--dpi', type=int, action='append', help="Resolution to build, may be repeated "
+                        "(default {}).".format(' and '.join(str(d) for d in VARIANT_DPIS)))
+    args = parser.parse_args()
+    build_variants(args.images, args.card_db, args.output, args.dpi or VARIANT_DPIS)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+from __future__ import print_function, absolute_import
+
+import gc
+import os
+import signal
+import sys
+import time
+import traceback
+from collections import Counter
+
+from . import main
+from .draw import DividerDrawer
+
+
+class Prefork(object):
+    # A pool of pre-forked generator workers.
+    # All of the one-time start up work (importing reportlab and pkg_resources, reading and parsing the
+    # label, card, set, type and language databases, registering the fonts) is done once in the parent by warm().
+    # serve() then forks the workers, which inherit that warmed state copy-on-write and can take their
+    # first request without paying any of it again.
+    #
+    # The request loop is pluggable: request_loop(worker_number, handler) is called in every worker and
+    # should fetch jobs from wherever they come from (a socket, a queue, ...) and call handler(options)
+    # for each one, with the options from parse_opts or a dict for main.options_from_dict.  The worker
+    # exits when request_loop returns.
+    #
+    # With respawn, a worker that fails (request_loop raises, or the worker dies of a signal) is started
+    # again, after respawn_delay seconds doubling with each failure of that worker, up to max_respawns
+    # times.  A worker whose request_loop returns has finished and is not started again.
+
+    def __init__(self, request_loop, workers=2, languages=None, respawn=False, max_respawns=5, respawn_delay=1.0):
+        if not hasattr(os, 'fork'):
+            raise RuntimeError("Prefork needs os.fork(), which is not available on this platform")
+        self.request_loop = request_loop
+        self.workers = workers
+        self.languages = languages  # languages to preload, None for all of them
+        self.respawn = respawn  # start a new worker when one fails
+        self.max_respawns = max_respawns
+        self.respawn_delay = respawn_delay
+        self.respawns = Counter()  # worker number -> times it was started again
+        self.children = {}  # pid -> worker number
+        self.warmed = False
+
+    def warm(self):
+        # Load everything the workers will need into this (the parent) process
+        main.preload_resources(self.languages)
+        DividerDrawer().registerFonts()
+        if hasattr(gc, 'freeze'):
+            # Keep the garbage collector from touching (and so un-sharing) the inherited objects
+            gc.freeze()
+        self.warmed = True
+
+    def handle(self, options):
+        # Run the generator for one set of options inside a worker
+        if isinstance(options, dict):
+            options = main.options_from_dict(options)
+        return main.generate(main.clean_opts(options))
+
+    def spawn(self, number):
+        pid = os.fork()
+        if pid:
+            self.children[pid] = number
+            return pid
+
+        # In the worker
+        status = 0
+        try:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            self.request_loop(number, self.handle)
+        except Exception:
+            traceback.print_exc(file=sys.stderr)
+            status = 1
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(status)
+
+    def serve(self):
+        # Start the workers and wait for all of them to finish, starting failed ones again with respawn.
+        # stop() ends this early.
+        if not self.warmed:
+            self.warm()
+        for number in range(self.workers):
+            self.spawn(number)
+
+        while self.children:
+            try:
+                pid, status = os.wait()
+            except OSError:
+                break
+            number = self.children.pop(pid, None)
+            if number is not None and self.failed(status) and self.respawn:
+                self.restart(number)
+
+    @staticmethod
+    def failed(status):
+        return not (os.WIFEXITED(status) and os.WEXITSTATUS(status) == 0)
+
+    def restart(self, number):
+        # Start a failed worker again, backing off each time it fails
+        if self.respawns[number] >= self.max_respawns:
+            print("Worker {} failed {} times, not starting it again".format(number, self.respawns[number] + 1),
+                  file=sys.stderr)
+            return
+        time.sleep(min(self.respawn_delay * 2 ** self.respawns[number], 60))
+        if not self.respawn:
+            return  # stopped while waiting
+        self.respawns[number] += 1
+        self.spawn(number)
+
+    def stop(self):
+        # Stop respawning and terminate all of the workers.  Safe to call from a signal handler.
+        self.respawn = False
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                self.children.pop(pid, None)
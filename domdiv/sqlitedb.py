@@ -0,0 +1,264 @@
+###########################################################################
+# The card database compiled into a single SQLite file
+#
+# build_database() reads the json files of a card_db directory (cards, sets, types, labels and
+# the text of every language) into one SQLite file, indexed by card_tag, cardset_tag,
+# group_tag, type, edition and language.  CardDatabase answers the lookups that
+# main.read_card_data() and main.filter_sort_cards() otherwise do on the json files, and
+# some ad-hoc selections for other users of the library.  Its answers have the same shape
+# as the json they come from.
+#
+# Building it is optional, run
+#     python domdiv/sqlitedb.py --output cards.sqlite
+# and use it with --card-database cards.sqlite.  The json files stay what gets edited, the
+# size, modification time and sha1 of each of them are kept in the database so that a stale
+# database can be spotted (see source_changed()) without reading the json files.
+#
+# This module only uses the standard library, like textindex.py.
+###########################################################################
+from __future__ import print_function
+
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+
+SCHEMA = """
+CREATE TABLE source (path TEXT PRIMARY KEY, sha1 TEXT NOT NULL, size INTEGER NOT NULL, mtime REAL NOT NULL);
+CREATE TABLE types (id INTEGER PRIMARY KEY, data TEXT NOT NULL);
+CREATE TABLE type_names (type_id INTEGER NOT NULL, type TEXT NOT NULL);
+CREATE INDEX type_names_type ON type_names (type);
+CREATE TABLE sets (cardset_tag TEXT PRIMARY KEY, data TEXT NOT NULL);
+CREATE TABLE set_editions (cardset_tag TEXT NOT NULL, edition TEXT NOT NULL);
+CREATE INDEX set_editions_edition ON set_editions (edition);
+CREATE TABLE cards (id INTEGER PRIMARY KEY, card_tag TEXT NOT NULL, group_tag TEXT, data TEXT NOT NULL);
+CREATE INDEX cards_card_tag ON cards (card_tag);
+CREATE INDEX cards_group_tag ON cards (group_tag);
+CREATE TABLE card_sets (card_id INTEGER NOT NULL, cardset_tag TEXT NOT NULL);
+CREATE INDEX card_sets_cardset_tag ON card_sets (cardset_tag, card_id);
+CREATE TABLE card_types (card_id INTEGER NOT NULL, type TEXT NOT NULL);
+CREATE INDEX card_types_type ON card_types (type, card_id);
+CREATE TABLE card_text (language TEXT NOT NULL, card_tag TEXT NOT NULL, data TEXT NOT NULL,
+                        PRIMARY KEY (language, card_tag));
+CREATE TABLE set_text (language TEXT NOT NULL, cardset_tag TEXT NOT NULL, data TEXT NOT NULL,
+                       PRIMARY KEY (language, cardset_tag));
+CREATE TABLE type_text (language TEXT NOT NULL, type TEXT NOT NULL, data TEXT NOT NULL,
+                        PRIMARY KEY (language, type));
+CREATE TABLE bonuses (language TEXT PRIMARY KEY, data TEXT NOT NULL);
+CREATE TABLE labels (id INTEGER PRIMARY KEY, data TEXT NOT NULL);
+"""
+
+# language file kind -> table it goes into, or None if the file is kept whole
+LANGUAGE_TABLES = {'cards': 'card_text', 'sets': 'set_text', 'types': 'type_text', 'bonuses': None}
+
+
+def source_hash(data):
+    return hashlib.sha1(data).hexdigest()
+
+
+def source_stamp(path):
+    # The size and modification time of a json file
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime
+
+
+def source_changed(path, sha1, size, mtime):
+    # Whether the json file at path is not the one with this sha1, size and modification time.
+    # It is only read (to compare the sha1) if it has the same size but another modification time.
+    if not os.path.isfile(path):
+        return True
+    stamp = source_stamp(path)
+    if stamp[0] != size:
+        return True
+    if stamp[1] == mtime:
+        return False
+    with open(path, 'rb') as source_file:
+        return source_hash(source_file.read()) != sha1
+
+
+def dumps(obj):
+    return json.dumps(obj, sort_keys=True, separators=(',', ':'))
+
+
+def source_files(db_dir):
+    # The json files of db_dir the database is built from, as paths relative to db_dir
+    paths = [name for name in ["cards_db.json", "sets_db.json", "types_db.json", "labels_db.json"]
+             if os.path.isfile(os.path.join(db_dir, name))]
+    for language in sorted(os.listdir(db_dir)):
+        for kind in sorted(LANGUAGE_TABLES):
+            path = os.path.join(language, "{}_{}.json".format(kind, language))
+            if os.path.isfile(os.path.join(db_dir, path)):
+                paths.append(path)
+    return paths
+
+
+def build_database(db_dir, path):
+    if os.path.exists(path):
+        os.remove(path)
+    connection = sqlite3.connect(path)
+    try:
+        connection.executescript(SCHEMA)
+        for source in source_files(db_dir):
+            with open(os.path.join(db_dir, source), 'rb') as source_file:
+                data = source_file.read()
+            connection.execute("INSERT INTO source VALUES (?, ?, ?, ?)",
+                               (source.replace(os.sep, '/'), source_hash(data)) +
+                               source_stamp(os.path.join(db_dir, source)))
+            add_source(connection, source, json.loads(data.decode('utf-8')))
+        connection.commit()
+    finally:
+        connection.close()
+
+
+def add_source(connection, source, content):
+    if source == "cards_db.json":
+        for card_id, card in enumerate(content):
+            connection.execute("INSERT INTO cards VALUES (?, ?, ?, ?)",
+                               (card_id, card['card_tag'], card.get('group_tag'), dumps(card)))
+            connection.executemany("INSERT INTO card_sets VALUES (?, ?)",
+                                   [(card_id, s) for s in card.get('cardset_tags', [])])
+            connection.executemany("INSERT INTO card_types VALUES (?, ?)",
+                                   [(card_id, t) for t in card.get('types', [])])
+    elif source == "sets_db.json":
+        for cardset_tag, cardset in content.items():
+            connection.execute("INSERT INTO sets VALUES (?, ?)", (cardset_tag, dumps(cardset)))
+            connection.executemany("INSERT INTO set_editions VALUES (?, ?)",
+                                   [(cardset_tag, e) for e in cardset.get('edition', [])])
+    elif source == "types_db.json":
+        for type_id, card_type in enumerate(content):
+            connection.execute("INSERT INTO types VALUES (?, ?)", (type_id, dumps(card_type)))
+            connection.executemany("INSERT INTO type_names VALUES (?, ?)",
+                                   [(type_id, t) for t in card_type['card_type']])
+    elif source == "labels_db.json":
+        connection.executemany("INSERT INTO labels VALUES (?, ?)",
+                               [(label_id, dumps(label)) for label_id, label in enumerate(content)])
+    else:
+        language, name = os.path.split(source)
+        table = LANGUAGE_TABLES[name.split('_')[0]]
+        if table is None:
+            connection.execute("INSERT INTO bonuses VALUES (?, ?)", (language, dumps(content)))
+        else:
+            connection.executemany("INSERT INTO {} VALUES (?, ?, ?)".format(table),
+                                   [(language, key, dumps(value)) for key, value in content.items()])
+
+
+def placeholders(values):
+    return ', '.join('?' * len(values))
+
+
+class CardDatabase(object):
+
+    def __init__(self, path):
+        if not os.path.isfile(path):
+            raise ValueError("No card database {}".format(path))
+        self.path = path
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+
+    def sources(self):
+        # source json path (relative to the card_db directory) -> (sha1, size, modification time) of the
+        # file it was built from.  Empty for a database built by an older version of this module.
+        try:
+            return {row[0]: tuple(row[1:]) for row in self.connection.execute(
+                "SELECT path, sha1, size, mtime FROM source")}
+        except sqlite3.OperationalError:
+            return {}
+
+    def languages(self):
+        return [row[0] for row in self.connection.execute("SELECT DISTINCT language FROM card_text ORDER BY 1")]
+
+    def types(self):
+        # Like types_db.json
+        return [json.loads(row[0]) for row in self.connection.execute("SELECT data FROM types ORDER BY id")]
+
+    def sets(self):
+        # Like sets_db.json
+        return {row[0]: json.loads(row[1]) for row in self.connection.execute("SELECT cardset_tag, data FROM sets")}
+
+    def labels(self):
+        # Like labels_db.json
+        return [json.loads(row[0]) for row in self.connection.execute("SELECT data FROM labels ORDER BY id")]
+
+    def edition_sets(self, edition):
+        # The cardset_tags of the sets that are part of edition
+        return set(row[0] for row in self.connection.execute(
+            "SELECT cardset_tag FROM set_editions WHERE edition = ?", (edition, )))
+
+    def cards(self, cardset_tags=None, types=None, card_tags=None, group_tags=None):
+        # Like cards_db.json, only the cards in any of the cardset_tags, of any of the types and so on if given
+        query = "SELECT data FROM cards"
+        conditions = []
+        parameters = []
+        if cardset_tags is not None:
+            conditions.append("id IN (SELECT card_id FROM card_sets WHERE cardset_tag IN ({}))".format(
+                placeholders(cardset_tags)))
+            parameters.extend(cardset_tags)
+        if types is not None:
+            conditions.append("id IN (SELECT card_id FROM card_types WHERE type IN ({}))".format(
+                placeholders(types)))
+            parameters.extend(types)
+        if card_tags is not None:
+            conditions.append("card_tag IN ({})".format(placeholders(card_tags)))
+            parameters.extend(card_tags)
+        if group_tags is not None:
+            conditions.append("group_tag IN ({})".format(placeholders(group_tags)))
+            parameters.extend(group_tags)
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        return [json.loads(row[0]) for row in self.connection.execute(query + " ORDER BY id", parameters)]
+
+    def cards_in_sets(self, cardset_tags, also_types=(), also_card_tags=()):
+        # Like cards_db.json, only the cards in any of the cardset_tags, and those of any of also_types
+        # or with any of also_card_tags
+        conditions = ["id IN (SELECT card_id FROM card_sets WHERE cardset_tag IN ({}))".format(
+            placeholders(cardset_tags))]
+        parameters = list(cardset_tags)
+        if also_types:
+            conditions.append("id IN (SELECT card_id FROM card_types WHERE type IN ({}))".format(
+                placeholders(also_types)))
+            parameters.extend(also_types)
+        if also_card_tags:
+            conditions.append("card_tag IN ({})".format(placeholders(also_card_tags)))
+            parameters.extend(also_card_tags)
+        query = "SELECT data FROM cards WHERE " + " OR ".join(conditions) + " ORDER BY id"
+        return [json.loads(row[0]) for row in self.connection.execute(query, parameters)]
+
+    def card_text(self, language, card_tags=None):
+        # Like cards_<language>.json, only for the card_tags if given
+        query = "SELECT card_tag, data FROM card_text WHERE language = ?"
+        parameters = [language]
+        if card_tags is not None:
+            card_tags = list(card_tags)
+            query += " AND card_tag IN ({})".format(placeholders(card_tags))
+            parameters.extend(card_tags)
+        return {row[0]: json.loads(row[1]) for row in self.connection.execute(query, parameters)}
+
+    def set_text(self, language):
+        # Like sets_<language>.json
+        return {row[0]: json.loads(row[1]) for row in self.connection.execute(
+            "SELECT cardset_tag, data FROM set_text WHERE language = ?", (language, ))}
+
+    def type_text(self, language):
+        # Like types_<language>.json
+        return {row[0]: json.loads(row[1]) for row in self.connection.execute(
+            "SELECT type, data FROM type_text WHERE language = ?", (language, ))}
+
+    def bonuses(self, language):
+        # Like bonuses_<language>.json
+        for row in self.connection.execute("SELECT data FROM bonuses WHERE language = ?", (language, )):
+            return json.loads(row[0])
+        return {}
+
+
+def main():
+    here = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description="Build the SQLite card database")
+    parser.add_argument('--card-db', default=os.path.join(here, 'card_db'), help="Card database directory.")
+    parser.add_argument('--output', default='cards.sqlite', help="Database file to write (default %(default)s).")
+    args = parser.parse_args()
+    build_database(args.card_db, args.output)
+    print("Wrote the card database to {}".format(args.output))
+
+
+if __name__ == '__main__':
+    main()
@@ -62,8 +62,8 @@ def test_cardread():
 
     # Option modified card count
     options = main.parse_opts(['--no-trash', '--curse10', '--start-decks', '--include-blanks', '7'])
-    options = main.clean_opts(options)
     options.data_path = '.'
+    options = main.clean_opts(options)
     cards = main.read_card_data(options)
     # Total delta cards is +28 from
     #      Trash:       -1 * 3 sets = -3
@@ -90,6 +90,80 @@ def test_languages():
             assert "Fluch" in [card.name for card in cards]
 
 
+def test_text_for_selected_cards(monkeypatch, tmpdir):
+    # The text is only added to the cards that are left after the set and card list selection
+    texted = []
+    set_card_text = main.set_card_text
+
+    def recording_set_card_text(card, card_text, fields):
+        texted.append((card.card_tag, tuple(fields)))
+        set_card_text(card, card_text, fields)
+    monkeypatch.setattr(main, 'set_card_text', recording_set_card_text)
+
+    cardlist = tmpdir.join('cardlist.txt')
+    cardlist.write('Dorf\nBurggraben\nKupfer\n')
+    options = main.parse_opts(['--expansions', 'base', 'dominion2ndEdition', '--language', 'de',
+                               '--cardlist', str(cardlist)])
+    options.data_path = '.'
+    options = main.clean_opts(options)
+    cards = main.filter_sort_cards(main.read_card_data(options), options)
+    assert sorted(c.card_tag for c in cards) == ['Copper', 'Moat', 'Village']
+    assert all(c.description for c in cards)
+    # names for the cards of the two sets (in both languages), the rest of the text just for the three on the list
+    named = [tag for tag, fields in texted if fields == ('name', )]
+    assert 'Village' in named and len(named) < 2 * 60
+    assert sorted(tag for tag, fields in texted if fields != ('name', )) == \
+        ['Copper'] * 2 + ['Moat'] * 2 + ['Village'] * 2
+
+
+def test_pipeline_passes():
+    class Cards(list):
+        traversals = 0
+
+        def __iter__(self):
+            Cards.traversals += 1
+            return list.__iter__(self)
+
+    options = main.clean_opts(main.parse_opts(['--expansions', 'base', 'empires', '--edition', 'latest',
+                                               '--special-card-groups', '--exclude-events', '--expansion-dividers']))
+    cards = Cards(main.read_card_data(options))
+    pipeline = main.CardPipeline(options)
+    seen = []
+
+    def record(cards):
+        for card in cards:
+            seen.append(card.card_tag)
+            yield card
+    pipeline.select_stages.append(record)
+    selected = pipeline.run(cards)
+    # all of the selection is done in one traversal of the cards
+    assert Cards.traversals == 1
+    assert 'events' in seen and 'Castles' in seen and 'Humble Castle' not in seen
+    assert set(c.card_tag for c in selected) == set(seen) | set(['base', 'empires', 'extras'])
+
+
+def test_several_languages():
+    # the cards are selected once, and get the text of each language
+    args = ['--expansions', 'dominion2ndEdition', '--special-card-groups', '--expansion-dividers']
+    options = main.clean_opts(main.parse_opts(args + ['--language', 'en_us', 'de']))
+    assert (options.language, options.languages) == ('en_us', ('en_us', 'de'))
+    cards = main.read_card_data(options)
+    state = domdiv_cards.Card.getClassState()
+    sections = main.CardPipeline(options).run_languages(cards, options.languages)
+    assert [language for language, cards, state in sections] == ['en_us', 'de']
+    # the Card class state of each language comes with its cards, and is not left behind
+    assert domdiv_cards.Card.getClassState() == state
+
+    for language, cards, (sets, types, type_names, bonus_regex) in sections:
+        options = main.clean_opts(main.parse_opts(args + ['--language', language]))
+        alone = main.filter_sort_cards(main.read_card_data(options), options)
+        assert [(c.card_tag, c.name, c.cardset, c.description, c.types_name) for c in cards] == \
+            [(c.card_tag, c.name, c.cardset, c.description, c.types_name) for c in alone]
+        assert sets == domdiv_cards.Card.sets
+        assert type_names == domdiv_cards.Card.type_names
+        assert bonus_regex == domdiv_cards.Card.bonus_regex
+
+
 @contextlib.contextmanager
 def change_cwd(d):
     curdir = os.getcwd()
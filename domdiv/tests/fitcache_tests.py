@@ -0,0 +1,105 @@
+import os
+
+import pytest
+
+from .. import fitcache
+from .. import main
+
+
+def test_fit_cache(tmpdir):
+    path = str(tmpdir.join('fit.json'))
+    cache = fitcache.FitCache(path, 'fonts')
+    assert cache.get(('tab', 'VILLAGE', 90.5)) is None
+    cache.put(('tab', 'VILLAGE', 90.5), [11.5, 88.0])
+    cache.save()
+
+    cache = fitcache.FitCache(path, 'fonts')
+    assert cache.get(('tab', 'VILLAGE', 90.5)) == [11.5, 88.0]
+    assert cache.get(('tab', 'VILLAGE', 80.5)) is None
+
+    # other fonts, other sizes
+    assert len(fitcache.FitCache(path, 'other fonts')) == 0
+
+
+def test_fit_cache_save(tmpdir, monkeypatch):
+    # the file is only written if there are new entries, and then replaced as a whole
+    path = tmpdir.join('fit.json')
+    cache = fitcache.FitCache(str(path), 'fonts')
+    cache.put('VILLAGE', 11.5)
+    cache.save()
+    written = path.read()
+
+    cache = fitcache.FitCache(str(path), 'fonts')
+    assert cache.get('VILLAGE') == 11.5
+    monkeypatch.setattr(fitcache, 'replace_file', None)
+    cache.save()
+    assert path.read() == written
+
+    cache.put('MARKET', 12.0)
+    with pytest.raises(TypeError):
+        cache.save()
+    assert path.read() == written
+    assert tmpdir.listdir() == [path]
+
+
+@pytest.mark.skipif(os.name != 'posix', reason="file permissions are posix")
+def test_fit_cache_mode(tmpdir):
+    # a new cache gets the permissions of any new file, a replaced one keeps those of the old one
+    path = tmpdir.join('fit.json')
+    cache = fitcache.FitCache(str(path), 'fonts')
+    cache.put('VILLAGE', 11.5)
+    cache.save()
+    umask = os.umask(0)
+    os.umask(umask)
+    assert path.stat().mode & 0o777 == 0o666 & ~umask
+
+    path.chmod(0o640)
+    cache.put('MARKET', 12.0)
+    cache.save()
+    assert path.stat().mode & 0o777 == 0o640
+
+
+def test_font_hash(tmpdir):
+    # the fonts are only read once
+    font = tmpdir.join('font.ttf')
+    font.write('font')
+    fingerprint = fitcache.font_hash([str(font)], ['3.4'])
+    font.write('changed')
+    assert fitcache.font_hash([str(font)], ['3.4']) == fingerprint
+    assert fitcache.font_hash([str(font)], ['3.5']) != fingerprint
+
+
+def test_fit_cache_size(tmpdir):
+    # only the most recently used entries are kept
+    path = str(tmpdir.join('fit.json'))
+    cache = fitcache.FitCache(path, 'fonts', max_entries=3)
+    for i in range(4):
+        cache.put(i, i)
+    cache.get(0)
+    cache.save()
+
+    cache = fitcache.FitCache(path, 'fonts', max_entries=3)
+    assert [cache.get(i) for i in range(4)] == [0, None, 2, 3]
+
+
+def test_fit_cache_reused(tmpdir, monkeypatch):
+    path = str(tmpdir.join('fit.json'))
+
+    def draw():
+        options = main.clean_opts(main.parse_opts(['--expansions', 'cornucopia', '--fit-cache', path, '--outfile',
+                                                   str(tmpdir.join('fit.pdf'))]))
+        cards = main.filter_sort_cards(main.read_card_data(options), options)
+        dd = main.calculate_layout(options, cards)
+        dd.draw()
+        return dd
+
+    textLayouts = draw().textLayouts
+
+    # the second time around the text is not fitted again
+    layoutText = main.DividerDrawer.layoutText
+
+    def fitted_layoutText(self, job, layout=None):
+        assert layout is not None
+        return layoutText(self, job, layout)
+    monkeypatch.setattr(main.DividerDrawer, 'layoutText', fitted_layoutText)
+    assert draw().textLayouts == textLayouts
@@ -0,0 +1,78 @@
+import json
+import re
+from io import BytesIO
+
+from PIL import Image
+
+from .. import gallery
+from .. import main
+
+
+def fake_rasterize(pdf, resolution):
+    # a png as big as the page of the pdf would be at resolution, without needing wand
+    width, height = [float(v) for v in re.search(br'/MediaBox \[ 0 0 ([\d.]+) ([\d.]+) \]', pdf).groups()]
+    png = BytesIO()
+    Image.new('RGB', (int(width * resolution / 72), int(height * resolution / 72)), 'white').save(png, 'png')
+    return png.getvalue()
+
+
+def test_export(tmpdir, monkeypatch):
+    monkeypatch.setattr(main, 'rasterize', fake_rasterize)
+    directory = str(tmpdir.join('thumbnails'))
+    options = main.clean_opts(main.parse_opts(['--expansions', 'cornucopia', '--back', 'rules']))
+
+    names = gallery.export(options, directory, dpi=36, sprite=True, workers=1)
+    assert 'Tournament-front.png' in names and 'Tournament-back.png' in names
+    assert len(names) == 2 * len(main.selected_cards(options))
+    width, height = main.parse_cardsize(options.size, options.sleeved)
+    with Image.open(tmpdir.join('thumbnails', 'Tournament-front.png').strpath) as thumbnail:
+        assert thumbnail.size[0] == int(width * 36 / 72)
+
+    with open(tmpdir.join('thumbnails', gallery.SPRITE_INDEX).strpath) as index_file:
+        index = json.load(index_file)
+    assert sorted(index['thumbnails']) == sorted(names)
+    with Image.open(tmpdir.join('thumbnails', gallery.SPRITE).strpath) as sprite:
+        assert sprite.size == (index['width'], index['height'])
+
+    # nothing changed, nothing drawn
+    rendered = []
+    monkeypatch.setattr(gallery, 'render', lambda args: rendered.extend(args[2]))
+    assert gallery.export(options, directory, dpi=36, workers=1) == names
+    assert rendered == []
+
+    # other options, new thumbnails
+    options = main.clean_opts(main.parse_opts(['--expansions', 'cornucopia', '--back', 'rules', '--tab-side', 'left']))
+    gallery.export(options, directory, dpi=36, workers=1)
+    assert len(rendered) == len(names)
+
+
+def test_export_workers(tmpdir, monkeypatch):
+    # the workers draw from the layout of export, the same thumbnails as without them
+    monkeypatch.setattr(main, 'rasterize', fake_rasterize)
+    options = main.clean_opts(main.parse_opts(['--expansions', 'cornucopia']))
+    names = gallery.export(options, str(tmpdir.join('one')), dpi=36, workers=1)
+
+    layout = gallery.layout
+    layouts = []
+
+    def counted_layout(options):
+        layouts.append(options)
+        return layout(options)
+    monkeypatch.setattr(gallery, 'layout', counted_layout)
+    assert gallery.export(options, str(tmpdir.join('two')), dpi=36, workers=2) == names
+    assert len(layouts) == 1 and gallery.LAYOUTS == []
+    for name in names:
+        assert tmpdir.join('one', name).read_binary() == tmpdir.join('two', name).read_binary()
+
+
+def test_export_languages(tmpdir, monkeypatch):
+    # each language gets its thumbnails
+    monkeypatch.setattr(main, 'rasterize', fake_rasterize)
+    options = main.clean_opts(main.parse_opts(['--expansions', 'cornucopia', '--language', 'en_us', 'de']))
+    names = gallery.export(options, str(tmpdir.join('thumbnails')), dpi=36, workers=1)
+    assert 'en_us-Tournament-front.png' in names and 'de-Tournament-front.png' in names
+    assert len(names) == 2 * 2 * len(main.selected_cards(options.replace(languages=['de'], language='de')))
+    # and the cards are left as they were
+    state = main.Card.getClassState()
+    gallery.export(options, str(tmpdir.join('thumbnails')), dpi=36, workers=1)
+    assert main.Card.getClassState() == state
@@ -1,8 +1,15 @@
 from __future__ import print_function
 
+import io
+import multiprocessing
+import sys
+
 import pytest
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.pdfgen import canvas
 
-from .. import main
+from .. import draw, main
+from ..cards import Card
 
 
 def get_clean_opts(opts):
@@ -22,3 +29,374 @@ def test_grouped(lang):
     print('checking ' + lang)
     options = get_clean_opts(['--special-card-groups', '--language={}'.format(lang)])
     main.generate(options)
+
+
+def test_incremental(tmpdir):
+    import pdfrw
+    outfile = str(tmpdir.join('incremental.pdf'))
+
+    options = get_clean_opts(['--incremental', '--expansions', 'base', '--outfile', outfile])
+    main.generate(options)
+    first = pdfrw.PdfReader(outfile)
+
+    # Adding an expansion after the first one leaves the pages of the first unchanged
+    options = get_clean_opts(['--incremental', '--expansions', 'base', 'promo', '--outfile', outfile])
+    dd = main.calculate_layout(options, main.filter_sort_cards(main.read_card_data(options), options))
+    dd.draw()
+    second = pdfrw.PdfReader(outfile)
+    assert len(second.pages) > len(first.pages)
+    reused = [f for f in dd.pageFingerprints if f in dd.previousPages]
+    assert 0 < len(reused) < len(dd.pageFingerprints)
+
+
+def test_incremental_without_pdfrw(tmpdir, monkeypatch, capsys):
+    # Without pdfrw there is a warning and all pages are drawn
+    monkeypatch.setitem(sys.modules, 'pdfrw', None)
+    outfile = tmpdir.join('incremental.pdf')
+    options = get_clean_opts(['--incremental', '--expansions', 'base', '--outfile', str(outfile)])
+    dd = main.calculate_layout(options, main.filter_sort_cards(main.read_card_data(options), options))
+    dd.draw()
+    assert 'needs the pdfrw package' in capsys.readouterr().err
+    assert dd.previousPages is None
+    assert outfile.size() > 0
+    assert not tmpdir.join('incremental.pages.json').check()
+
+
+def test_repeated_dividers(tmpdir):
+    # The four identical blank dividers are drawn once (per tab position) and then reused
+    options = get_clean_opts(['--expansions', 'base', '--include-blanks', '4', '--tab-side', 'right',
+                              '--outfile', str(tmpdir.join('blanks.pdf'))])
+    dd = main.calculate_layout(options, main.filter_sort_cards(main.read_card_data(options), options))
+    dd.draw()
+    assert len(dd.dividerForms) == 2  # front and back
+    assert len(dd.dividerKeys) == 8
+
+
+def test_optimize_size(tmpdir):
+    sizes = {}
+    for opts in [[], ['--optimize-size']]:
+        options = get_clean_opts(['--expansions', 'dominion2ndEdition', '--outfile', str(tmpdir.join('size.pdf'))] +
+                                 opts)
+        dd = main.calculate_layout(options, main.filter_sort_cards(main.read_card_data(options), options))
+        dd.draw()
+        sizes[tuple(opts)] = dd.outputSize
+    assert options.image_dpi == 300
+    # the set icons are resampled, the small icons are kept as they are
+    assert dd.imagePath('dominion2ndEdition_set.png') != dd.get_image_filepath('dominion2ndEdition_set.png')
+    assert dd.imagePath('card.png') == dd.get_image_filepath('card.png')
+    assert sizes[('--optimize-size',)] < sizes[()]
+
+
+def test_optimize_size_conflict():
+    with pytest.raises(ValueError):
+        get_clean_opts(['--optimize-size', '--no-page-compression'])
+
+
+def test_preview_languages():
+    # a preview is one page in one language
+    with pytest.raises(ValueError):
+        get_clean_opts(['--preview', '--language', 'en_us', 'de'])
+    with pytest.raises(ValueError):
+        main.generate_sample(get_clean_opts(['--language', 'en_us', 'de']))
+
+
+def test_stream_encoding():
+    # drawers with the same encoding share it, one with another one waits for them, and the setting is put back
+    import threading
+    from reportlab import rl_config
+    from ..draw import StreamEncoding
+
+    encoding = StreamEncoding()
+    default = rl_config.useA85
+    used = []
+
+    def draw_default():
+        with encoding.use():
+            used.append(rl_config.useA85)
+
+    with encoding.use(0):
+        with encoding.use(0):
+            assert rl_config.useA85 == 0
+        waiting = threading.Thread(target=draw_default)
+        waiting.start()
+        waiting.join(0.2)
+        assert used == []
+    waiting.join()
+    assert used == [default]
+    assert rl_config.useA85 == default
+
+
+def test_plotter_path():
+    from io import BytesIO
+    from reportlab.pdfgen import canvas
+    from ..draw import Plotter
+
+    c = canvas.Canvas(BytesIO())
+    plotter = Plotter(c, usePath=True)
+    plotter.plot(10, 0, plotter.LINE)
+    plotter.plot(0, 10, plotter.LINE)
+    plotter.plot(5, 5)
+    plotter.plot(0, 10, plotter.DOT)
+    plotter.stroke()
+    ops = ' '.join(c._code).split()
+    # one continuous line, a move for the dot, and a single stroke at the end
+    assert ops.count('m') == 2
+    assert ops.count('l') == 2
+    assert ops.count('S') == 1
+
+
+def test_page_cropmarks(tmpdir):
+    options = get_clean_opts(['--cropmarks', '--expansions', 'dominion2ndEdition', 'intrigue2ndEdition',
+                              '--outfile', str(tmpdir.join('cropmarks.pdf'))])
+    dd = main.calculate_layout(options, main.filter_sort_cards(main.read_card_data(options), options))
+    dd.draw()
+    # full pages (front and back) share their cropmarks, only the last ones differ
+    assert len(dd.pages) > 2
+    assert len(dd.cropmarkForms) == 4
+
+    # marks shared by dividers next to each other are only drawn once
+    class Marks(set):
+        added = 0
+
+        def add(self, mark):
+            self.added += 1
+            set.add(self, mark)
+
+    marks = Marks()
+    hMargin, vMargin, page = dd.pages[0]
+    for item in page:
+        dd.drawDivider(item, horizontalMargin=hMargin, verticalMargin=vMargin, cropmarks=marks)
+    assert 0 < len(marks) < marks.added
+
+
+@pytest.mark.parametrize('args', [['--orientation', 'vertical'], ['--wrapper', '--back-offset', '0.5'],
+                                  ['--rotate', '90'], ['--rotate', '180', '--back-offset', '0.5'],
+                                  ['--rotate', '270', '--back-offset-height', '0.5']])
+def test_page_matrix(tmpdir, args):
+    # the cropmarks are put on the page with the transform the divider is drawn with
+    options = get_clean_opts(['--cropmarks', '--expansions', 'dominion2ndEdition',
+                              '--outfile', str(tmpdir.join('matrix.pdf'))] + args)
+    dd = main.calculate_layout(options, main.filter_sort_cards(main.read_card_data(options), options))
+    dd.canvas = canvas.Canvas(io.BytesIO())
+    hMargin, vMargin, page = dd.pages[0]
+    for isBack in [False, True]:
+        pageWidth = dd.options.paperwidth - 2 * hMargin
+        x0, y0 = hMargin, vMargin
+        if isBack:
+            x0 += dd.options.back_offset
+            y0 += dd.options.back_offset_height
+            pageWidth -= 2 * dd.options.back_offset
+        for item in page:
+            dd.canvas.saveState()
+            dd.canvas.translate(x0, y0)
+            item.translate(dd.canvas, pageWidth, isBack)
+            expected = [round(v, 6) for v in dd.canvas._currentMatrix]
+            assert [round(v, 6) for v in item.pageMatrix(pageWidth, isBack, x0, y0)] == expected
+            dd.canvas.restoreState()
+
+
+def test_card_render(tmpdir, monkeypatch):
+    # Every card is resolved once, no matter how many sides of it get drawn
+    options = get_clean_opts(['--expansions', 'dominion2ndEdition', '--wrapper', '--cost', 'tab', '--outfile',
+                              str(tmpdir.join('render.pdf'))])
+    cards = main.filter_sort_cards(main.read_card_data(options), options)
+    dd = main.calculate_layout(options, cards)
+    resolved = []
+    resolveCard = dd.resolveCard
+
+    def recording_resolveCard(card):
+        resolved.append(card)
+        return resolveCard(card)
+    monkeypatch.setattr(dd, 'resolveCard', recording_resolveCard)
+    dd.draw()
+    assert sorted(id(c) for c in resolved) == sorted(id(c) for c in cards)
+
+    render = [item.render for hMargin, vMargin, page in dd.pages for item in page
+              if item.card.card_tag == 'Village'][0]
+    assert render.upper_name == 'VILLAGE'
+    assert render.tab_name_lines == ('VILLAGE', )
+    assert render.tab_cost and render.tab_text_inset == 4 + dd.costWidth(render)
+    # the width only depends on the costs, so it is the same worked out from the card
+    for hMargin, vMargin, page in dd.pages:
+        for item in page:
+            assert dd.costWidth(item.card) == dd.costWidth(item.render)
+    assert render.set_image == 'dominion2ndEdition_set.png'
+    with pytest.raises(AttributeError):
+        render.name = 'Town'
+
+
+def test_paragraph_styles(tmpdir):
+    # The text of all dividers shares a few styles, shrinking the text asks for a smaller one
+    options = get_clean_opts(['--expansions', 'adventures', '--front', 'rules', '--back', 'card', '--outfile',
+                              str(tmpdir.join('styles.pdf'))])
+    cards = main.filter_sort_cards(main.read_card_data(options), options)
+    dd = main.calculate_layout(options, cards)
+    dd.draw()
+    body = dd.baseStyles['BodyText']
+    style = dd.paragraphStyle('Times-Roman', 4)
+    assert style is dd.paragraphStyle('Times-Roman', 4, body.fontSize, body.leading)
+    assert (style.fontName, style.alignment) == ('Times-Roman', 4)
+    assert len(dd.paragraphStyles) < len(cards)
+    assert any(s.fontSize < body.fontSize for s in dd.paragraphStyles.values())
+    # the sample style itself is left alone
+    sample = getSampleStyleSheet()['BodyText']
+    assert (body.fontName, body.fontSize, body.alignment) == (sample.fontName, sample.fontSize, sample.alignment)
+
+
+def test_draw_name(tmpdir):
+    # A name is drawn as one text object, switching the size between the first letter and the rest of each word
+    options = get_clean_opts(['--expansions', 'base', '--outfile', str(tmpdir.join('name.pdf'))])
+    cards = main.filter_sort_cards(main.read_card_data(options), options)
+    dd = main.calculate_layout(options, cards)
+    dd.registerFonts()
+    dd.canvas = canvas.Canvas(str(tmpdir.join('name.pdf')))
+    start = len(dd.canvas._code)
+    dd.drawName('THRONE ROOM', 10, 20, 12)
+    code = dd.canvas._code[start:]
+    assert len(code) == 1
+    assert code[0].count('BT') == 1 and code[0].count('Tf') == 4
+    assert '(T) Tj' in code[0] and '(HRONE) Tj' in code[0] and '( R) Tj' in code[0]
+
+
+def test_layout_workers(tmpdir, monkeypatch):
+    # Fitting the text in worker processes gives the same sizes as fitting it while drawing
+    def layouts(*args, **changes):
+        options = get_clean_opts(['--expansions', 'cornucopia', '--back', 'rules', '--outfile',
+                                  str(tmpdir.join('layout.pdf'))] + list(args)).replace(**changes)
+        cards = main.filter_sort_cards(main.read_card_data(options), options)
+        dd = main.calculate_layout(options, cards)
+        dd.draw()
+        return dd.textLayouts
+
+    textLayouts = layouts()
+    assert textLayouts == layouts('--layout-workers', '2')
+    # the workers don't need the outfile
+    assert textLayouts == layouts('--layout-workers', '2', outfile=io.BytesIO())
+    # a worker only needs what comes with its jobs
+    options = get_clean_opts(['--expansions', 'cornucopia', '--image-dpi', '150', '--outfile',
+                              str(tmpdir.join('layout.pdf'))])
+    cards = main.filter_sort_cards(main.read_card_data(options), options)
+    dd = main.calculate_layout(options, cards)
+    dd.draw()
+    imageSizes = dd.imageDrawSizes()
+    jobs = sorted(dd.textLayouts)
+    expected = [dd.textLayouts[job] for job in jobs]
+    monkeypatch.setattr(Card, 'types', {})
+    monkeypatch.setattr(Card, 'sets', {})
+    assert draw.layoutTexts((dd.options, imageSizes, jobs)) == expected
+    monkeypatch.undo()
+    # without fork, the texts are laid out in this process
+    monkeypatch.setattr(multiprocessing, 'get_all_start_methods', lambda: ['spawn'])
+    monkeypatch.setattr(multiprocessing, 'get_context', None)
+    assert textLayouts == layouts('--layout-workers', '2')
+    assert len([job for job in textLayouts if job[0] == 'Tournament']) == 2  # card text and rules
+    assert any(layout.font_size < 10 for layout in textLayouts.values())
+
+
+def test_num_pages_resolves_shown_cards(tmpdir):
+    # Only the cards on the pages that are drawn get a CardPlot and are resolved
+    def pages(*args):
+        options = get_clean_opts(['--expansions', 'dominion2ndEdition', '--outfile',
+                                  str(tmpdir.join('first.pdf'))] + list(args))
+        cards = main.filter_sort_cards(main.read_card_data(options), options)
+        dd = main.calculate_layout(options, cards)
+        dd.draw(cards)
+        return [[(item.card.card_tag, item.tabIndex, item.x, item.y) for item in page]
+                for hMargin, vMargin, page in dd.pages], dd
+
+    allPages, dd = pages()
+    firstPages, dd = pages('--num-pages', '2')
+    assert len(allPages) > 2 and firstPages == allPages[:2]
+    assert all(item.render is not None for hMargin, vMargin, page in dd.pages for item in page)
+
+    allPages, dd = pages('--wrapper', '--pack-wrappers')
+    firstPages, dd = pages('--wrapper', '--pack-wrappers', '--num-pages', '1')
+    assert len(allPages) > 1 and firstPages == allPages[:1]
+
+
+def test_render_divider():
+    options = get_clean_opts(['--expansions', 'dominion2ndEdition', '--back', 'rules'])
+    expansions = tuple(options.expansions)
+    pdf = main.render_divider(options, 'Chapel', side='back')
+    assert pdf.startswith(b'%PDF') and b'/Count 1 ' in pdf
+    # a page just big enough for the divider with its tab
+    width, height = main.parse_cardsize(options.size, options.sleeved)
+    assert '/MediaBox [ 0 0 {:.4f} '.format(width).encode('ascii') in pdf
+
+    # the selection is only made once, and leaves the options alone
+    assert options.expansions == expansions
+    selected = main.selected_cards(options)
+    assert main.render_divider(options, 'Village')
+    assert main.selected_cards(options) is selected
+
+    with pytest.raises(ValueError):
+        main.render_divider(options, 'Pixie')
+    # one divider, in one language
+    with pytest.raises(ValueError):
+        main.render_divider(options.replace(languages=['en_us', 'de']), 'Chapel')
+
+
+def test_render_divider_tab(monkeypatch):
+    # The divider gets the tab it has in the whole document, without laying out the document
+    options = get_clean_opts(['--expansions', 'dominion2ndEdition', 'intrigue2ndEdition', '--tab-side', 'left',
+                              '--tab-number', '3', '--tab-serpentine',
+                              '--expansion-dividers', '--expansion-reset-tabs'])
+    cards = main.selected_cards(options)
+    dd = main.calculate_layout(options, cards)
+    tabs = {}
+    for hMargin, vMargin, page in dd.pages:
+        for item in page:
+            tabs.setdefault(item.card.card_tag, (item.tabIndex, item.tabIndexBack, item.tabOffset))
+
+    plots = []
+    cardPlot = main.DividerDrawer.cardPlot
+
+    def recording_cardPlot(self, *args):
+        plots.append(cardPlot(self, *args))
+        return plots[-1]
+    monkeypatch.setattr(main.DividerDrawer, 'cardPlot', recording_cardPlot)
+    monkeypatch.setattr(main.DividerDrawer, 'calculatePages', None)
+    for card_tag in ['Moat', 'Courtyard', 'Witch', 'Masquerade']:
+        main.render_divider(options, card_tag)
+        item = plots[-1]
+        assert (item.tabIndex, item.tabIndexBack, item.tabOffset) == tabs[card_tag]
+    assert len(plots) == 4
+
+
+def test_selected_cards_state():
+    # The cards of a selection are drawn with the sets and types of their language
+    english = get_clean_opts(['--expansions', 'cornucopia'])
+    german = get_clean_opts(['--expansions', 'cornucopia', '--language', 'de'])
+    main.selected_cards(english)
+    state = Card.getClassState()
+    main.selected_cards(german)
+    assert Card.getClassState() != state
+    main.selected_cards(english)
+    assert Card.getClassState() == state
+
+
+def test_selected_cards_cardlist(tmpdir):
+    # a changed --cardlist file selects the cards again
+    cardlist = tmpdir.join('cards.txt')
+    cardlist.write('Village\n')
+    options = get_clean_opts(['--expansions', 'dominion2ndEdition', '--cardlist', str(cardlist)])
+    assert [card.name for card in main.selected_cards(options)] == ['Village']
+    cardlist.write('Village\nSmithy\n')
+    assert sorted(card.name for card in main.selected_cards(options)) == ['Smithy', 'Village']
+
+
+def test_several_languages(tmpdir):
+    # one document, each language starting on a new page
+    options = get_clean_opts(['--expansions', 'cornucopia', '--language', 'en_us', 'de', '--outfile',
+                              str(tmpdir.join('languages.pdf'))])
+    sections = main.CardPipeline(options).run_languages(main.read_card_data(options), options.languages)
+    dd = main.calculate_layout(options, [], sections)
+    english, german = [main.calculate_layout(options, cards).pages for language, cards, state in sections]
+    assert len(dd.pages) == len(english) + len(german)
+    assert [item.card.name for item in dd.pages[len(english)][2]] == [item.card.name for item in german[0][2]]
+    state = Card.getClassState()
+    dd.draw()
+    assert Card.getClassState() == state
+    renders = dict((item.card.card_tag, item.render) for hMargin, vMargin, page in dd.pages[len(english):]
+                   for item in page)
+    assert '<b>+1 Aktion</b>' in renders['Hamlet'].description
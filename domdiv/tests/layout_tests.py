@@ -1,34 +1,182 @@
+import argparse
+import copy
+import json
+import pickle
+import pytest
+
 from reportlab.lib.units import cm
 
-from .. import main
+from .. import draw, main
 
 
 def test_horizontal():
     # should be the default
     options = main.parse_opts([])
     assert options.orientation == 'horizontal'
-    main.calculate_layout(options)
-    assert options.numDividersHorizontal == 2
-    assert options.numDividersVertical == 3
-    assert options.dividerWidth == 9.1 * cm
-    assert options.labelHeight == 0.9 * cm
-    assert options.dividerHeight == 5.9 * cm + options.labelHeight
+    plan = main.calculate_layout(options).plan
+    assert plan.numDividersHorizontal == 2
+    assert plan.numDividersVertical == 3
+    assert plan.dividerWidth == 9.1 * cm
+    assert plan.labelHeight == 0.9 * cm
+    assert plan.dividerHeight == 5.9 * cm + plan.labelHeight
 
 
 def test_vertical():
     options = main.parse_opts(['--orientation', 'vertical'])
     assert options.orientation == 'vertical'
-    main.calculate_layout(options)
-    assert options.numDividersHorizontal == 3
-    assert options.numDividersVertical == 2
-    assert options.dividerWidth == 5.9 * cm
-    assert options.labelHeight == 0.9 * cm
-    assert options.dividerHeight == 9.1 * cm + options.labelHeight
+    plan = main.calculate_layout(options).plan
+    assert plan.numDividersHorizontal == 3
+    assert plan.numDividersVertical == 2
+    assert plan.dividerWidth == 5.9 * cm
+    assert plan.labelHeight == 0.9 * cm
+    assert plan.dividerHeight == 9.1 * cm + plan.labelHeight
 
 
 def test_sleeved():
     options = main.parse_opts(['--size', 'sleeved'])
-    main.calculate_layout(options)
-    assert options.dividerWidth == 9.4 * cm
-    assert options.labelHeight == 0.9 * cm
-    assert options.dividerHeight == 6.15 * cm + options.labelHeight
+    plan = main.calculate_layout(options).plan
+    assert plan.dividerWidth == 9.4 * cm
+    assert plan.labelHeight == 0.9 * cm
+    assert plan.dividerHeight == 6.15 * cm + plan.labelHeight
+
+
+def test_layout_only(tmpdir):
+    outfile = tmpdir.join('layout.pdf')
+    options = main.clean_opts(main.parse_opts(['--layout-only', '--expansions', 'base', '--outfile', str(outfile)]))
+    main.generate(options)
+    assert not outfile.check()
+    layout = json.loads(tmpdir.join('layout.json').read())
+    assert layout['dividers_horizontal'] == 2
+    assert layout['dividers_vertical'] == 3
+    assert layout['pdf_pages'] == 2 * layout['sheets'] == 2 * len(layout['pages'])
+    first = layout['pages'][0]['dividers'][0]
+    assert first['crop'] == {'top': True, 'bottom': False, 'left': True, 'right': False}
+    assert first['y'] == 2 * layout['divider_height']
+
+
+def test_estimate():
+    for args in [['--expansions', 'base'], ['--expansions', 'base', 'promo', '--wrapper'], ['--num-pages', '2']]:
+        options = main.clean_opts(main.parse_opts(args))
+        estimate = main.estimate(options)
+        assert estimate == main.estimate(options)  # now from the card count cache
+        cards = main.filter_sort_cards(main.read_card_data(options), options)
+        dd = main.calculate_layout(options, cards)
+        layout = dd.getLayout()
+        assert estimate['sheets'] == layout['sheets']
+        assert estimate['pdf_pages'] == layout['pdf_pages']
+        assert estimate['dividers_per_page'] == layout['dividers_horizontal'] * layout['dividers_vertical']
+        assert estimate['dividers'] == len(cards)
+
+
+def test_pack_wrappers():
+    args = ['--wrapper', '--papersize', 'legal', '--expansions', 'base', 'dominion2ndEdition']
+    options = main.clean_opts(main.parse_opts(args))
+    grid = main.calculate_layout(options, main.filter_sort_cards(main.read_card_data(options), options))
+
+    options = main.clean_opts(main.parse_opts(args + ['--pack-wrappers']))
+    packed = main.calculate_layout(options, main.filter_sort_cards(main.read_card_data(options), options))
+    assert len(packed.pages) < len(grid.pages)
+    assert main.estimate(main.clean_opts(main.parse_opts(args + ['--pack-wrappers'])))['sheets'] == len(packed.pages)
+
+    # the wrappers stay in order, and on the page without overlapping
+    items = [item for _, _, page in packed.pages for item in page]
+    assert [item.card.name for item in items] == [item.card.name for _, _, page in grid.pages for item in page]
+    for hMargin, vMargin, page in packed.pages:
+        boxes = [(item.x, item.y, item.x + item.cardWidth,
+                  item.y + 2 * (item.cardHeight + item.tabHeight + item.stackHeight)) for item in page]
+        for box in boxes:
+            assert box[0] >= 0 and box[1] >= 0
+            assert box[2] + hMargin <= packed.plan.paperwidth and box[3] + vMargin <= packed.plan.paperheight
+        for i, a in enumerate(boxes):
+            for b in boxes[i + 1:]:
+                assert a[2] <= b[0] or b[2] <= a[0] or a[3] <= b[1] or b[3] <= a[1]
+
+
+def test_options_from_dict(monkeypatch):
+    assert main.get_parser() is main.get_parser()
+    args = ['--expansions', 'base', 'intrigue', '--fan', 'animals', '--tab-side', 'left-alternate',
+            '--front', 'rules', '--tabwidth', '3', '--language', 'de', 'fr', '--wrapper']
+    values = {'expansions': ['base', 'intrigue'], 'fan': 'animals', 'tab-side': 'left-alternate',
+              '--front': 'rules', 'tabwidth': '3', 'language': ['de', 'fr'], 'wrapper': True}
+    assert vars(main.options_from_dict(values)) == vars(main.parse_opts(args))
+    assert vars(main.clean_opts(main.options_from_dict(values))) == vars(main.clean_opts(main.parse_opts(args)))
+
+    # the defaults are not shared between options, not even lists in lists
+    options = main.options_from_dict({})
+    options.cost.append('body-top')
+    assert main.options_from_dict({}).cost == ['tab']
+    monkeypatch.setitem(main.PARSER_CACHE['defaults'], 'expansions', [['base']])
+    main.options_from_dict({}).expansions[0].append('intrigue')
+    assert main.options_from_dict({}).expansions == [['base']]
+
+    # every option is known by its dest
+    actions = main.PARSER_CACHE['actions']
+    assert set(option.action.dest for option in actions.values()) == set(main.PARSER_CACHE['defaults'])
+    assert actions['wrapper'].kind == 'store_true' and actions['expansions'].kind == 'append'
+
+    for values in [{'tab_side': 'up'}, {'tabwidth': 'wide'}, {'no_such_option': 1}]:
+        with pytest.raises(ValueError):
+            main.options_from_dict(values)
+
+
+def test_layout_plan():
+    options = main.clean_opts(main.parse_opts(['--expansions', 'base', 'intrigue', '--orientation', 'vertical',
+                                               '--upgrade-with-expansion', '--exclude-events']))
+    with pytest.raises(AttributeError):
+        options.tabwidth = 2
+    before = vars(copy.deepcopy(options))
+    assert main.clean_opts(options) is options
+    # cleaning them again changes nothing
+    assert vars(main.clean_opts(argparse.Namespace(**copy.deepcopy(before)))) == before
+
+    # the options are left as they are, and the same plan is used for the same layout
+    cards = main.filter_sort_cards(main.read_card_data(options), options)
+    first = main.calculate_layout(options, cards)
+    second = main.calculate_layout(options, cards)
+    assert vars(options) == before
+    assert second.plan is first.plan
+    assert [len(page) for _, _, page in second.pages] == [len(page) for _, _, page in first.pages]
+    assert first.options.numDividersHorizontal == first.plan.numDividersHorizontal
+    assert main.calculate_layout(options.replace(tabwidth=3.0), cards).plan is not first.plan
+
+
+def test_lru_cache():
+    cache = draw.LRUCache(2)
+    cache['a'] = 1
+    cache['b'] = 2
+    assert cache.get('a') == 1
+    cache['c'] = 3
+    # 'b' was the least recently used
+    assert 'b' not in cache and cache.get('b') is None
+    assert cache.get('a') == 1 and cache.get('c') == 3 and len(cache) == 2
+
+    # the labels database gets the defaults of a label on a copy
+    label = [label for label in main.LABEL_INFO if '8867' in label['names']][0]
+    keys = set(label)
+    options = main.clean_opts(main.parse_opts(['--label', '8867']))
+    assert 'pad-vertical' in options.label and set(label) == keys
+
+
+def test_options_frozen(tmpdir):
+    # the lists and dicts of the options can't be changed in place either, but still pickle, copy and go to json
+    options = main.clean_opts(main.parse_opts(['--expansions', 'base', '--label', '8867']))
+    with pytest.raises(AttributeError):
+        options.expansions.append('intrigue')
+    with pytest.raises(TypeError):
+        options.label['margin-top'] = 99
+    with pytest.raises(TypeError):
+        options.label.update({'margin-top': 99})
+    assert options.expansions == ('base', )
+    for copied in [pickle.loads(pickle.dumps(options)), copy.deepcopy(options)]:
+        assert vars(copied) == vars(options)
+        with pytest.raises(TypeError):
+            copied.label['margin-top'] = 99
+    assert json.loads(json.dumps(options.label)) == json.loads(json.dumps(dict(options.label)))
+
+    # a drawer given other options lays its pages out again from them
+    cards = main.filter_sort_cards(main.read_card_data(options), options)
+    dd = main.calculate_layout(options, cards)
+    other = options.replace(label=None, label_name=None, outfile=str(tmpdir.join('other.pdf')))
+    dd.draw(cards, main.calculate_dimensions(other))
+    assert dd.plan is main.calculate_layout(other, cards).plan
+    assert dd.plan.numDividersVertical != main.calculate_layout(options, cards).plan.numDividersVertical
@@ -0,0 +1,25 @@
+import os
+
+import pkg_resources
+from PIL import Image
+
+from .. import resample
+
+
+def test_build_variants(tmpdir):
+    image_dir = pkg_resources.resource_filename('domdiv', 'images')
+    db_dir = pkg_resources.resource_filename('domdiv', 'card_db')
+    resample.build_variants(image_dir, db_dir, str(tmpdir), dpis=[300])
+
+    # set icons are drawn at 14x12pt, 59 pixels at 300 dpi
+    assert Image.open(str(tmpdir.join('300dpi', 'dominion2ndEdition_set.png'))).size == (59, 59)
+    # the banner is about the size of the default tab already
+    assert not os.path.exists(str(tmpdir.join('300dpi', 'action.png')))
+
+    # smallest good enough variant, or the original
+    assert resample.select_variant(str(tmpdir), 'dominion2ndEdition_set.png', 300, resample.SET_ICON_SIZE, {}) == \
+        str(tmpdir.join('300dpi', 'dominion2ndEdition_set.png'))
+    assert resample.select_variant(str(tmpdir), 'dominion2ndEdition_set.png', 600, resample.SET_ICON_SIZE, {}) == \
+        str(tmpdir.join('dominion2ndEdition_set.png'))
+    assert resample.select_variant(str(tmpdir), 'action.png', 300, resample.TAB_SIZE, {}) == \
+        str(tmpdir.join('action.png'))
@@ -0,0 +1,70 @@
+import os
+
+import pytest
+
+from .. import main
+from .. import server
+
+
+@pytest.fixture
+def card_state():
+    # put back the Card class state the test changes by reading cards
+    state = main.Card.getClassState()
+    yield
+    main.Card.setClassState(state)
+
+
+@pytest.fixture
+def no_gc_freeze(monkeypatch):
+    # warm() freezes the garbage collector for the workers, which would be this pytest process
+    monkeypatch.setattr(server.gc, 'freeze', lambda: None, raising=False)
+
+
+def test_preload_resources():
+    cache = main.preload_resources(['de'])
+    assert os.path.join('card_db', 'cards_db.json') in cache
+    assert os.path.join('card_db', 'de', 'cards_de.json') in cache
+    with main.get_resource_stream(os.path.join('card_db', 'sets_db.json')) as setfile:
+        assert setfile.read() == cache[os.path.join('card_db', 'sets_db.json')]
+
+
+def test_prefork(tmpdir, no_gc_freeze):
+    outfile = str(tmpdir.join('prefork.pdf'))
+
+    def request_loop(number, handler):
+        options = main.parse_opts(['--expansions', 'base', '--outfile', outfile])
+        handler(options)
+
+    pool = server.Prefork(request_loop, workers=1, languages=['en_us'], respawn=False)
+    pool.serve()
+    assert pool.warmed
+    assert not pool.children
+    assert os.path.getsize(outfile) > 0
+
+
+def test_prefork_respawn(tmpdir, no_gc_freeze):
+    # a failing worker is started again a limited number of times, a finished one is not
+    runs = tmpdir.join('runs')
+
+    def request_loop(number, handler):
+        runs.write('{}\n'.format(number), mode='a')
+        if number == 0:
+            raise RuntimeError("worker failed")
+
+    pool = server.Prefork(request_loop, workers=2, languages=['en_us'], respawn=True, max_respawns=2,
+                          respawn_delay=0)
+    pool.serve()
+    assert sorted(runs.read().split()) == ['0', '0', '0', '1']
+    assert pool.respawns[0] == 2 and pool.respawns[1] == 0
+
+
+def test_parsed_resources(card_state):
+    main.preload_resources(['de'])
+    assert os.path.join('card_db', 'cards_db.json') in main.PARSED_RESOURCES
+    assert os.path.join('card_db', 'de', 'sets_de.json') in main.PARSED_RESOURCES
+    options = main.clean_opts(main.parse_opts([]))
+    cards = main.read_card_data(options)
+    # the parsed databases are not changed by reading the cards
+    main.Card.sets['base']['set_name'] = 'changed'
+    assert main.parsed_resource(os.path.join('card_db', 'sets_db.json'))['base']['set_name'] == '*base*'
+    assert len(main.read_card_data(options)) == len(cards)
@@ -0,0 +1,79 @@
+import json
+import shutil
+
+import pkg_resources
+
+from .. import main
+from .. import sqlitedb
+
+
+def test_build_database(tmpdir):
+    db_dir = pkg_resources.resource_filename('domdiv', 'card_db')
+    path = str(tmpdir.join('cards.sqlite'))
+    sqlitedb.build_database(db_dir, path)
+    database = sqlitedb.CardDatabase(path)
+
+    with open(pkg_resources.resource_filename('domdiv', 'card_db/cards_db.json')) as cardfile:
+        cards = json.load(cardfile)
+    assert database.cards() == cards
+    assert database.cards(cardset_tags=['base']) == [c for c in cards if 'base' in c['cardset_tags']]
+    assert database.cards(types=['Event'], cardset_tags=['empires']) == \
+        [c for c in cards if 'Event' in c['types'] and 'empires' in c['cardset_tags']]
+    assert [c['card_tag'] for c in database.cards(card_tags=['Moat'])] == ['Moat']
+    assert database.cards_in_sets(['empires'], also_types=['Event'], also_card_tags=['Moat']) == \
+        [c for c in cards if 'empires' in c['cardset_tags'] or 'Event' in c['types'] or c['card_tag'] == 'Moat']
+    assert database.edition_sets('1') == set(s for s, v in database.sets().items() if '1' in v['edition'])
+    assert database.card_text('de', ['Village', 'no such card']) == {'Village': {
+        'description': database.card_text('de')['Village']['description'],
+        'extra': database.card_text('de')['Village']['extra'],
+        'name': 'Dorf'}}
+    assert 'de' in database.languages()
+
+
+def test_card_database_selection(tmpdir):
+    db_dir = pkg_resources.resource_filename('domdiv', 'card_db')
+    path = str(tmpdir.join('cards.sqlite'))
+    sqlitedb.build_database(db_dir, path)
+
+    def select(*args):
+        options = main.clean_opts(main.parse_opts(list(args)))
+        cards = main.filter_sort_cards(main.read_card_data(options), options)
+        return [(c.card_tag, c.cardset_tag, c.name, c.description, c.types_name, c.count) for c in cards]
+
+    for args in [['--expansions', 'base', 'empires', '--language', 'fr'],
+                 ['--edition', '1', '--special-card-groups', '--exclude-events'],
+                 ['--expansions', 'intrigue1stEdition', '--upgrade-with-expansion', '--start-decks', '--curse10'],
+                 ['--expansions', 'seaside', '--exclude-landmarks', '--include-blanks', '2']]:
+        assert select(*args) == select('--card-database', path, *args)
+
+    # only the cards of the selected sets are read from the database
+    options = main.clean_opts(main.parse_opts(['--card-database', path, '--expansions', 'seaside']))
+    assert len(main.read_card_data(options)) < len(main.read_card_data(main.clean_opts(main.parse_opts([]))))
+
+
+def test_card_database_out_of_date(tmpdir, capsys):
+    # built from other json, so the json files of the package are read instead
+    db_dir = tmpdir.join('card_db')
+    shutil.copytree(pkg_resources.resource_filename('domdiv', 'card_db'), str(db_dir))
+    db_dir.join('sets_db.json').write('{}')
+    path = str(tmpdir.join('cards.sqlite'))
+    sqlitedb.build_database(str(db_dir), path)
+
+    options = main.clean_opts(main.parse_opts(['--card-database', path]))
+    assert main.get_card_database(options) is None
+    assert 'sets_db.json' in capsys.readouterr().err
+    assert main.read_card_data(options)
+
+
+def test_source_changed(tmpdir):
+    # by size and modification time, the file is only read to compare a copy with another modification time
+    source = tmpdir.join('sets_db.json')
+    source.write('{"base": {}}')
+    sha1 = sqlitedb.source_hash(source.read_binary())
+    size, mtime = sqlitedb.source_stamp(str(source))
+    assert not sqlitedb.source_changed(str(source), 'not read', size, mtime)
+    assert not sqlitedb.source_changed(str(source), sha1, size, mtime - 10)
+    assert sqlitedb.source_changed(str(source), sha1, size + 1, mtime)
+    source.write('{"core": {}}')
+    assert sqlitedb.source_changed(str(source), sha1, size, mtime - 10)
+    assert sqlitedb.source_changed(str(tmpdir.join('missing.json')), sha1, size, mtime)
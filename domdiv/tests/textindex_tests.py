@@ -0,0 +1,33 @@
+import json
+
+import pkg_resources
+import pytest
+
+from .. import textindex
+
+
+def test_build_indexes(tmpdir):
+    db_dir = pkg_resources.resource_filename('domdiv', 'card_db')
+    textindex.build_indexes(db_dir, str(tmpdir))
+
+    json_path = pkg_resources.resource_filename('domdiv', 'card_db/de/cards_de.json')
+    with open(json_path, 'rb') as json_file:
+        data = json_file.read()
+    card_text = json.loads(data.decode('utf-8'))
+
+    index = textindex.CardTextIndex(str(tmpdir.join('cards_de.idx')), json_path)
+    assert len(index) == len(card_text)
+    assert index.get('Village') == card_text['Village']
+    assert index.get('no such card') is None
+    assert index.select(['Moat', 'Curse', 'no such card']) == {'Moat': card_text['Moat'], 'Curse': card_text['Curse']}
+
+    # a copy of the json is only read to check it is the same, an index of other json is not used
+    copy = tmpdir.join('cards_de.json')
+    copy.write_binary(data)
+    assert len(textindex.CardTextIndex(str(tmpdir.join('cards_de.idx')), str(copy))) == len(card_text)
+    copy.write_binary(data.replace(b'Dorf', b'Torf', 1))
+    with pytest.raises(ValueError):
+        textindex.CardTextIndex(str(tmpdir.join('cards_de.idx')), str(copy))
+    copy.write_binary(data + b' ')
+    with pytest.raises(ValueError):
+        textindex.CardTextIndex(str(tmpdir.join('cards_de.idx')), str(copy))
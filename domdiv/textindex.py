@@ -0,0 +1,141 @@
+###########################################################################
+# Offset indexed copies of the card text files in domdiv/card_db
+#
+# A cards_<language>.json holds the text of every card, but a run usually only prints a few
+# sets.  build_indexes() writes each of them as a cards_<language>.idx into card_index/: a
+# header line with the size, modification time and sha1 of the json file it was built from
+# and the byte range of every card_tag's entry, followed by the entries themselves as compact
+# json.  CardTextIndex maps such a file into memory and only decodes the entries it is asked for.
+#
+# The json files stay what translators edit, the index is rebuilt from them by setup.py when
+# building the package, or directly with
+#     python domdiv/textindex.py
+# in a development checkout.  An index that does not match its json file is not used.  That is
+# checked by the size and modification time of the json file, it is only read (to compare its
+# sha1) if it has the right size but another modification time, e.g. when it was copied.
+#
+# This module only uses the standard library, so that setup.py can run it without importing
+# the domdiv package.
+###########################################################################
+from __future__ import print_function
+
+import argparse
+import hashlib
+import io
+import json
+import mmap
+import os
+
+INDEX_MAGIC = b'DOMDIV-CARD-TEXT 2\n'
+
+
+def index_name(language):
+    return "cards_{}.idx".format(language)
+
+
+def source_hash(data):
+    return hashlib.sha1(data).hexdigest()
+
+
+def source_stamp(path):
+    # The size and modification time of a json file
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime
+
+
+def build_index(json_path, index_path):
+    with open(json_path, 'rb') as json_file:
+        data = json_file.read()
+    size, mtime = source_stamp(json_path)
+    card_text = json.loads(data.decode('utf-8'))
+
+    entries = {}
+    body = io.BytesIO()
+    for card_tag in sorted(card_text):
+        entry = json.dumps(card_text[card_tag], sort_keys=True, separators=(',', ':')).encode('utf-8')
+        entries[card_tag] = [body.tell(), len(entry)]
+        body.write(entry)
+    header = json.dumps({'source': source_hash(data), 'size': size, 'mtime': mtime, 'entries': entries},
+                        sort_keys=True, separators=(',', ':')).encode('utf-8')
+
+    with open(index_path, 'wb') as index_file:
+        index_file.write(INDEX_MAGIC)
+        index_file.write(header + b'\n')
+        index_file.write(body.getvalue())
+    return len(entries)
+
+
+def build_indexes(db_dir, out_dir):
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+    for language in sorted(os.listdir(db_dir)):
+        json_path = os.path.join(db_dir, language, "cards_{}.json".format(language))
+        if not os.path.isfile(json_path):
+            continue
+        index_path = os.path.join(out_dir, index_name(language))
+        count = build_index(json_path, index_path)
+        print("Indexed the text of {} cards in {}".format(count, index_path))
+
+
+class CardTextIndex(object):
+
+    def __init__(self, index_path, source_path=None):
+        # source_path is the json file the index has to be built from.
+        # Raises ValueError if the file is not an index of it.
+        with open(index_path, 'rb') as index_file:
+            if index_file.read(len(INDEX_MAGIC)) != INDEX_MAGIC:
+                raise ValueError("{} is not a card text index".format(index_path))
+            header = json.loads(index_file.readline().decode('utf-8'))
+            if source_path is not None and not self.built_from(header, source_path):
+                raise ValueError("{} is out of date".format(index_path))
+            self.start = index_file.tell()
+            self.entries = header['entries']
+            self.data = mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    @staticmethod
+    def built_from(header, source_path):
+        size, mtime = source_stamp(source_path)
+        if size != header['size']:
+            return False
+        if mtime == header['mtime']:
+            return True
+        with open(source_path, 'rb') as source_file:
+            return source_hash(source_file.read()) == header['source']
+
+    def __contains__(self, card_tag):
+        return card_tag in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, card_tag):
+        if card_tag not in self.entries:
+            return None
+        offset, length = self.entries[card_tag]
+        offset += self.start
+        return json.loads(self.data[offset:offset + length].decode('utf-8'))
+
+    def select(self, card_tags):
+        # The text of the given card_tags, as a dict like the one in the json file.
+        # The entries are joined into one json object, decoding that is quicker than each on its own.
+        parts = []
+        for card_tag in card_tags:
+            if card_tag in self.entries:
+                offset, length = self.entries[card_tag]
+                offset += self.start
+                parts.append(json.dumps(card_tag).encode('utf-8') + b':' + self.data[offset:offset + length])
+        return json.loads((b'{' + b','.join(parts) + b'}').decode('utf-8'))
+
+
+def main():
+    here = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description="Build the offset indexed card text files")
+    parser.add_argument('--card-db', default=os.path.join(here, 'card_db'), help="Card database directory.")
+    parser.add_argument('--output', default=os.path.join(here, 'card_index'),
+                        help="Where to put the index files (default %(default)s).")
+    args = parser.parse_args()
+    build_indexes(args.card_db, args.output)
+
+
+if __name__ == '__main__':
+    main()
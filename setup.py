@@ -1,7 +1,31 @@
+import os
+import runpy
+
 from setuptools import setup, find_packages
+from setuptools.command.build_py import build_py
 
 version = '3.7'
 
+
+class BuildPyWithGeneratedData(build_py):
+    # Also build the card text index (see domdiv/textindex.py) and the lower resolution
+    # variants of the images (see domdiv/resample.py)
+    def run(self):
+        build_py.run(self)
+        if self.dry_run:
+            return
+        textindex = runpy.run_path(os.path.join('domdiv', 'textindex.py'))
+        textindex['build_indexes'](os.path.join('domdiv', 'card_db'),
+                                   os.path.join(self.build_lib, 'domdiv', 'card_index'))
+        resample = runpy.run_path(os.path.join('domdiv', 'resample.py'))
+        try:
+            resample['build_variants'](os.path.join('domdiv', 'images'),
+                                       os.path.join('domdiv', 'card_db'),
+                                       os.path.join(self.build_lib, 'domdiv', 'images'))
+        except ImportError:
+            print("Pillow is not installed, skipping the image variants")
+
+
 setup(
     name="domdiv",
     version=version,
@@ -11,10 +35,12 @@ setup(
         ],
     },
     packages=find_packages(exclude=['tests']),
+    cmdclass={'build_py': BuildPyWithGeneratedData},
     install_requires=["reportlab>=3.4.0",
                       "Pillow>=4.1.0"],
+    extras_require={"incremental": ["pdfrw"]},
     setup_requires=["pytest-runner"],
-    tests_require=["pytest", "pytest-flake8", "six"],
+    tests_require=["pytest", "pytest-flake8", "six", "pdfrw"],
     url='http://domtabs.sandflea.org',
     include_package_data=True,
     author="Peter Gorniak",